@@ -1,6 +1,17 @@
-from tasks import AbstractTask, ClusterTask, NullTask, STATUS_PENDING, STATUS_FINISH, STATUS_FATAL, STATUS_IGNORED, FatalException, CycleException
+from tasks import AbstractTask, ClusterTask, NullTask, add_edges, invalidate, Workflow, current_workflow, STATUS_PENDING, STATUS_RUNNING, STATUS_FINISH, STATUS_FATAL, STATUS_IGNORED, FatalException, CycleException
 from orm import OrmTask, OrmCreatorTask, RemapTask
 from files import FileTask
 from regex import RegexTask
+from uge import UGE
+from runner import Runner
+from executor import LocalExecutor
+from cache import ResultCache
+from modules import ModuleCache
 
 
+from template import Template
+from resources import ResourceBudget
+from history import RuntimeHistory
+from timing import Timings
+from loader import WorkflowLoader
+from shell import ShellPool
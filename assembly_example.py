@@ -49,17 +49,23 @@ trim = ClusterTask("FASTX Trim",
 		  
 #files in content fields are made available as the field name
 #Files as non-field attachments aren't supplied to the workflow engine.
+#
+#cores and mem (in GB) are what each job is submitted asking for, so a Runner
+#with a ResourceBudget can pack jobs into your allocation; {cores} is available
+#to the command, too.
 assemble_one = ClusterTask("SPAdes assembler (single-end)",
-						 """spades.py -1 {cntn_fk_file} -t 8""",
-						    modules=spades_module)
+						 """spades.py -1 {cntn_fk_file} -t {cores}""",
+						    modules=spades_module,
+						    cores=8, mem=32)
 		  
 #and as the names defined in gov.fda.cfsan.slims.util.Meta
 assemble_pair = ClusterTask("SPAdes assembler (paired-end miseq)", 
 						  """spades.py -1 {SEQ_MISEQ_FORWARD} 
 									   -2 {SEQ_MISEQ_REVERSE} 
 									   -o {output}
-									   -t 8""",
-						    modules=spades_module)
+									   -t {cores}""",
+						    modules=spades_module,
+						    cores=8, mem=32)
 									   
 
 #the engine takes out tabs and linefeeds in commands, so commands can be written in
@@ -73,9 +79,10 @@ assemble_eight = ClusterTask("SPades assembler (paired-end nextseq)",
 										-pe1-2 {SEQ_NEXTSEQ_REVERSE3}
 										-pe1-1 {SEQ_NEXTSEQ_FORWARD4}
 										-pe1-2 {SEQ_NEXTSEQ_REVERSE4}
-										-t 32
+										-t {cores}
 						   				-o {output}""",
-						    modules=spades_module)
+						    modules=spades_module,
+						    cores=32, mem=128)
 
 
 #The constructor makes any extra keywords available to your command		   
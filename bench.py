@@ -0,0 +1,170 @@
+import argparse
+import json
+import math
+import platform
+import random
+import sys
+import time
+from timeit import default_timer as clock
+from tasks import ClusterTask, Workflow, _below, STATUS_PENDING
+
+SIZES = (10, 100, 1000, 10000, 100000)
+BUDGET = 60.0 #seconds a shape may be projected to take at the next size
+
+
+def _task(n):
+	return ClusterTask("Task {}".format(n), "process --sample {{sample}} --in {{input}} --out {{output}}/{}".format(n), file_filter=('*.fasta', '*.fq.gz'))
+
+
+def _link(child, parent):
+	"Every edge carries a condition, so delivery evaluates one; it always holds."
+	child.follows(parent).when(lambda sample, **k: sample is not None)
+
+
+def fan_out(n):
+	"A root with n - 1 children."
+	root = _task(0)
+	for i in range(1, n):
+		_link(_task(i), root)
+	return root
+
+
+def chain(n):
+	"n tasks one after the other."
+	root = parent = _task(0)
+	for i in range(1, n):
+		child = _task(i)
+		_link(child, parent)
+		parent = child
+	return root
+
+
+def diamonds(n, width=8):
+	"Diamonds stacked end to end: each fans out to width tasks that all join again."
+	root = top = _task(0)
+	i = 1
+	while i < n:
+		middle = [_task(j) for j in range(i, min(i + width, n))]
+		[_link(t, top) for t in middle]
+		i += len(middle)
+		if i < n:
+			top = _task(i)
+			[_link(top, t) for t in middle]
+			i += 1
+	return root
+
+
+def layered(n, width=None, degree=3, seed=0):
+	"Random layers of about sqrt(n) tasks, each with up to degree parents from the layer above."
+	rand = random.Random(seed)
+	width = width or max(int(n ** 0.5), 1)
+	root = _task(0)
+	above, i = [root], 1
+	while i < n:
+		layer = [_task(j) for j in range(i, min(i + width, n))]
+		for t in layer:
+			[_link(t, p) for p in rand.sample(above, min(degree, len(above)))]
+		above, i = layer, i + len(layer)
+	return root
+
+
+SHAPES = dict(fan_out=fan_out, chain=chain, diamonds=diamonds, layered=layered)
+
+
+def drive(root, stdout='ok\n', files=('sample.fasta',)):
+	"Run a workflow to the end without running anything; returns the seconds spent polling and finalizing."
+	polling = finalizing = 0.0
+	while True:
+		t = clock()
+		ready = [task for task in root.__get_next__() if task.status == STATUS_PENDING]
+		polling += clock() - t
+		if not ready:
+			return polling, finalizing
+		t = clock()
+		[task.__finalize__(None, stdout, list(files), ('sample', 0)) for task in ready]
+		finalizing += clock() - t
+
+
+def measure(shape, n):
+	"Time each core operation over one generated graph."
+	timings = dict()
+	with Workflow():
+		t = clock()
+		root = SHAPES[shape](n)
+		timings['follows'] = clock() - t
+	tasks = sorted(_below(root), key=lambda task: task.__order__)
+	edges = sum([len(task.__children__) for task in tasks])
+
+	t = clock()
+	for i, task in enumerate(tasks):
+		bound = {'sample': i}
+		[cond.evaluate(bound) for cond in task.__conditionals__.values()]
+	timings['conditions'] = clock() - t
+
+	t = clock()
+	ser = root.__serialize__()
+	timings['serialize'] = clock() - t
+	t = clock()
+	root.__deserialize__(ser)
+	timings['deserialize'] = clock() - t
+
+	timings['get_next'], timings['finalize'] = drive(root)
+
+	t = clock()
+	[task.start(output='/scratch', sample=i) for i, task in enumerate(tasks)]
+	timings['start'] = clock() - t
+
+	files = ['/data/sample_{}.{}'.format(i, ('fasta', 'fq.gz', 'bam')[i % 3]) for i in range(n * 10)]
+	sink = _task(n)
+	t = clock()
+	sink.__preload_files__(files)
+	timings['preload_files'] = clock() - t
+
+	return [dict(shape=shape, size=n, tasks=len(tasks), edges=edges, operation=op, seconds=s) for op, s in sorted(timings.items())]
+
+
+def projected(history, n):
+	"Seconds a shape should take at size n, from how its total grew over the sizes already measured."
+	if not history:
+		return 0.0
+	n1, t1 = history[-1]
+	growth = 1.0
+	if len(history) > 1 and history[-2][1] > 0 and n1 > history[-2][0]:
+		n0, t0 = history[-2]
+		growth = max(math.log(t1 / t0) / math.log(float(n1) / n0), 1.0)
+	return t1 * (float(n) / n1) ** growth
+
+
+def run(shapes=sorted(SHAPES), sizes=SIZES, budget=BUDGET):
+	"Measure every shape at every size, smallest first, skipping sizes a shape is projected to take more than budget seconds at."
+	results, skipped, history = [], [], dict()
+	for n in sorted(sizes):
+		for shape in shapes:
+			seen = history.setdefault(shape, [])
+			estimate = projected(seen, n)
+			if estimate > budget:
+				skipped.append(dict(shape=shape, size=n, projected=estimate))
+				continue
+			measured = measure(shape, n)
+			seen.append((n, sum([r['seconds'] for r in measured])))
+			results.extend(measured)
+	return dict(python=platform.python_version(), started=time.time(), budget=budget, results=results, skipped=skipped)
+
+
+def main(argv):
+	parser = argparse.ArgumentParser(prog='dag-tool.py bench', description="Time the workflow engine over synthetic graphs; JSON results go to stdout.")
+	parser.add_argument('--shapes', default=','.join(sorted(SHAPES)), help="comma-separated, from: {}".format(', '.join(sorted(SHAPES))))
+	parser.add_argument('--sizes', default=','.join([str(n) for n in SIZES]), help="comma-separated task counts")
+	parser.add_argument('--budget', type=float, default=BUDGET, help="skip sizes a shape is projected to take longer than this many seconds at")
+	parser.add_argument('--output', default=None, help="write results here instead of stdout")
+	args = parser.parse_args(argv)
+	shapes = args.shapes.split(',')
+	for shape in shapes:
+		if shape not in SHAPES:
+			parser.error("unknown shape '{}'".format(shape))
+	results = run(shapes, [int(n) for n in args.sizes.split(',')], args.budget)
+	out = open(args.output, 'w') if args.output else sys.stdout
+	json.dump(results, out, indent=2, sort_keys=True)
+	out.write('\n')
+	if args.output:
+		out.close()
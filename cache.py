@@ -0,0 +1,124 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+from files import digest
+
+
+class ResultCache(object):
+	"""
+	Content-addressed store of finished ClusterTask results on local disk.
+
+	A task's key hashes its run command, modules, bound params and termargs, and
+	the names and contents of its input files, so a resubmitted workflow whose
+	inputs haven't changed can skip straight past it. An entry holds the task's
+	stdout and a copy of whatever it wrote to its {output} directory. Entries not
+	used in max_age seconds are dropped, then the least recently used ones until
+	the store fits in max_bytes. An index of the entries' sizes and last use is
+	read from disk once and kept current, so a put that leaves the store within
+	its limits doesn't list it again; the store is only re-read to evict.
+	"""
+
+	def __init__(self, path, max_bytes=100 << 30, max_age=30 * 24 * 3600):
+		self.path = path
+		self.max_bytes = max_bytes
+		self.max_age = max_age
+		self.hits = 0
+		self.misses = 0
+		self.index = None #key -> [last used, size]
+		if not os.path.isdir(path):
+			os.makedirs(path)
+
+	def key(self, task):
+		"Hash of everything that goes into a task's commands; None if it doesn't run any."
+		if not getattr(task, 'run_command', None):
+			return None
+		kwargs = task.__bind__(task.termargs)
+		kwargs.pop('output', None) #a fresh directory every run
+		inputs = [(os.path.basename(f), digest(f)) for f in task.input_files]
+		described = [task.run_command, list(task.modules), sorted([(k, repr(v)) for k, v in kwargs.items()]),
+					 bool(getattr(task, 'array', False)), getattr(task, 'chunk_size', 1), inputs]
+		return hashlib.sha256(json.dumps(described, sort_keys=True).encode('utf-8')).hexdigest()
+
+	def __entry__(self, key):
+		return os.path.join(self.path, key)
+
+	def __index__(self):
+		if self.index is None:
+			self.index = dict((key, [used, size]) for used, size, key in self.entries())
+		return self.index
+
+	def get(self, key, output_dir=None):
+		"The stdout cached under key, with its files copied into output_dir; None on a miss."
+		meta = os.path.join(self.__entry__(key), 'meta.json')
+		try:
+			with open(meta) as f:
+				entry = json.load(f)
+			if output_dir is not None:
+				for rel in entry['files']:
+					target = os.path.join(output_dir, rel)
+					if not os.path.isdir(os.path.dirname(target)):
+						os.makedirs(os.path.dirname(target))
+					shutil.copy2(os.path.join(self.__entry__(key), 'files', rel), target)
+			os.utime(meta, None) #last used
+		except (IOError, OSError, ValueError): #missing, evicted mid-read, or torn
+			self.misses += 1
+			return None
+		self.__index__()[key] = [time.time(), entry['size']]
+		self.hits += 1
+		return entry['stdout']
+
+	def put(self, key, stdout, output_dir=None):
+		"Record a task's result; a concurrent put of the same key wins or loses whole."
+		staging = tempfile.mkdtemp(prefix='.', dir=self.path)
+		files, size = [], len(stdout)
+		if output_dir is not None:
+			for d, _, names in os.walk(output_dir):
+				for name in sorted(names):
+					rel = os.path.relpath(os.path.join(d, name), output_dir)
+					target = os.path.join(staging, 'files', rel)
+					if not os.path.isdir(os.path.dirname(target)):
+						os.makedirs(os.path.dirname(target))
+					shutil.copy2(os.path.join(d, name), target)
+					files.append(rel)
+					size += os.path.getsize(target)
+		with open(os.path.join(staging, 'meta.json'), 'w') as f:
+			json.dump({'stdout': stdout, 'files': files, 'size': size}, f)
+		try:
+			os.rename(staging, self.__entry__(key))
+			self.__index__()[key] = [time.time(), size]
+		except OSError: #already cached
+			shutil.rmtree(staging, ignore_errors=True)
+		self.evict()
+
+	def entries(self):
+		"(last used, size, key) for every entry, least recently used first."
+		found = []
+		for key in os.listdir(self.path):
+			meta = os.path.join(self.__entry__(key), 'meta.json')
+			if key.startswith('.') or not os.path.exists(meta):
+				continue
+			try:
+				with open(meta) as f:
+					found.append((os.path.getmtime(meta), json.load(f)['size'], key))
+			except (IOError, OSError, ValueError):
+				continue
+		return sorted(found)
+
+	def evict(self, now=None):
+		"Drop entries past max_age, then the least recently used until the rest fit in max_bytes."
+		now = time.time() if now is None else now
+		index = self.__index__()
+		if sum([size for _, size in index.values()]) <= self.max_bytes and now - min([used for used, _ in index.values()] or [now]) <= self.max_age:
+			return
+		entries = self.entries() #other processes may have used or added entries since
+		self.index = dict((key, [used, size]) for used, size, key in entries)
+		total = sum([size for _, size, _ in entries])
+		for used, size, key in entries:
+			if now - used <= self.max_age and total <= self.max_bytes:
+				break
+			shutil.rmtree(self.__entry__(key), ignore_errors=True)
+			del self.index[key]
+			total -= size
@@ -3,9 +3,20 @@ import os, os.path
 
 usage = """
 DAG workflow verification tool v 0.01
+
+dag-tool.py <workflow.py>        print the workflow description as markdown
+dag-tool.py bench [--help]       time the workflow engine over synthetic graphs, as JSON
 """
 
 
+if sys.argv[1:2] == ['bench']:
+	try:
+		from dag_core import bench
+	except ImportError: #run from inside the package directory
+		import bench
+	bench.main(sys.argv[2:])
+	quit()
+
 try:
 	dag_file = os.path.abspath(sys.argv[1])
 except IndexError:
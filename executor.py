@@ -0,0 +1,60 @@
+import subprocess
+import tempfile
+from runner import Backend, Runner
+
+
+class LocalBackend(Backend):
+	"Runs commands as shell processes on this machine. Output goes to temporary files, so polling never blocks."
+
+	def launch(self, task, command):
+		out, err = tempfile.TemporaryFile(mode='w+'), tempfile.TemporaryFile(mode='w+')
+		return subprocess.Popen(command, shell=True, stdout=out, stderr=err, universal_newlines=True), out, err
+
+	def poll(self, handles):
+		finished = dict()
+		for handle in handles:
+			proc, out, err = handle
+			if proc.poll() is not None:
+				out.seek(0)
+				err.seek(0)
+				finished[handle] = (proc.returncode, out.read(), err.read())
+				out.close()
+				err.close()
+		return finished
+
+	def cancel(self, handle):
+		proc, out, err = handle
+		if proc.poll() is None:
+			proc.kill()
+			proc.wait()
+		out.close()
+		err.close()
+
+
+class LocalExecutor(object):
+	"""
+	Runs a workflow's commands on this machine, at most max_workers at a time, in
+	whatever order the ready set allows. Each task's stdout is handed on to its
+	children as their stdin, where stdout() hooks like RegexTask's see it.
+
+	For development, CI and small single-node deployments.
+	"""
+
+	def __init__(self, max_workers=4, scratch=None, record=None, interval=0.01, cache=None, module_cache=None, history=None, budget=None, max_interval=0.5):
+		self.max_workers = max_workers
+		self.scratch = scratch #where {output} directories are made
+		self.record = record
+		self.interval = interval
+		self.max_interval = max_interval #local processes are cheap to check on; don't back off as far as for a cluster
+		self.cache = cache #a ResultCache, to skip tasks that have already run
+		self.module_cache = module_cache #a ModuleCache, to load each module set once
+		self.history = history #a RuntimeHistory, to start the longest branches first
+		self.budget = budget #a ResourceBudget, to keep jobs within this machine's cores and memory
+
+	def run(self, root):
+		"Run the workflow below root to completion. Raises FatalException if a task fails."
+		runner = Runner(LocalBackend(), max_jobs=self.max_workers, interval=self.interval, max_interval=self.max_interval, scratch=self.scratch, cache=self.cache, module_cache=self.module_cache, history=self.history, budget=self.budget)
+		runner.add(root, self.record).run()
+		if root in runner.failed:
+			raise runner.failed[root]
+		return root
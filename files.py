@@ -1,4 +1,49 @@
 from tasks import AbstractTask
+from collections import OrderedDict
+from threading import Lock
+import hashlib
+import os
+
+_digests = OrderedDict() #(path, size, mtime) -> digest, least recently used first
+_digests_lock = Lock()
+_MAX_DIGESTS = 1 << 14
+
+
+def digest(path, block_size=1 << 20):
+	"sha256 of a file's contents, remembered (for the last _MAX_DIGESTS files) as long as its size and mtime don't change."
+	stat = os.stat(path)
+	memo = (os.path.abspath(path), stat.st_size, stat.st_mtime)
+	with _digests_lock:
+		found = _digests.pop(memo, None)
+		if found is not None:
+			_digests[memo] = found #most recently used
+			return found
+	sha = hashlib.sha256()
+	with open(path, 'rb') as f:
+		for block in iter(lambda: f.read(block_size), b''):
+			sha.update(block)
+	with _digests_lock:
+		_digests[memo] = found = sha.hexdigest()
+		while len(_digests) > _MAX_DIGESTS:
+			_digests.popitem(last=False)
+	return found
+
 
 class FileTask(AbstractTask):
-	pass
\ No newline at end of file
+	"""
+	Brings files already on disk into a workflow. Starting it checks that they're
+	all there and records their content digests, then passes them on to children.
+	"""
+
+	def __init__(self, name, paths=(), **kwargs):
+		super(FileTask, self).__init__(name, **kwargs)
+		self.input_files = list(paths)
+		self.digests = dict()
+
+	def start(self, **kwargs):
+		missing = [p for p in self.input_files if not os.path.isfile(p)]
+		if missing:
+			self.__setFatal__("missing input files: {}".format(', '.join(missing)))
+			return None
+		self.digests = dict([(p, digest(p)) for p in self.input_files])
+		return None
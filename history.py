@@ -0,0 +1,77 @@
+import json
+import os
+from tasks import _below
+
+
+def _median(values):
+	values = sorted(values)
+	middle = len(values) // 2
+	return values[middle] if len(values) % 2 else (values[middle - 1] + values[middle]) / 2.0
+
+
+def input_size(task):
+	"Total bytes of a task's input files; ones that aren't there count for nothing."
+	size = 0
+	for path in task.input_files:
+		try:
+			size += os.path.getsize(path)
+		except OSError:
+			pass
+	return size
+
+
+class RuntimeHistory(object):
+	"""
+	How long each task's commands took in past runs, by slug and input size, kept
+	in a JSON file at path. A Runner given one records into it, and starts ready
+	tasks in order of the longest estimated path from each to the end of its
+	workflow, so long branches aren't left queued behind short jobs.
+
+	A task's estimate is the median of its last keep runs, each scaled by how its
+	input size compares; tasks never seen before are assumed to take default
+	seconds, and tasks that don't run commands none.
+	"""
+
+	def __init__(self, path=None, default=60.0, keep=20):
+		self.path = path
+		self.default = default
+		self.keep = keep
+		self.samples = dict() #slug -> [[input bytes, seconds], ...], oldest first
+		if path is not None and os.path.exists(path):
+			try:
+				with open(path) as f:
+					self.samples = json.load(f)
+			except ValueError: #torn; start over
+				pass
+
+	def record(self, task, seconds, size=None):
+		size = input_size(task) if size is None else size
+		samples = self.samples.setdefault(task.slug, [])
+		samples.append([size, seconds])
+		del samples[:-self.keep]
+
+	def estimate(self, task, size=None):
+		"Seconds a task's commands should take, given its input size if known."
+		if not getattr(task, 'run_command', None):
+			return 0.0
+		samples = self.samples.get(task.slug)
+		if not samples:
+			return self.default
+		if size:
+			return _median([seconds * size / float(was) if was else seconds for was, seconds in samples])
+		return _median([seconds for was, seconds in samples])
+
+	def priorities(self, root):
+		"The longest estimated path from each task below root to the end of the workflow, itself included."
+		longest = dict()
+		for t in sorted(_below(root), key=lambda t: t.__order__, reverse=True): #children first
+			longest[t] = self.estimate(t) + max([longest[c] for c in t.__children__ if c in longest] or [0.0])
+		return longest
+
+	def save(self):
+		if self.path is None:
+			return
+		staging = '{}.{}'.format(self.path, os.getpid())
+		with open(staging, 'w') as f:
+			json.dump(self.samples, f, sort_keys=True)
+		os.rename(staging, self.path)
@@ -0,0 +1,144 @@
+import json
+import os
+from numbers import Number
+from tasks import Termargs, _layer_ids
+
+_REFERENCES = ('passed', 'handoff') #recorded by reference: a termargs layer's number, and a digest with its files
+
+
+def _scalar(value):
+	return value is None or isinstance(value, (Number, str, type(u'')))
+
+def _fields(task):
+	"The fields the journal records for a task: its scalar state, and its references."
+	fields = dict()
+	for k, v in task.__dict__.items():
+		if '__' in k or k in task.__definition__:
+			continue
+		if k in _REFERENCES or (_scalar(v) and k != 'stdin'):
+			fields[k] = v
+	return fields
+
+def _dumps(value):
+	return json.dumps(value, ensure_ascii=True, separators=(',', ':'), default=list) #termargs are written out flat
+
+
+class Journal(object):
+	"""
+	Append-only persistence for a workflow's state.
+
+	The file starts with a compact snapshot of the whole graph, followed by one
+	[task key, field, value] record per changed scalar field - status, job_id,
+	fingerprint and the like. What a task passes on is recorded by reference:
+	'passed' as the number of a termargs layer, each layer written once as a
+	['~termargs', number, [args, parent numbers]] record, and 'handoff' as the
+	digest of its output, written once as a ['~outputs', digest, stdout] record.
+	A child's stdin, termargs and input files aren't recorded at all; replay hands
+	them on again from the parents that finished. Tasks mark themselves dirty when
+	their status changes, and flush() appends records for just those tasks, so
+	each event costs O(1) in the size of the graph. Every compact_every records
+	the file is rewritten as a snapshot.
+	"""
+
+	def __init__(self, root, path, compact_every=1000):
+		self.root = root
+		self.path = path
+		self.compact_every = compact_every
+		self.records = 0
+		self.dirty = set()
+		self.written = dict()
+		self.layers = dict() #id -> (number, layer) of the termargs layers written since the snapshot
+		self.outputs = set() #digests of the outputs written
+		self.tasks = root.__tasks__()
+		self.keys = dict((t, key) for key, t in self.tasks.items())
+		for t in self.tasks.values():
+			t.__journal__ = self
+
+	def mark(self, task):
+		"Note a task whose persisted fields may have changed."
+		self.dirty.add(task)
+
+	def __remember__(self):
+		self.written = dict((key, dict((k, v if k == 'passed' else _dumps(v)) for k, v in _fields(t).items())) for key, t in self.tasks.items())
+		self.layers = dict()
+		self.outputs = set(self.root.__workflow__.outputs)
+		self.dirty.clear()
+
+	def __passed__(self, termargs, lines):
+		"The number of a task's passed termargs, with a record for each layer under it that's new to the journal."
+		known = len(self.layers)
+		n = _layer_ids(termargs, self.layers)
+		for m, layer in sorted(self.layers.values(), key=lambda l: l[0])[known:]:
+			lines.append('["~termargs",{},{}]\n'.format(m, _dumps([layer.args, [self.layers[id(p)][0] for p in layer.parents]])))
+		return n
+
+	def flush(self):
+		"Append a record for every changed field of the dirty tasks."
+		if not os.path.exists(self.path):
+			return self.compact()
+		lines = []
+		for t in self.dirty:
+			key = self.keys[t]
+			written = self.written.setdefault(key, dict())
+			for field, value in _fields(t).items():
+				if field == 'passed':
+					if value is written.get(field):
+						continue
+					written[field] = value
+					value = _dumps(value if value is None else self.__passed__(value, lines))
+				else:
+					value = _dumps(value)
+					if written.get(field) == value:
+						continue
+					written[field] = value
+					if field == 'handoff' and t.handoff is not None and t.handoff[0] not in self.outputs:
+						self.outputs.add(t.handoff[0])
+						lines.append('["~outputs",{},{}]\n'.format(_dumps(t.handoff[0]), _dumps(t.__workflow__.outputs[t.handoff[0]])))
+				lines.append('[{},{},{}]\n'.format(_dumps(key), _dumps(field), value))
+		self.dirty.clear()
+		if lines:
+			with open(self.path, 'a') as journal:
+				journal.writelines(lines)
+			self.records += len(lines)
+			if self.records >= self.compact_every:
+				self.compact()
+		return self
+
+	def compact(self):
+		"Replace the journal with a single snapshot of the current state."
+		snapshot = _dumps(self.root.__to_flat__())
+		with open(self.path + '.tmp', 'w') as journal:
+			journal.write(snapshot + '\n')
+		os.rename(self.path + '.tmp', self.path)
+		self.records = 0
+		self.__remember__()
+		return self
+
+	def replay(self):
+		"Restore the snapshot as __deserialize__ does, apply each record in order, then hand on what was handed off since."
+		layers, handed = dict(), []
+		with open(self.path) as journal:
+			self.root.__deserialize__(journal.readline())
+			self.records = 0
+			for line in journal:
+				if not line.endswith('\n'):
+					break #torn write at the end of the journal
+				key, field, value = json.loads(line)
+				self.records += 1
+				if key == '~outputs':
+					self.root.__workflow__.outputs[field] = value
+				elif key == '~termargs':
+					args, parents = value
+					layers[field] = Termargs(args, [layers[p] for p in parents])
+				else:
+					t = self.tasks[key]
+					if field == 'passed' and value is not None:
+						value = layers[value]
+					setattr(t, field, value)
+					if field == 'handoff':
+						handed = [h for h in handed if h is not t] + [t]
+		for t in handed:
+			if t.handoff is not None:
+				t.__deliver__(t.__children__, *t.__handoff__())
+		self.__remember__()
+		return self.root
@@ -0,0 +1,218 @@
+import cPickle
+import hashlib
+import marshal
+import os
+import sys
+import tempfile
+import types
+from collections import OrderedDict
+from glob import glob
+from tasks import Workflow
+from template import Template
+
+_FORMAT = '2' #bump when what's pickled changes shape
+_PACKAGE = os.path.dirname(os.path.abspath(__file__))
+
+
+def _stamps(paths):
+	"[path, size, mtime] of each file, sorted; a missing one is stamped with Nones."
+	stamps = []
+	for path in sorted(set(paths)):
+		try:
+			stat = os.stat(path)
+			stamps.append([path, stat.st_size, stat.st_mtime])
+		except OSError:
+			stamps.append([path, None, None])
+	return stamps
+
+def _stale(stamps):
+	return _stamps([path for path, _, _ in stamps]) != stamps
+
+def _dependencies(namespace, template):
+	"Source files of the modules a description imports from, or defines its tasks' classes in."
+	names = set([type(t).__module__ for t in template.tasks])
+	for value in namespace.values():
+		names.add(value.__name__ if isinstance(value, types.ModuleType) else getattr(value, '__module__', None))
+	paths = []
+	for name in names:
+		path = getattr(sys.modules.get(name) if isinstance(name, str) else None, '__file__', None)
+		if path is not None and not os.path.abspath(path).startswith(_PACKAGE + os.sep): #the key covers dag_core itself
+			paths.append(path[:-1] if path.endswith(('.pyc', '.pyo')) else path)
+	return _stamps(paths)
+
+
+def _importable(func):
+	return getattr(sys.modules.get(func.__module__), func.__name__, None) is func
+
+
+def _cell(value):
+	return (lambda: value).__closure__[0]
+
+
+class _Packer(object):
+	"""
+	Pickles a compiled workflow. The lambdas, closures and bound methods a workflow
+	description is full of go as marshalled code plus whatever they close over;
+	workflows and modules go by reference.
+	"""
+
+	def __init__(self, f):
+		self.pickler = cPickle.Pickler(f, 2)
+		self.pickler.persistent_id = self.persistent_id
+		self.namespaces = dict()
+		self.functions = dict() #persistent ids aren't memoized, so pickle each function's parts once
+
+	def namespace(self, g):
+		"A module's globals by name; a workflow file's own globals, once, as a dict."
+		name = g.get('__name__')
+		if getattr(sys.modules.get(name), '__dict__', None) is g:
+			return name
+		if id(g) not in self.namespaces:
+			self.namespaces[id(g)] = (g, dict([(k, v) for k, v in g.items() if k != '__builtins__']))
+		return self.namespaces[id(g)][1]
+
+	def persistent_id(self, obj):
+		if isinstance(obj, Workflow):
+			return ('workflow',)
+		if isinstance(obj, types.ModuleType):
+			return ('module', obj.__name__)
+		if isinstance(obj, types.FunctionType) and not _importable(obj):
+			if id(obj) not in self.functions:
+				closure = tuple([c.cell_contents for c in obj.__closure__ or ()])
+				parts = (marshal.dumps(obj.__code__), self.namespace(obj.__globals__), obj.__name__, obj.__defaults__, closure)
+				self.functions[id(obj)] = (obj, parts)
+			return ('function', self.functions[id(obj)][1])
+		if isinstance(obj, (types.MethodType, types.BuiltinMethodType)) and getattr(obj, '__self__', None) is not None \
+		   and not isinstance(obj.__self__, types.ModuleType):
+			return ('method', obj.__self__, obj.__name__)
+		return None
+
+	def dump(self, template):
+		self.pickler.dump(template)
+
+
+class _Unpacker(object):
+
+	def __init__(self, f):
+		self.unpickler = cPickle.Unpickler(f)
+		self.unpickler.persistent_load = self.persistent_load
+		self.workflow = Workflow()
+		self.functions = dict()
+
+	def persistent_load(self, pid):
+		kind = pid[0]
+		if kind == 'workflow':
+			return self.workflow
+		if kind == 'module':
+			__import__(pid[1])
+			return sys.modules[pid[1]]
+		if kind == 'function':
+			parts = pid[1]
+			if id(parts) not in self.functions:
+				code, g, name, defaults, closure = parts
+				if isinstance(g, str):
+					__import__(g)
+					g = sys.modules[g].__dict__
+				else:
+					g.setdefault('__builtins__', __builtins__)
+				func = types.FunctionType(marshal.loads(code), g, name, defaults, tuple([_cell(v) for v in closure]) or None)
+				self.functions[id(parts)] = (parts, func)
+			return self.functions[id(parts)][1]
+		if kind == 'method':
+			return getattr(pid[1], pid[2])
+		raise cPickle.UnpicklingError("Unknown persistent id '{}'.".format(kind))
+
+	def load(self):
+		template = self.unpickler.load()
+		self.workflow.root = template.tasks[0]
+		for t in template.tasks: #in the order they were compiled in
+			t.__order__ = self.workflow.next_id()
+		return template
+
+
+class WorkflowLoader(object):
+	"""
+	Loads workflow description files, evaluating each one only once. The graph a file
+	builds is compiled into a Template and kept in memory and, if path is given,
+	pickled to disk under a hash of the file's contents and of dag_core's own source
+	files, so later loads - in this process or a fresh one - skip running the
+	description at all. Each compiled workflow also notes the size and mtime of the
+	modules the description imported; editing the file, dag_core, or any of those
+	modules means the next load evaluates it again. The max_compiled most recently
+	used workflows are kept in memory.
+
+	Descriptions whose graphs can't be pickled (a task class defined in the file
+	itself, say) still load; they're just evaluated every time in a new process.
+	"""
+
+	def __init__(self, path=None, max_compiled=64):
+		self.path = path
+		self.max_compiled = max_compiled
+		self.compiled = OrderedDict() #key -> (dependency stamps, Template), least recently used first
+		self.hits = 0
+		self.misses = 0
+		if path is not None and not os.path.isdir(path):
+			os.makedirs(path)
+
+	def key(self, source):
+		package = repr(_stamps(glob(os.path.join(_PACKAGE, '*.py'))))
+		return hashlib.sha256(_FORMAT + sys.version + package + source).hexdigest()
+
+	def __entry__(self, key):
+		return os.path.join(self.path, key + '.pickle')
+
+	def load(self, filename):
+		"The compiled workflow a description file defines; its root is template.tasks[0]."
+		with open(filename, 'rb') as f:
+			source = f.read()
+		key = self.key(source)
+		compiled = self.compiled.pop(key, None)
+		if compiled is None or _stale(compiled[0]):
+			compiled = self.__read__(key)
+		if compiled is None:
+			self.misses += 1
+			compiled = self.__evaluate__(filename, source)
+			self.__write__(key, compiled)
+		else:
+			self.hits += 1
+		self.compiled[key] = compiled
+		while len(self.compiled) > self.max_compiled:
+			self.compiled.popitem(last=False)
+		return compiled[1]
+
+	def __evaluate__(self, filename, source):
+		namespace = {'__name__': '__workflow__', '__file__': filename}
+		with Workflow() as workflow:
+			exec compile(source, filename, 'exec') in namespace
+		if workflow.root is None:
+			raise ValueError("Workflow description '{}' doesn't define any tasks.".format(filename))
+		template = Template(workflow.root)
+		return _dependencies(namespace, template), template
+
+	def __read__(self, key):
+		if self.path is None:
+			return None
+		try:
+			with open(self.__entry__(key), 'rb') as f:
+				stamps = cPickle.load(f)
+				if _stale(stamps):
+					return None
+				return stamps, _Unpacker(f).load()
+		except Exception: #missing, torn, or pickled by an incompatible version
+			return None
+
+	def __write__(self, key, compiled):
+		"Pickle a compiled workflow after its dependency stamps; a concurrent write of the same key wins or loses whole."
+		if self.path is None:
+			return False
+		stamps, template = compiled
+		fd, staging = tempfile.mkstemp(prefix='.', dir=self.path)
+		try:
+			with os.fdopen(fd, 'wb') as f:
+				cPickle.dump(stamps, f, 2)
+				_Packer(f).dump(template)
+			os.rename(staging, self.__entry__(key))
+		except Exception: #something in the graph won't pickle
+			os.remove(staging)
+			return False
+		return True
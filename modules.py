@@ -0,0 +1,91 @@
+import hashlib
+import json
+import os
+import subprocess
+from tasks import module_sets
+
+try:
+	from pipes import quote
+except ImportError:
+	from shlex import quote
+
+_VOLATILE = ('_', 'PWD', 'OLDPWD', 'SHLVL') #differ between shells, not between module sets
+
+
+class ModuleCache(object):
+	"""
+	Loads each distinct set of environment modules once, and saves the environment
+	it produces as a script under path. A ClusterTask given the cache starts its
+	commands by sourcing that snapshot instead of running 'module load' again.
+
+	Snapshots are keyed by the module list and the size and mtime of the modulefiles
+	it resolves to on modulepath, so editing or installing a modulefile makes a new
+	one. init is shell code that defines 'module', if the shell doesn't already.
+	"""
+
+	def __init__(self, path, init=None, modulepath=None, shell='/bin/sh'):
+		self.path = path
+		self.init = init
+		self.modulepath = modulepath if modulepath is not None else os.environ.get('MODULEPATH', '')
+		self.shell = shell
+		self.snapshots = dict() #key -> snapshot path, or None if loading failed
+		if not os.path.isdir(path):
+			os.makedirs(path)
+
+	def __modulefiles__(self, modules):
+		"(path, size, mtime) of every modulefile a module name could resolve to."
+		found = []
+		for d in [d for d in self.modulepath.split(':') if d]:
+			for module in modules:
+				candidate = os.path.join(d, module)
+				if os.path.isdir(candidate):
+					for root, _, files in os.walk(candidate):
+						found.extend([os.path.join(root, f) for f in sorted(files)])
+				elif os.path.isfile(candidate):
+					found.append(candidate)
+		return [(f, os.path.getsize(f), os.path.getmtime(f)) for f in found]
+
+	def key(self, modules):
+		return hashlib.sha256(json.dumps([list(modules), self.__modulefiles__(modules)]).encode('utf-8')).hexdigest()
+
+	def __env__(self, modules):
+		script = [self.init] if self.init else []
+		script.extend(['module load {} || exit 1'.format(quote(m)) for m in modules])
+		script.append('env -0')
+		with open(os.devnull, 'w') as devnull:
+			out = subprocess.check_output([self.shell, '-c', '\n'.join(script)], stderr=devnull, universal_newlines=True)
+		return dict([line.split('=', 1) for line in out.split('\0') if '=' in line])
+
+	def snapshot(self, modules):
+		"Path to a script that recreates the environment these modules load; None if they don't load."
+		modules = tuple(modules)
+		key = self.key(modules) #stats the modulefiles again, so a long-lived cache notices edits too
+		if key not in self.snapshots:
+			target = os.path.join(self.path, key + '.sh')
+			if not os.path.exists(target):
+				try:
+					before, after = self.__env__(()), self.__env__(modules)
+				except (OSError, subprocess.CalledProcessError):
+					self.snapshots[key] = None
+					return None
+				lines = ['unset {}'.format(k) for k in sorted(before) if k not in after and k not in _VOLATILE]
+				lines.extend(['export {}={}'.format(k, quote(v)) for k, v in sorted(after.items()) if before.get(k) != v and k not in _VOLATILE])
+				staging = '{}.{}'.format(target, os.getpid())
+				with open(staging, 'w') as f:
+					f.write('\n'.join(lines) + '\n')
+				os.rename(staging, target)
+			self.snapshots[key] = target
+		return self.snapshots[key]
+
+	def prepare(self, root):
+		"Snapshot every module set the workflow below root uses, up front."
+		return dict([(modules, self.snapshot(modules)) for modules in module_sets(root)])
+
+	def prefix(self, modules):
+		"What a command should start with to have these modules loaded."
+		if not modules:
+			return ''
+		snapshot = self.snapshot(modules)
+		if snapshot is None: #let the job load them itself, and fail where it can be seen
+			return '; '.join(['module load {}'.format(m) for m in modules])
+		return '. {}'.format(quote(snapshot))
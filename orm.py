@@ -1,4 +1,13 @@
-from tasks import AbstractTask
+from tasks import AbstractTask, _below
+from contextlib import contextmanager
+from string import Formatter
+from threading import Lock
+import re
+
+try:
+	from Queue import Queue
+except ImportError:
+	from queue import Queue
 
 try:
 	from gov.fda.cfsan.slims.util.orm import Orm, RecordNotFoundException
@@ -6,6 +15,11 @@ try:
 except ImportError:
 	from tests.stubs import Orm, RecordNotFoundException, Meta
 
+try:
+	from gov.fda.cfsan.slims.util.orm import connect
+except ImportError:
+	connect = None #SessionPool needs one passed in
+
 
 class OrmShadow(object):
 	"dumb object to prevent accidental database changes"
@@ -18,9 +32,97 @@ class OrmShadow(object):
 				setattr(self, repr(field), path)
 
 
+def referenced_fields(task):
+	"Names the command templates and edge conditions at or below a task read; None if a condition could read anything."
+	fields = set()
+	for t in _below(task):
+		try:
+			names = [name for _, name, _, _ in Formatter().parse(getattr(t, 'run_command', '') or '') if name]
+		except ValueError: #not a template
+			names = []
+		fields.update([re.split(r'[.\[]', name)[0] for name in names])
+		for cond in t.__conditionals__.values():
+			if cond.keys is None:
+				return None
+			fields.update(cond.keys)
+	return fields - set(['input', 'output'])
+
+
+class SessionPool(object):
+	"Up to size ORM sessions, opened as they're needed and shared out one at a time."
+
+	def __init__(self, connect=connect, size=4):
+		if connect is None:
+			raise ValueError("The SLims ORM isn't importable here; pass SessionPool a connect function.")
+		self.connect = connect
+		self.size = size
+		self.opened = 0
+		self.idle = Queue()
+		self.lock = Lock()
+
+	@contextmanager
+	def session(self):
+		with self.lock:
+			if self.idle.empty() and self.opened < self.size:
+				self.opened += 1
+				self.idle.put(self.connect())
+		session = self.idle.get()
+		try:
+			yield session
+		finally:
+			self.idle.put(session)
+
+
+class _Batch(object):
+	"Records found together. The fields of all of them are loaded in one round trip, the first time any is read."
+
+	def __init__(self, pool, ids, fields):
+		self.pool = pool
+		self.ids = ids
+		self.fields = fields
+		self.values = None
+
+	def load(self):
+		if self.values is None:
+			with self.pool.session() as session:
+				self.values = session.fields(self.ids, self.fields)
+		return self.values
+
+
+class LazyShadow(object):
+	"Read-only stand-in for a record in a batch; only holds its id until a field is read."
+
+	__slots__ = ('id', 'batch')
+
+	def __init__(self, record_id, batch):
+		object.__setattr__(self, 'id', record_id)
+		object.__setattr__(self, 'batch', batch)
+
+	def __getattr__(self, name):
+		fields = self.batch.fields
+		if fields is not None and name not in fields:
+			raise AttributeError("'{}' isn't read by the workflow, so it isn't loaded".format(name))
+		try:
+			return self.batch.load()[self.id][name]
+		except KeyError:
+			raise AttributeError(name)
+
+	def __setattr__(self, name, value):
+		raise AttributeError("ORM shadows are read-only")
+
+	def __delattr__(self, name):
+		raise AttributeError("ORM shadows are read-only")
+
+	def items(self):
+		"The record's loaded fields, as termargs."
+		return sorted(self.batch.load()[self.id].items())
+
+
 class OrmTask(AbstractTask):
 	
-	def __init__(self, types, **kwargs):
+	__definition__ = AbstractTask.__definition__ + ('types', 'batch_size')
+	
+	def __init__(self, types, batch_size=500, pool=None, **kwargs):
 		super(OrmTask, self).__init__("ORM Task", **kwargs)
 		if isinstance(types, str):
 			self.types = (types,)
@@ -28,6 +130,34 @@ class OrmTask(AbstractTask):
 			self.types = types
 		else:
 			raise ValueError("Types parameter should be string or list of strings.")
+		self.batch_size = batch_size
+		self.__pool__ = pool
+		
+	def records(self):
+		"""
+		Bulk mode: every record of the task's types as a LazyShadow, found batch_size
+		at a time through a session pool. Only the fields the workflow's commands and
+		conditions read are loaded, a batch at once.
+
+		Nothing calls this for you. Compile the workflow once and start a run per
+		record, with the record's fields as the root's termargs:
+
+			template = Template(task)
+			runs = [template.run(*record.items()) for record in task.records()]
+		"""
+		if self.__pool__ is None:
+			self.__pool__ = SessionPool()
+		fields = referenced_fields(self)
+		offset = 0
+		while True:
+			with self.__pool__.session() as session:
+				ids = session.find(self.types, offset, self.batch_size)
+			batch = _Batch(self.__pool__, ids, fields)
+			for record_id in ids:
+				yield LazyShadow(record_id, batch)
+			if len(ids) < self.batch_size:
+				return
+			offset += len(ids)
 		
 	
 class OrmCreatorTask(AbstractTask):
@@ -38,6 +168,8 @@ class OrmCreatorTask(AbstractTask):
 
 class RemapTask(AbstractTask):
 	
+	__definition__ = AbstractTask.__definition__ + ('remap',)
+	
 	def __init__(self, name, exclude=False, **kwargs):
 		super(RemapTask, self).__init__(name)
 		self.remap = {}.update(kwargs)
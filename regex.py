@@ -1,23 +1,245 @@
-from tasks import AbstractTask, STATUS_FINISH, STATUS_FATAL
+from tasks import AbstractTask, STATUS_PENDING, STATUS_FINISH, STATUS_FATAL
+from functools import partial
 import re
 
+try:
+	_text = basestring
+except NameError: #python 3
+	_text = str
+
+
+def _number(value):
+	try:
+		return int(value)
+	except ValueError:
+		return float(value)
+
+
+class Aggregate(object):
+	"""
+	Folds one named group's values over every match: first, last, all, count, sum or
+	mean. Sum and mean skip values that don't parse as numbers, counting them in unparsed.
+	"""
+
+	modes = ('first', 'last', 'all', 'count', 'sum', 'mean')
+
+	def __init__(self, mode):
+		if mode not in self.modes:
+			raise ValueError("unknown aggregate '{}'; use one of {}".format(mode, ', '.join(self.modes)))
+		self.mode = mode
+		self.values = []
+		self.n = 0
+		self.total = 0
+		self.seen = None
+		self.unparsed = 0
+
+	def add(self, value):
+		if self.mode in ('sum', 'mean'):
+			try:
+				value = _number(value)
+			except ValueError: #e.g. 'cov_.' from a pattern looser than the data
+				self.unparsed += 1
+				return
+		self.n += 1
+		if self.mode == 'first' and self.n == 1 or self.mode == 'last':
+			self.seen = value
+		elif self.mode == 'all':
+			self.values.append(value)
+		elif self.mode in ('sum', 'mean'):
+			self.total += value
+
+	def result(self):
+		if self.mode == 'all':
+			return self.values
+		if self.mode == 'count':
+			return self.n
+		if self.mode == 'sum':
+			return self.total
+		if self.mode == 'mean':
+			return float(self.total) / self.n
+		return self.seen
+
+
+class _Collector(object):
+	"What one RegexTask keeps of the matches handed to it, until it's applied to the task."
+
+	def __init__(self, task):
+		self.task = task
+		self.first_only = task.aggregate is None
+		self.done = False
+		self.first = None
+		keys = sorted([key for key in task.regex.groupindex if 'default' not in key])
+		modes = task.aggregate if isinstance(task.aggregate, dict) else dict.fromkeys(keys, task.aggregate or 'first')
+		self.aggregates = [(key, Aggregate(modes.get(key, 'first'))) for key in keys]
+
+	def add(self, mtch):
+		if self.first_only:
+			self.first = mtch.groupdict()
+			self.done = True
+			return
+		self.first = self.first or {}
+		for key, agg in self.aggregates:
+			value = mtch.group(key)
+			if value is not None:
+				agg.add(value)
+
+	def apply(self):
+		task = self.task
+		if self.first is None:
+			if task.stop_miss:
+				task.status = STATUS_FATAL
+		elif self.first_only:
+			for key, value in self.first.items():
+				if 'default' not in key:
+					task.termargs.append((key, value))
+		else:
+			for key, agg in self.aggregates:
+				if agg.n or agg.mode == 'count':
+					task.termargs.append((key, agg.result()))
+
+
+_group_name = re.compile(r'(?<!\\)\(\?P<\w+>')
+_leading_flags = re.compile(r'^\(\?[iLmsux]+\)')
+_backreference = re.compile(r'\(\?P=|\\[1-9]')
+
+
+def _fusable(regexes):
+	"Patterns can share one scan if they agree on flags and don't refer back to their own groups."
+	return len(set([r.flags for r in regexes])) == 1 and not any([_backreference.search(r.pattern) for r in regexes])
+
+
+def _scan(regexes, chunks, overlap, collectors):
+	"""
+	One pass over a stream of chunks for any number of patterns, handing each
+	collector exactly the matches its own finditer would have found.
+
+	The patterns are joined into a single alternation to find the next place any
+	of them matches; each pattern is then tried anchored there, and every pattern
+	keeps its own cursor, so overlapping matches from different patterns all count.
+	A match is only taken once it ends before the last line break (or the last
+	overlap characters) read so far; the rest is carried into the next chunk, with
+	one character of context so ^, $, \\b and lookbehinds still see what's before.
+	Without MULTILINE, $ also matches just before a newline that ends the text, so
+	a match ending right before the last character read waits for more text too.
+	"""
+	if len(regexes) == 1:
+		fused = regexes[0]
+	else:
+		fused = re.compile('|'.join(['(?:{})'.format(_group_name.sub('(?:', _leading_flags.sub('', r.pattern))) for r in regexes]), regexes[0].flags)
+	live = [i for i, c in enumerate(collectors) if not c.done]
+	cursors = [0] * len(regexes) #absolute offsets into the stream
+	buf, base = '', 0 #buf starts at offset base
+	chunks = iter(chunks)
+	while live:
+		chunk = next(chunks, None)
+		final = chunk is None
+		if not final:
+			buf += chunk
+		cut = len(buf) if final else max(buf.rfind('\n') + 1, len(buf) - overlap)
+		stalled = False
+		while live and not stalled:
+			pos = min([cursors[i] for i in live]) - base
+			if pos >= cut:
+				break
+			mtch = fused.search(buf, pos)
+			if mtch is None or mtch.start() >= cut:
+				break
+			at = mtch.start()
+			for i in list(live):
+				if cursors[i] - base > at:
+					continue
+				found = mtch if fused is regexes[i] else regexes[i].match(buf, at)
+				if found is not None and not final and (found.end() > cut or found.end() >= len(buf) - 1):
+					stalled = True #might run on into the next chunk
+					break
+				if found is None:
+					cursors[i] = base + at + 1
+					continue
+				cursors[i] = base + max(found.end(), at + 1)
+				collectors[i].add(found)
+				if collectors[i].done:
+					live.remove(i)
+		if final:
+			break
+		if not stalled:
+			for i in live:
+				cursors[i] = max(cursors[i], base + cut)
+		drop = max(0, min([cursors[i] - base for i in live] + [cut]) - 1)
+		buf, base = buf[drop:], base + drop
+
+
 class RegexTask(AbstractTask):
-	def __init__(self, name, regex, stop_on_miss=False, **kwargs):
+	"""
+	Matches regex groups in its predecessors' output and passes them on as termargs.
+
+	By default only the first match counts. With aggregate set - a mode for every
+	group, or a {group: mode} dict with 'first' for the rest - every match is folded
+	in as output streams by, so a few hundred MB of contig headers can be reduced to
+	a mean coverage without holding them in memory. stdout() takes a string, a file,
+	or any iterable of chunks; with scan_files the task also reads its input files.
+
+	Sibling RegexTasks handed the same output are scanned together in one pass;
+	the first of them to start does the scan and the rest pick up their results.
+	"""
+
+	__definition__ = AbstractTask.__definition__ + ('regex', 'stop_miss', 'aggregate', 'scan_files', 'chunk_size', 'overlap')
+
+	def __init__(self, name, regex, stop_on_miss=False, aggregate=None, scan_files=False, chunk_size=1 << 20, overlap=1 << 16, **kwargs):
 		super(RegexTask, self).__init__(name, "", **kwargs)
 		# del self.run_command
 		self.regex = re.compile(regex)
 		self.stop_miss = stop_on_miss
-		
-# 	def start(self, **kwargs):
-# 		self.status = STATUS_FINISH
-# 		return None
-		
+		self.aggregate = aggregate
+		if aggregate is not None:
+			[Aggregate(mode) for mode in (aggregate.values() if isinstance(aggregate, dict) else (aggregate,))] #fail early on a bad mode
+		self.scan_files = scan_files
+		self.chunk_size = chunk_size
+		self.overlap = overlap #most text carried between chunks; no match can be longer
+		self.__fused__ = None #(stdin, collector) from a sibling's scan
+
+	def start(self, **kwargs):
+		if self.scan_files:
+			for path in self.input_files:
+				with open(path) as f:
+					self.stdout(f)
+			if self.status == STATUS_FATAL:
+				return None
+		return super(RegexTask, self).start(**kwargs)
+
+	def __chunks__(self, stdoutput):
+		if isinstance(stdoutput, _text):
+			return (stdoutput,)
+		if hasattr(stdoutput, 'read'):
+			return iter(partial(stdoutput.read, self.chunk_size), stdoutput.read(0))
+		return stdoutput
+
+	def __finditer__(self, chunks):
+		"Every match of this task's pattern over a stream of chunks."
+		matches = []
+		collector = _Collector(self)
+		collector.first_only, collector.add = False, matches.append
+		_scan([self.regex], chunks, self.overlap, [collector])
+		return matches
+
+	def __siblings__(self, stdoutput):
+		"Other RegexTasks still waiting to read this same output, that can share a scan with this one."
+		siblings = []
+		for parent in self.__parents__:
+			for task in parent.__children__:
+				if isinstance(task, RegexTask) and task is not self and task not in siblings and task.status == STATUS_PENDING \
+						and task.__fused__ is None and not task.scan_files and (task.stdin is stdoutput or task.stdin == stdoutput) \
+						and _fusable([self.regex, task.regex]):
+					siblings.append(task)
+		return siblings
+
 	def stdout(self, stdoutput):
-		mtch = self.regex.search(stdoutput)
-		if mtch:
-			for key, value in mtch.groupdict().items():
-				if 'default' not in key:
-					self.termargs.append((key, value))
-		else:
-			if self.stop_miss:
-				self.status = STATUS_FATAL
\ No newline at end of file
+		fused, self.__fused__ = self.__fused__, None
+		if fused is not None and (fused[0] is stdoutput or fused[0] == stdoutput):
+			fused[1].apply()
+			return
+		tasks = [self] + (self.__siblings__(stdoutput) if isinstance(stdoutput, _text) else [])
+		collectors = [_Collector(task) for task in tasks]
+		_scan([task.regex for task in tasks], self.__chunks__(stdoutput), max([task.overlap for task in tasks]), collectors)
+		for task, collector in zip(tasks[1:], collectors[1:]):
+			task.__fused__ = (stdoutput, collector)
+		collectors[0].apply()
@@ -0,0 +1,62 @@
+from collections import defaultdict
+
+
+def requested(task):
+	"(cores, GB of memory) each of a task's jobs asks for."
+	return getattr(task, 'cores', None) or 1, getattr(task, 'mem', None) or 0
+
+def claimed(task):
+	"(cores, GB of memory) one of a task's launches can take: a task array's elements may all run at once."
+	cores, mem = requested(task)
+	n = (getattr(task, 'array_size', None) or 1) if getattr(task, 'array', False) else 1
+	return cores * n, mem * n
+
+
+class ResourceBudget(object):
+	"""
+	The cores and memory (GB) a Runner may have in use on the cluster at once:
+	overall, and for each user named in users, as {user: (cores, mem)}. A limit of
+	None is no limit. The Runner submits waiting jobs in priority order as long as
+	they fit, so small jobs backfill around a large one that has to wait for room.
+	A task array is charged for all of its elements.
+	"""
+
+	def __init__(self, cores=None, mem=None, users=None):
+		self.cores = cores
+		self.mem = mem
+		self.users = users or {}
+		self.used = defaultdict(lambda: [0, 0]) #None for overall, or a user -> [cores, mem]
+
+	def __limits__(self, user):
+		yield None, self.cores, self.mem
+		if user in self.users:
+			cores, mem = self.users[user]
+			yield user, cores, mem
+
+	def possible(self, task, user=None):
+		"Whether the task's jobs could ever fit, with nothing else running."
+		cores, mem = claimed(task)
+		return all([(limit is None or cores <= limit) and (mem_limit is None or mem <= mem_limit) for _, limit, mem_limit in self.__limits__(user)])
+
+	def fits(self, task, user=None):
+		"Whether one of the task's jobs fits in what's left right now."
+		cores, mem = claimed(task)
+		for key, limit, mem_limit in self.__limits__(user):
+			used = self.used[key]
+			if limit is not None and used[0] + cores > limit:
+				return False
+			if mem_limit is not None and used[1] + mem > mem_limit:
+				return False
+		return True
+
+	def claim(self, task, user=None):
+		cores, mem = claimed(task)
+		for key, _, _ in self.__limits__(user):
+			self.used[key][0] += cores
+			self.used[key][1] += mem
+
+	def release(self, task, user=None):
+		cores, mem = claimed(task)
+		for key, _, _ in self.__limits__(user):
+			self.used[key][0] -= cores
+			self.used[key][1] -= mem
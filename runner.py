@@ -0,0 +1,318 @@
+import os
+import tempfile
+import time
+from collections import deque
+from heapq import heapify, heappop, heappush
+from itertools import count
+from tasks import STATUS_PENDING, STATUS_RUNNING, STATUS_FATAL, FatalException
+from history import input_size
+from resources import claimed
+
+
+class Backend(object):
+	"""
+	Where a Runner sends commands. None of these calls should block on a job;
+	the runner drives every workflow from a single loop.
+	"""
+
+	def launch(self, task, command):
+		"Start a command for a task and return a handle for it."
+		raise NotImplementedError
+
+	def launch_all(self, launches):
+		"""
+		Start each (task, command). Returns a handle for each in order, or the IOError
+		or OSError that kept it from starting. Backends that can start several at once
+		in one round trip should override this; the runner hands it a whole step's worth.
+		"""
+		handles = []
+		for task, command in launches:
+			try:
+				handles.append(self.launch(task, command))
+			except (IOError, OSError) as e:
+				handles.append(e)
+		return handles
+
+	def poll(self, handles):
+		"Return {handle: (returncode, stdout, stderr)} for the handles that have finished."
+		raise NotImplementedError
+
+	def cancel(self, handle):
+		raise NotImplementedError
+
+
+class FakeBackend(Backend):
+	"In-memory backend for tests. Jobs finish after a number of polls, with results scripted by task slug."
+
+	def __init__(self, results=None, polls=1, durations=None):
+		self.results = results or {} #slug -> (returncode, stdout)
+		self.polls = polls
+		self.durations = durations or {} #slug -> polls, for jobs that take longer or shorter than the rest
+		self.jobs = dict()
+		self.submitted = []
+		self.cancelled = []
+		self.peak = 0
+		self.ids = count(1)
+
+	def launch(self, task, command):
+		handle = next(self.ids)
+		self.jobs[handle] = [task, self.durations.get(task.slug, self.polls)]
+		self.submitted.append(command)
+		self.peak = max(self.peak, len(self.jobs))
+		return handle
+
+	def poll(self, handles):
+		finished = dict()
+		for handle in handles:
+			job = self.jobs[handle]
+			job[1] -= 1
+			if job[1] <= 0:
+				del self.jobs[handle]
+				returncode, stdout = self.results.get(job[0].slug, (0, ''))
+				finished[handle] = (returncode, stdout, '')
+		return finished
+
+	def cancel(self, handle):
+		self.jobs.pop(handle, None)
+		self.cancelled.append(handle)
+
+
+class FakeCluster(FakeBackend):
+	"""
+	A FakeBackend with a fixed number of core slots and GB of memory, for simulating
+	dispatch offline. Launching a job that doesn't fit in what's free is an error;
+	busy records the cores in use at each poll.
+	"""
+
+	def __init__(self, slots, mem=None, **kwargs):
+		super(FakeCluster, self).__init__(**kwargs)
+		self.slots = slots
+		self.mem = mem
+		self.busy = []
+
+	def __in_use__(self):
+		return [sum(r) for r in zip(*[claimed(task) for task, _ in self.jobs.values()])] or [0, 0]
+
+	def launch(self, task, command):
+		cores, mem = [a + b for a, b in zip(self.__in_use__(), claimed(task))]
+		if cores > self.slots or (self.mem is not None and mem > self.mem):
+			raise OSError("Cluster oversubscribed: {} cores and {} GB in use.".format(cores, mem))
+		return super(FakeCluster, self).launch(task, command)
+
+	def poll(self, handles):
+		self.busy.append(self.__in_use__()[0])
+		return super(FakeCluster, self).poll(handles)
+
+
+class CommandFailed(Exception):
+	pass
+
+
+def collect_outputs(task, output_dir):
+	"Files written under {output} stand in for the task's inputs of the same extension."
+	if output_dir is None:
+		return list(task.input_files)
+	outputs = [os.path.join(d, f) for d, _, files in os.walk(output_dir) for f in sorted(files)]
+	extensions = set([os.path.splitext(f)[1] for f in outputs])
+	return outputs + [f for f in task.input_files if os.path.splitext(f)[1] not in extensions]
+
+
+class Runner(object):
+	"""
+	Drives any number of workflows through their lifecycle from one loop: poll
+	the ready set, start tasks, submit their commands, collect results, finalize,
+	repeat. At most max_jobs commands are outstanding on the backend at once. The
+	backend is polled for every outstanding job together, once a pass; passes that
+	find nothing to do wait interval seconds, then backoff times longer each time,
+	up to max_interval, until something happens.
+
+	With a ResultCache, tasks whose commands and inputs match an earlier successful
+	run are finished from the cache instead of being submitted. With a ModuleCache,
+	commands source a snapshot of their modules' environment instead of loading them.
+	With a RuntimeHistory, commands are submitted longest remaining path first, rather
+	than in the order they became ready, and each task's runtime is recorded. With a
+	ResourceBudget, jobs are only submitted while their cores and memory fit in it.
+	"""
+
+	def __init__(self, backend, max_jobs=64, interval=5.0, scratch=None, cache=None, module_cache=None, history=None, budget=None,
+				 max_interval=60.0, backoff=2.0):
+		self.backend = backend
+		self.max_jobs = max_jobs
+		self.interval = interval #seconds to sleep when a pass finds nothing to do
+		self.max_interval = max(max_interval, interval)
+		self.backoff = backoff
+		self.waits = deque(maxlen=100) #the latest sleeps, in seconds
+		self.scratch = scratch #where {output} directories and array manifests are made
+		self.cache = cache
+		self.module_cache = module_cache
+		self.history = history
+		self.budget = budget
+		self.workflows = dict() #root -> record
+		self.users = dict() #root -> who the budget charges its jobs to
+		self.started = dict() #root -> tasks already started
+		self.jobs = dict() #task -> [commands outstanding, output dir, stdout, errors, cache key]
+		self.waiting = [] #heap of (-priority, arrival, root, task, command) waiting for a job slot
+		self.arrivals = count()
+		self.priorities = dict() #root -> {task: longest estimated path to the end}
+		self.launched = dict() #task -> when its first command was submitted
+		self.handles = dict() #handle -> (root, task)
+		self.finished = []
+		self.failed = dict() #root -> exception
+
+	def add(self, root, record=None, user=None):
+		self.workflows[root] = record
+		self.started[root] = set()
+		self.users[root] = user
+		if self.history is not None:
+			self.priorities[root] = self.history.priorities(root)
+		return self
+
+	def cancel(self, root, error=None):
+		"Stop a workflow, killing its outstanding jobs."
+		self.waiting = [w for w in self.waiting if w[2] is not root]
+		heapify(self.waiting)
+		for handle, (r, task) in list(self.handles.items()):
+			if r is root:
+				self.backend.cancel(handle)
+				del self.handles[handle]
+				if self.budget is not None:
+					self.budget.release(task, self.users[root])
+		for task in self.started.pop(root, ()):
+			self.launched.pop(task, None)
+			if self.jobs.pop(task, None) is not None and task.status in (STATUS_PENDING, STATUS_RUNNING):
+				task.__setFatal__(error or 'cancelled')
+		self.workflows.pop(root, None)
+		self.priorities.pop(root, None)
+		self.users.pop(root, None)
+		if error is not None:
+			self.failed[root] = error
+
+	def __advance__(self, root):
+		"Start whatever's ready. Tasks with nothing to run finish at once, which can make more ready."
+		started = self.started[root]
+		progressed, more = False, True
+		while more:
+			more = False
+			for task in root.__get_next__():
+				if task in started:
+					continue
+				started.add(task)
+				progressed = more = True
+				output_dir = None
+				if '{output}' in getattr(task, 'run_command', ''):
+					output_dir = tempfile.mkdtemp(prefix=task.slug + '.', dir=self.scratch)
+				commands = task.__start__(output=output_dir, manifest_dir=self.scratch, module_cache=self.module_cache)
+				if task.status == STATUS_FATAL:
+					continue
+				if not commands:
+					task.__finalize__(self.workflows[root], '', collect_outputs(task, output_dir))
+					continue
+				if self.budget is not None and not self.budget.possible(task, self.users[root]):
+					task.__setFatal__("asks for {} cores and {} GB at once, more than the resource budget allows".format(*claimed(task)))
+					continue
+				key = self.cache.key(task) if self.cache is not None else None
+				stdout = self.cache.get(key, output_dir) if key is not None else None
+				if stdout is not None:
+					task.__finalize__(self.workflows[root], stdout, collect_outputs(task, output_dir))
+					continue
+				self.jobs[task] = [len(commands), output_dir, [], [], key]
+				priority = self.__priority__(root, task)
+				[heappush(self.waiting, (-priority, next(self.arrivals), root, task, c)) for c in sorted(commands)]
+		if not any([task in self.jobs for task in started]):
+			self.workflows.pop(root)
+			self.started.pop(root)
+			self.priorities.pop(root, None)
+			self.users.pop(root)
+			self.finished.append(root)
+		return progressed
+
+	def __priority__(self, root, task):
+		"A ready task's estimated runtime, now its inputs are known, plus the longest estimated path after it."
+		if self.history is None:
+			return 0.0
+		longest = self.priorities[root]
+		after = max([longest.get(c, 0.0) for c in task.__children__] or [0.0])
+		return self.history.estimate(task, input_size(task)) + after
+
+	def __complete__(self, root, task, returncode, stdout, stderr):
+		job = self.jobs[task]
+		job[0] -= 1
+		job[2].append(stdout)
+		if returncode:
+			job[3].append(CommandFailed("exit status {}: {}".format(returncode, stderr.strip())))
+		if job[0]:
+			return
+		del self.jobs[task]
+		launched = self.launched.pop(task, None)
+		if job[3]:
+			task.__setFatal__(job[3][0])
+			return
+		if self.history is not None and launched is not None:
+			self.history.record(task, time.time() - launched)
+		if job[4] is not None:
+			self.cache.put(job[4], ''.join(job[2]), job[1])
+		task.__finalize__(self.workflows[root], ''.join(job[2]), collect_outputs(task, job[1]))
+
+	def step(self):
+		"One pass over every workflow. Returns True if anything happened."
+		progressed = False
+		for root in list(self.workflows):
+			try:
+				progressed = self.__advance__(root) or progressed
+			except FatalException as e:
+				self.cancel(root, e)
+				progressed = True
+		deferred, batch = [], [] #jobs that don't fit the budget yet, and the ones that do, launched together
+		while self.waiting and len(self.handles) + len(batch) < self.max_jobs:
+			waiting = heappop(self.waiting)
+			_, _, root, task, command = waiting
+			if self.budget is not None:
+				if not self.budget.fits(task, self.users[root]):
+					deferred.append(waiting) #later ones that fit backfill around it
+					continue
+				self.budget.claim(task, self.users[root])
+			progressed = True
+			self.launched.setdefault(task, time.time())
+			batch.append((root, self.users[root], task, command))
+		handles = self.backend.launch_all([(task, command) for _, _, task, command in batch]) if batch else []
+		for (root, user, task, command), handle in zip(batch, handles):
+			if root not in self.workflows: #cancelled by a launch that failed before it in this batch
+				if self.budget is not None:
+					self.budget.release(task, user)
+				if not isinstance(handle, Exception):
+					self.backend.cancel(handle)
+				continue
+			if isinstance(handle, Exception): #e.g. qsub refused it; fail this workflow, not the loop
+				if self.budget is not None:
+					self.budget.release(task, user)
+				task.__setFatal__(handle)
+				self.cancel(root, handle)
+				continue
+			self.handles[handle] = (root, task)
+			if task.status == STATUS_PENDING:
+				task.__setRunning__(handle)
+		[heappush(self.waiting, waiting) for waiting in deferred if waiting[2] in self.workflows]
+		results = self.backend.poll(list(self.handles)) if self.handles else {}
+		for handle, (returncode, stdout, stderr) in results.items():
+			root, task = self.handles.pop(handle)
+			if self.budget is not None:
+				self.budget.release(task, self.users[root])
+			self.__complete__(root, task, returncode, stdout, stderr)
+		return progressed or bool(results)
+
+	def run(self):
+		"Loop until every workflow has finished or failed."
+		wait = self.interval
+		while self.workflows:
+			if self.step():
+				wait = self.interval
+				continue
+			if not self.workflows: #the pass only noticed they're done
+				break
+			self.waits.append(wait)
+			time.sleep(wait)
+			wait = min(wait * self.backoff, self.max_interval)
+		if self.history is not None:
+			self.history.save()
+		return self
+
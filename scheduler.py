@@ -0,0 +1,106 @@
+from collections import deque
+from tasks import STATUS_PENDING, STATUS_RUNNING, STATUS_FINISH, STATUS_FATAL, STATUS_IGNORED, FatalException
+
+_resolved = (STATUS_FINISH, STATUS_IGNORED)
+_live = (STATUS_PENDING, STATUS_RUNNING)
+
+
+class Scheduler(object):
+	"""
+	Incremental ready set for the graph below a root task.
+
+	Keeps a count of unresolved parents for every task and the set of tasks that
+	are ready to run. Tasks report their status changes here, so each transition
+	costs O(out-degree) and each poll costs O(ready tasks) instead of a full walk.
+
+	A task is ready when it's pending or running and every parent has completed
+	or been ignored, with at least one parent completed. A task whose parents
+	were all ignored is ignored too.
+	"""
+
+	def __init__(self, root):
+		self.root = root
+		self.stale = False
+		self.ready = set()
+		self.fatal = set()
+		self.members = set()
+		self.unresolved = dict()
+		self.fed = dict()
+		self.queue = deque()
+
+		#descendants of the root are scheduled, their outside parents are only watched
+		stack = [root]
+		self.members.add(root)
+		while stack:
+			for c in stack.pop().__children__:
+				if c not in self.members:
+					self.members.add(c)
+					stack.append(c)
+		for t in self.members:
+			for p in t.__parents__:
+				self.__claim__(p)
+			self.__claim__(t)
+
+		settle = []
+		for t in self.members:
+			self.unresolved[t] = len([p for p in t.__parents__ if p.status not in _resolved])
+			self.fed[t] = any([p.status == STATUS_FINISH for p in t.__parents__])
+			if t.status == STATUS_FATAL:
+				self.fatal.add(t)
+			elif not self.unresolved[t]:
+				settle.append(t)
+		[self.__settle__(t) for t in settle]
+
+	def __claim__(self, task):
+		other = task.__scheduler__
+		if other is not None and other is not self:
+			other.stale = True
+		task.__scheduler__ = self
+
+	def __settle__(self, task):
+		"Called once all of a task's parents are resolved."
+		if task.status not in _live:
+			return
+		if task.__parents__ and not self.fed[task]:
+			task.status = STATUS_IGNORED #notifies back through __transition__
+		else:
+			self.ready.add(task)
+
+	def __transition__(self, task, old, new):
+		"Update the ready set for a single task status change."
+		if old == new or self.stale:
+			return
+		if old not in _live:
+			#a terminal task went back to pending (reset or restore); start over
+			self.stale = True
+			return
+		if new in _live:
+			return
+		self.ready.discard(task)
+		if new == STATUS_FATAL:
+			self.fatal.add(task)
+			return
+		#ignoring cascades; work through it iteratively rather than recursively
+		self.queue.append((task, new))
+		if len(self.queue) > 1:
+			return
+		while self.queue:
+			task, new = self.queue[0]
+			for c in task.__children__:
+				if c not in self.members:
+					continue
+				if new == STATUS_FINISH:
+					self.fed[c] = True
+				self.unresolved[c] -= 1
+				if not self.unresolved[c]:
+					self.__settle__(c)
+			self.queue.popleft()
+
+	def poll(self, nexts=None):
+		if nexts is None:
+			nexts = set()
+		if self.fatal:
+			s = next(iter(self.fatal))
+			raise FatalException("Task {s.name} (job id:{job_id}) is in a terminal failure state.".format(s=s, job_id=getattr(s, 'job_id', None)))
+		nexts.update(self.ready)
+		return nexts
@@ -0,0 +1,185 @@
+import os
+import subprocess
+import uuid
+from contextlib import contextmanager
+from threading import Lock
+from timing import clock
+
+try:
+	from Queue import Queue
+except ImportError:
+	from queue import Queue
+
+try:
+	from pipes import quote
+except ImportError:
+	from shlex import quote
+
+#most script to write ahead of reading results back, well short of a pipe buffer, so neither end blocks the other
+_AHEAD = 16 * 1024
+
+
+def _bytes(text):
+	return text if isinstance(text, bytes) else text.encode('utf-8')
+
+def _text(data):
+	return data if isinstance(data, str) else data.decode('utf-8', 'replace')
+
+
+class SessionLost(OSError):
+	"The shell went away before a command's result came back; the command may or may not have run."
+
+
+class ShellSession(object):
+	"""
+	A long-lived shell, such as 'ssh -T host sh', that runs the commands sent to
+	it one after another. Each command reads its stdin from a here-document and
+	writes its stderr to a file on the far side; a line with a token only this
+	session knows ends its output, followed by its stderr, which is read back by
+	its size in bytes, so the pipe is binary and output is decoded once it's read.
+	Any number of commands can be written out before their results are read back.
+	"""
+
+	def __init__(self, command):
+		self.command = list(command)
+		self.token = uuid.uuid4().hex
+		with open(os.devnull, 'w') as devnull:
+			self.proc = subprocess.Popen(self.command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=devnull)
+		self.__send__('__dag_err=$(mktemp) || exit 1\ntrap \'rm -f "$__dag_err"\' EXIT\n')
+
+	def alive(self):
+		return self.proc.poll() is None
+
+	def __send__(self, text):
+		try:
+			self.proc.stdin.write(_bytes(text))
+			self.proc.stdin.flush()
+		except (IOError, OSError, ValueError) as e:
+			raise SessionLost("shell {} closed: {}".format(' '.join(self.command), e))
+
+	def __script__(self, args, input=None):
+		line = ' '.join([quote(str(a)) for a in args]) + ' 2>"$__dag_err"'
+		if input is None:
+			line += ' </dev/null\n'
+		else:
+			end = '{}_IN'.format(self.token)
+			line += " <<'{}'\n{}\n{}\n".format(end, input.rstrip('\n'), end)
+		return line + 'printf \'\\n{} %d %d\\n\' $? $(wc -c <"$__dag_err"); cat "$__dag_err"\n'.format(self.token)
+
+	def __receive__(self):
+		lines, marker = [], _bytes(self.token + ' ')
+		while True:
+			line = self.proc.stdout.readline()
+			if not line:
+				raise SessionLost("shell {} closed".format(' '.join(self.command)))
+			if line.startswith(marker):
+				status, size = line.split()[1:]
+				break
+			lines.append(line)
+		out = b''.join(lines)[:-1] #less the newline written ahead of the marker
+		return int(status), _text(out), _text(self.proc.stdout.read(int(size)))
+
+	def pipeline(self, commands):
+		"Run each (args, input) in turn; [(exit status, stdout, stderr), ...] in the same order."
+		results, pending, script = [], 0, []
+		for args, input in commands:
+			script.append(self.__script__(args, input))
+			pending += 1
+			if sum([len(s) for s in script]) >= _AHEAD:
+				self.__send__(''.join(script))
+				results.extend([self.__receive__() for _ in range(pending)])
+				pending, script = 0, []
+		if pending:
+			self.__send__(''.join(script))
+			results.extend([self.__receive__() for _ in range(pending)])
+		return results
+
+	def run(self, args, input=None):
+		return self.pipeline([(args, input)])[0]
+
+	def close(self):
+		try:
+			self.proc.stdin.close()
+		except (IOError, OSError):
+			pass
+		self.proc.wait()
+
+
+class ShellPool(object):
+	"""
+	Up to size ShellSessions started with command, opened as they're needed and
+	shared out one at a time. A session found dead is replaced before it's used,
+	so idle connections the far side dropped cost one reconnect; a command whose
+	session dies under it is only retried, on a fresh one, if it's marked safe to
+	repeat (e.g. qstat, but not qsub).
+	"""
+
+	def __init__(self, command, size=2):
+		self.command = list(command)
+		self.size = size
+		self.opened = 0
+		self.idle = Queue()
+		self.lock = Lock()
+		self.connects = 0
+		self.reconnects = 0
+		self.lost = 0
+		self.commands = 0
+		self.round_trips = 0
+		self.waited = 0.0 #seconds spent waiting for a free session
+
+	def __connect__(self):
+		self.connects += 1
+		return ShellSession(self.command)
+
+	@contextmanager
+	def session(self):
+		with self.lock:
+			if self.idle.empty() and self.opened < self.size:
+				self.opened += 1
+				self.idle.put(None) #connected below, outside the lock
+		began = clock()
+		session = self.idle.get()
+		self.waited += clock() - began
+		try:
+			if session is None or not session.alive():
+				if session is not None:
+					self.reconnects += 1
+				session = self.__connect__()
+			yield session
+		except SessionLost:
+			session.close()
+			session = None
+			raise
+		finally:
+			self.idle.put(session)
+
+	def pipeline(self, commands, idempotent=False):
+		"Run each (args, input) over one session in as few round trips as it takes; retried once if idempotent and the session is lost."
+		commands = list(commands)
+		for attempt in (0, 1):
+			try:
+				with self.session() as session:
+					self.round_trips += 1
+					results = session.pipeline(commands)
+					self.commands += len(commands)
+					return results
+			except SessionLost:
+				self.lost += 1
+				if attempt or not idempotent:
+					raise
+
+	def run(self, args, input=None, idempotent=False):
+		"(exit status, stdout, stderr) of one command."
+		return self.pipeline([(args, input)], idempotent)[0]
+
+	def metrics(self):
+		return dict(size=self.size, opened=self.opened, connects=self.connects, reconnects=self.reconnects, lost=self.lost,
+					commands=self.commands, round_trips=self.round_trips, waited=self.waited)
+
+	def close(self):
+		with self.lock:
+			while not self.idle.empty():
+				session = self.idle.get()
+				if session is not None:
+					session.close()
+				self.opened -= 1
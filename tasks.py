@@ -1,11 +1,23 @@
 
+import hashlib
 import json
 import re
 from collections import defaultdict
-from fnmatch import fnmatch
+from fnmatch import translate as fnmatch_translate
 import traceback
 from functools import wraps
+import inspect
+from itertools import chain, count
+import os
 import sys
+import tempfile
+import threading
+from timing import untimed
+
+try:
+	from inspect import getfullargspec as getargspec
+except ImportError:
+	from inspect import getargspec
 
 STATUS_PENDING = 'pending'
 STATUS_RUNNING = 'running'
@@ -14,15 +26,93 @@ STATUS_FATAL = 'fatal error'
 STATUS_IGNORED = 'ignored by condition'
 
 
-_root = None
+_local = threading.local()
+_LAZY_FIELDS = ('command_log', 'input_files', 'stdin', 'handoff') #bulky state a lazy restore leaves encoded
+_LAYERED_FIELDS = ('termargs', 'passed') #Termargs, written once per shared layer
 
 
 class FatalException(Exception):
 	pass
 	
 class CycleException(Exception):
-	pass
+	def __init__(self, message="Graph must remain acyclic.", path=()):
+		super(CycleException, self).__init__(message)
+		self.path = list(path)
+	
+class Workflow(object):
+	"""
+	A workflow's root and the log of the commands it has started, with a lock
+	that guards its graph and task state. Tasks belong to the workflow current
+	in the thread that makes them: each thread has its own default, and 'with
+	Workflow():' makes another current, so workflows can be built and run side by
+	side in one process.
+
+	The workflow also numbers its tasks in topological order, kept incrementally as
+	edges are added, so edges should join tasks of the same workflow.
+	"""
+	
+	def __init__(self):
+		self.root = None
+		self.command_log = []
+		self.lock = threading.RLock()
+		self.timings = None #a Timings, to record where its tasks spend their time
+		self.ids = count() #next() on a count is atomic
+		self.outputs = dict() #digest -> stdout a finished task handed off, kept once however many tasks refer to it
+		
+	def next_id(self):
+		return next(self.ids)
+		
+	def keep(self, stdout):
+		"Keep a task's output; returns the digest that refers to it."
+		digest = hashlib.sha1(stdout if isinstance(stdout, bytes) else stdout.encode('utf-8')).hexdigest()
+		self.outputs.setdefault(digest, stdout)
+		return digest
+		
+	def __enter__(self):
+		_local.__dict__.setdefault('stack', []).append(self)
+		return self
+		
+	def __exit__(self, *exc):
+		_local.stack.pop()
+		
+	def log(self, commands):
+		with self.lock:
+			self.command_log.extend(commands)
+			
+			
+def current_workflow():
+	"The workflow new tasks in this thread belong to."
+	stack = _local.__dict__.setdefault('stack', [])
+	if not stack:
+		stack.append(Workflow())
+	return stack[-1]
+	
+	
+def _timed(task, phase):
+	"Time a block as one of a task's phases, if its workflow keeps timings."
+	timings = task.__workflow__.timings
+	return untimed if timings is None else timings.phase(task, phase)
+	
+	
+def _mark(task, event):
+	timings = task.__workflow__.timings
+	if timings is not None:
+		timings.mark(task, event)
+		
+		
+class _locked(object):
+	"Hold the locks of the workflows some tasks belong to, always taken in the same order."
 	
+	def __init__(self, tasks):
+		self.locks = sorted(set([t.__workflow__.lock for t in tasks]), key=id)
+		
+	def __enter__(self):
+		[lock.acquire() for lock in self.locks]
+		
+	def __exit__(self, *exc):
+		[lock.release() for lock in reversed(self.locks)]
+		
+		
 def fix_stacktrace(func):
 	@wraps(func)
 	def manipulate_stacktrace_on_exception(*args, **kwargs):
@@ -36,14 +126,136 @@ def fix_stacktrace(func):
 	return manipulate_stacktrace_on_exception
 	
 	
+def _cycle(path):
+	return CycleException("Graph must remain acyclic; {} would form a cycle.".format(' -> '.join([t.slug for t in path])), path)
+	
+	
+def _find_cycle(stuck, parents):
+	"Walk upstream through tasks that couldn't be ordered until the walk repeats itself."
+	stuck = set(stuck)
+	path, index, t = [], {}, next(iter(stuck))
+	while t not in index:
+		index[t] = len(path)
+		path.append(t)
+		t = next(p for p in chain(t.__parents__, parents.get(t, ())) if p in stuck)
+	cycle = path[index[t]:] + [t]
+	cycle.reverse()
+	return cycle
+	
+	
+@fix_stacktrace
+def add_edges(edges):
+	"""
+	Add many (parent, child) relationships at once. The whole batch is checked for
+	cycles in one linear pass before any of it is added to the graph.
+	"""
+	edges, batch = list(edges), []
+	for parent, child in edges:
+		for t in (parent, child):
+			if not isinstance(t, AbstractTask):
+				raise ValueError("Graph relationships must be between Task objects; supplied type was '{}'.".format(type(t)))
+		if child not in parent.__children__:
+			batch.append((parent, child))
+	with _locked([t for edge in edges for t in edge]):
+		children, parents = defaultdict(set), defaultdict(set)
+		for parent, child in batch:
+			children[parent].add(child)
+			parents[child].add(parent)
+		
+		#everything connected to the batch gets reordered
+		component, stack = set(), [t for edge in batch for t in edge]
+		while stack:
+			t = stack.pop()
+			if t not in component:
+				component.add(t)
+				stack.extend(chain(t.__children__, t.__parents__, children.get(t, ())))
+			
+		#Kahn's algorithm over the old and new edges together
+		indegree = dict((t, len(t.__parents__) + len(parents.get(t, ()))) for t in component)
+		order = [t for t in component if not indegree[t]]
+		for t in order:
+			for c in chain(t.__children__, children.get(t, ())):
+				indegree[c] -= 1
+				if not indegree[c]:
+					order.append(c)
+		if len(order) < len(component):
+			raise _cycle(_find_cycle([t for t in component if indegree[t]], parents))
+		
+		for parent, child in batch:
+			child.__link__(parent)
+		for t in order:
+			t.__order__ = t.__workflow__.next_id()
+		return [Relationship(parent, child) for parent, child in batch]
+	
+	
+def invalidate(tasks):
+	"""
+	Reset tasks and everything downstream of them to pending, make-style, keeping
+	every other result. Reset tasks are refilled from whichever of their parents
+	are still finished, so a rerun picks up exactly where the change was. Returns
+	the reset tasks in order.
+	"""
+	closure, stack = set(), list(tasks)
+	while stack:
+		t = stack.pop()
+		if t not in closure:
+			closure.add(t)
+			stack.extend(t.__children__)
+	closure = sorted(closure, key=lambda t: t.__order__)
+	for t in closure:
+		t.__reset__()
+	for t in closure:
+		for parent in sorted(t.__parents__, key=lambda p: p.__order__):
+			if parent not in closure and parent.status == STATUS_FINISH and parent.handoff is not None:
+				parent.__deliver__([t], *parent.__handoff__())
+	return closure
+	
+	
+def _below(task):
+	"Every task at or below this one, each once however many paths lead to it."
+	seen, stack = set(), [task]
+	while stack:
+		t = stack.pop()
+		if t not in seen:
+			seen.add(t)
+			stack.extend(t.__children__)
+	return seen
+	
+	
 def scan_modules(task):
 	return_set = set()
-	if hasattr(task, 'modules'):
-		return_set.update(task.modules)
-	[return_set.update(scan_modules(c)) for c in task.__children__]
+	for t in _below(task):
+		if hasattr(t, 'modules'):
+			return_set.update(t.modules)
 	return return_set
 	
 	
+def module_sets(task):
+	"The distinct module lists tasks at or below this one load, in load order."
+	return set([tuple(t.modules) for t in _below(task) if getattr(t, 'modules', None)])
+	
+	
+def _glob_filter(patterns):
+	"""
+	Compile shell globs into one matcher. Pure suffix patterns ('*.fasta') become a
+	single str.endswith check; the rest are translated once into one combined regex.
+	"""
+	suffixes, globs = [], []
+	for pattern in patterns:
+		if pattern.startswith('*') and not any([c in pattern[1:] for c in '*?[']):
+			suffixes.append(pattern[1:])
+		else:
+			globs.append(fnmatch_translate(pattern))
+	suffixes = tuple(suffixes)
+	if not globs:
+		return lambda f: f.endswith(suffixes)
+	#translate() appends its flags in Python 2 and wraps the pattern in a group in Python 3
+	match = re.compile('|'.join(['(?:{})'.format(g.replace('\\Z(?ms)', '\\Z')) for g in globs]), re.S).match
+	if not suffixes:
+		return lambda f: match(f) is not None
+	return lambda f: f.endswith(suffixes) or match(f) is not None
+	
+	
 _slugify_strip_re = re.compile(r'[^\w\s-]')
 _slugify_hyphenate_re = re.compile(r'[-\s]+')
 def _slugify(value):
@@ -69,58 +281,315 @@ class Relationship(object):
 		
 	def __getattr__(self, attr):
 		"override so you can do 't = Task().follows(s)' and have t act like a task"
-		try:
-			return super(Relationship, self).__getattr__(attr)
-		except AttributeError:
-			return child_task.__getattr__(attr)
+		child = self.__dict__.get('child_task')
+		if child is None: #not built yet, as while unpickling
+			raise AttributeError(attr)
+		return getattr(child, attr)
 		
-	def when(self, conditional_func_or_field, v=None):
-		if hasattr(conditional_func_or_field, '__call__'):
-			conditional_func = conditional_func_or_field
-		else:
-			if v is None:
-				raise ValueError('arguments to "when" must be a callable, or a keyword and a value.')
-			c = conditional_func_or_field
-			conditional_func = lambda **r: (c in r and r[c] == v)
-		self.parent_task.__conditionals__[self.child_task] = conditional_func
+	def when(self, conditional_func_or_field, v=None, keys=None):
+		"""
+		Make the edge conditional, on a callable or a termarg keyword and value. A callable's
+		named arguments are the termarg keys it reads, unless keys says otherwise; one that
+		also takes **kwargs is given them all.
+		"""
+		self.parent_task.__conditionals__[self.child_task] = _condition(conditional_func_or_field, v, keys)
 		return self
 		
 	def follows(self, parent_task):
 		return self.child_task.follows(parent_task)
 		
-	def _or(self, cond_func):
+	def __declared__(self, word):
 		try:
-			first_cond = self.parent_task.__conditionals__[self.child_task]
-			disjunction = lambda **k: first_cond(**k) or second_cond(**k)
-			self.parent_task.__conditionals__[self.child_task] = disjunction
-			return self
+			return self.parent_task.__conditionals__[self.child_task]
 		except KeyError:
-			return SyntaxError("'or' called on undeclared conditional (use 'when()' first.)")
+			raise SyntaxError("'{}' called on undeclared conditional (use 'when()' first.)".format(word))
 		
-	def _and(self, second_cond):
-		try:
-			first_cond = self.parent_task.__conditionals__[self.child_task]
-			conjunction = lambda **k: first_cond(**k) and second_cond(**k)
-			self.parent_task.__conditionals__[self.child_task] = conjunction
-			return self
-		except KeyError:
-			return SyntaxError("'and' called on undeclared conditional (use 'when()' first.)")
+	def _or(self, second_cond, v=None, keys=None):
+		first_cond = self.__declared__('or')
+		self.parent_task.__conditionals__[self.child_task] = Disjunction(first_cond, _condition(second_cond, v, keys))
+		return self
+		
+	def _and(self, second_cond, v=None, keys=None):
+		first_cond = self.__declared__('and')
+		self.parent_task.__conditionals__[self.child_task] = Conjunction(first_cond, _condition(second_cond, v, keys))
+		return self
 			
 	def _else(self, alt_child):
+		cond = self.__declared__('else')
+		relationship = alt_child.follows(self.parent_task)
+		self.parent_task.__conditionals__[alt_child] = Negation(cond) #shares cond's memo with this edge
+		return relationship
+
+
+_missing = object()
+
+def _arguments(func):
+	"Named arguments of a callable, or None if it takes **kwargs (or can't be inspected), since then it may read any termarg."
+	try:
+		spec = getargspec(func)
+	except TypeError:
+		return None
+	if spec[2] is not None: #keywords, or varkw
+		return None
+	args = spec.args
+	if inspect.ismethod(func):
+		args = args[1:]
+	return tuple(args) or None
+	
+def _condition(func_or_field, v=None, keys=None):
+	if isinstance(func_or_field, Condition):
+		return func_or_field
+	if hasattr(func_or_field, '__call__'):
+		return Condition(func_or_field, keys)
+	if v is None:
+		raise ValueError('arguments to "when" must be a callable, or a keyword and a value.')
+	c = func_or_field
+	return Condition(lambda **r: (c in r and r[c] == v), (c,))
+	
+	
+class Condition(object):
+	"""
+	A compiled edge conditional. It declares the termarg keys it reads, and results are
+	memoized on the values of just those keys, so repeated finalizes over records with
+	the same values (and the negated _else edge) don't call back into Python closures.
+	A condition with keys of None is handed every termarg, and only remembers its
+	result for the last delivery, for the _else edge.
+	"""
+	
+	cache_size = 4096
+	
+	def __init__(self, func, keys=None):
+		self.func = func
+		self.keys = tuple(keys) if keys is not None else _arguments(func)
+		self.memo = dict()
+		self.last = (None, None) #(bound, result)
+		
+	def __apply__(self, bound):
+		if self.keys is None:
+			return bool(self.func(**bound))
+		return bool(self.func(**dict((k, bound[k]) for k in self.keys if k in bound)))
+		
+	def evaluate(self, bound):
+		"Truth of the condition for a dict of bound termargs."
+		if self.keys is None:
+			last, result = self.last
+			if last is not bound:
+				result = self.__apply__(bound)
+				self.last = (bound, result)
+			return result
+		values = tuple([bound.get(k, _missing) for k in self.keys])
 		try:
-			alt_child.follows(self.parent_task)
-			cond = self.parent_task.__conditionals__[self.child_task]
-			negation = lambda **k: not cond(**k)
-			self.parent_task.__conditionals__[alt_child] = negation
+			return self.memo[values]
 		except KeyError:
-			return SyntaxError("'else' called on undeclared conditional (use 'when()' first.)")
+			pass
+		except TypeError: #unhashable termarg values can't be memoized
+			return self.__apply__(bound)
+		if len(self.memo) >= self.cache_size:
+			self.memo.clear()
+		result = self.memo[values] = self.__apply__(bound)
+		return result
+		
+	def __call__(self, **kwargs):
+		return self.evaluate(kwargs)
+		
+		
+def _union(first, second):
+	if first is None or second is None:
+		return None
+	return first + tuple([k for k in second if k not in first])
+	
+class Conjunction(Condition):
+	
+	def __init__(self, first, second):
+		self.first, self.second = first, second
+		self.keys = _union(first.keys, second.keys)
+		
+	def evaluate(self, bound):
+		return self.first.evaluate(bound) and self.second.evaluate(bound)
+		
+class Disjunction(Conjunction):
+	
+	def evaluate(self, bound):
+		return self.first.evaluate(bound) or self.second.evaluate(bound)
+		
+class Negation(Condition):
+	
+	def __init__(self, condition):
+		self.condition = condition
+		self.keys = condition.keys
+		
+	def evaluate(self, bound):
+		return not self.condition.evaluate(bound)
+		
+
+_stamps = count() #the order layers were frozen in
 
+def _pair(arg):
+	return isinstance(arg, (tuple, list)) and len(arg) == 2
+
+def _merge(layers):
+	"key -> (stamp, value) over frozen layers; the latest frozen value of each key wins."
+	if len(layers) == 1:
+		return layers[0].merged
+	merged = dict()
+	for layer in layers:
+		for key, stamped in layer.merged.items():
+			if key not in merged or merged[key][0] < stamped[0]:
+				merged[key] = stamped
+	return merged
+
+
+class Termargs(object):
+	"""
+	Layered termargs. A task's own args sit over shared references to the layers its
+	parents passed on, so wide or deep graphs don't copy every ancestor's pairs into
+	every descendant, and a layer reached by two paths through a diamond is read once.
+	Iteration runs parents first, so later pairs override earlier ones.
+
+	A layer is frozen once it's passed on, and caches the latest value of each key
+	under it, so binding costs a task's own args and a merge of its parents' keys,
+	not a walk over every ancestor. A frozen layer that's changed again is thawed;
+	layers already frozen over it keep what they saw.
+	"""
+	
+	def __init__(self, args=(), parents=()):
+		self.args = [tuple(a) if isinstance(a, list) and len(a) == 2 else a for a in args] #pairs come back from JSON as lists
+		self.parents = [p.freeze() for p in parents]
+		self.merged = None #key -> (stamp, value), once frozen
+		
+	def __thaw__(self):
+		self.merged = None
+		
+	def append(self, arg):
+		self.__thaw__()
+		self.args.append(arg)
+		
+	def extend(self, args):
+		self.__thaw__()
+		self.args.extend(args)
+		
+	def inherit(self, layer):
+		"Share a parent's layer rather than copying it."
+		self.__thaw__()
+		self.parents.append(layer.freeze())
+		
+	def __getstate__(self):
+		"Stamps only order layers frozen in the same process; unpickled layers are frozen again as they're used."
+		state = dict(self.__dict__)
+		state['merged'] = None
+		return state
+		
+	def freeze(self):
+		"Fix the pairs this layer binds, now it's being passed on."
+		if self.merged is None:
+			order, seen, stack = [], set(), [(self, False)]
+			while stack: #any layers under it that aren't frozen yet, parents first
+				layer, expanded = stack.pop()
+				if expanded:
+					order.append(layer)
+				elif id(layer) not in seen:
+					seen.add(id(layer))
+					stack.append((layer, True))
+					stack.extend([(p, False) for p in reversed(layer.parents) if p.merged is None])
+			for layer in order:
+				if layer.merged is None:
+					layer.__fix__()
+		return self
+		
+	def __fix__(self):
+		stamp = next(_stamps)
+		own = [(arg[0], (stamp, arg[1])) for arg in self.args if _pair(arg)]
+		merged = _merge(self.parents) if self.parents else dict()
+		if own:
+			merged = dict(merged)
+			merged.update(own)
+		self.merged = merged
+		
+	def bound(self):
+		"Latest value of every key."
+		if self.merged is not None:
+			return dict((key, value) for key, (_, value) in self.merged.items())
+		bound = dict((key, value) for key, (_, value) in _merge([p.freeze() for p in self.parents]).items()) if self.parents else dict()
+		bound.update([arg for arg in self.args if _pair(arg)])
+		return bound
+		
+	def layers(self):
+		"Every layer under this one, once each, parents before children."
+		order, seen, stack = [], set(), [(self, False)]
+		while stack:
+			layer, expanded = stack.pop()
+			if expanded:
+				order.append(layer)
+			elif id(layer) not in seen:
+				seen.add(id(layer))
+				stack.append((layer, True))
+				stack.extend([(p, False) for p in reversed(layer.parents)])
+		return order
+		
+	def __iter__(self):
+		return chain.from_iterable([layer.args for layer in self.layers()])
+		
+	def __contains__(self, arg):
+		return any([arg in layer.args for layer in self.layers()])
+		
+	def __len__(self):
+		return sum([len(layer.args) for layer in self.layers()])
+		
+	def __eq__(self, other):
+		return list(self) == list(other)
+		
+	def __ne__(self, other):
+		return not self == other
+		
+	def __repr__(self):
+		return repr(list(self))
+		
+	def get(self, key, default=None):
+		"Latest value bound to key."
+		if self.merged is None:
+			for arg in reversed(self.args):
+				if _pair(arg) and arg[0] == key:
+					return arg[1]
+			stamped = [p.freeze().merged[key] for p in self.parents if key in p.freeze().merged]
+		else:
+			stamped = [self.merged[key]] if key in self.merged else []
+		return max(stamped, key=lambda s: s[0])[1] if stamped else default
+		
+		
+def _encode(value):
+	"json default for the definition fields that aren't plain data, such as a RegexTask's compiled pattern."
+	if hasattr(value, 'pattern'):
+		return value.pattern
+	raise TypeError("{!r} is not JSON serializable".format(value))
+
+def _outputs(tasks):
+	"digest -> stdout for the outputs these tasks handed off."
+	return dict((t.handoff[0], t.__workflow__.outputs[t.handoff[0]]) for t in tasks if t.handoff is not None)
+
+def _layer_ids(termargs, table):
+	"Number the layers under termargs into a shared table, parents first; returns the top layer's id."
+	stack, seen = [(termargs, False)], set()
+	while stack: #only as far down as layers already numbered, so shared ancestors are walked once per table
+		layer, expanded = stack.pop()
+		if expanded:
+			table[id(layer)] = (len(table), layer)
+		elif id(layer) not in table and id(layer) not in seen:
+			seen.add(id(layer))
+			stack.append((layer, True))
+			stack.extend([(p, False) for p in reversed(layer.parents) if id(p) not in table])
+	return table[id(termargs)][0]
+	
+	
 class AbstractTask(object):
 	
+	__definition__ = ('name', 'slug', 'params', 'file_filter') #set by the workflow description, so restores keep what it rebuilt
+	
 	def __init__(self,
 				 name,
 				 file_filter = None,
 				 **kwargs):
+		self.__workflow__ = workflow = current_workflow()
+		
 		#These fields get pickled in the Job state
 		self.name = name
 		self.slug = _slugify(name)
@@ -130,6 +599,9 @@ class AbstractTask(object):
 		self.stdin = ""
 		self.input_files = []
 		self.command_log = []
+		self.fingerprint = None #what it was started with
+		self.handoff = None #digest of the stdout, and the files, it passed on when it finished
+		self.passed = None #and the termargs
 		
 		#These do not
 		self.__children__ = set()
@@ -138,19 +610,22 @@ class AbstractTask(object):
 		self.__touch__ = False
 		self.__preprocessors__ = []
 		self.__postprocessors__ = []
+		self.__scheduler__ = None
+		self.__journal__ = None
+		self.__created__ = self.__order__ = workflow.next_id()
 		self.__file_filter = lambda f: True #by default, all tasks pass on all input files
 		
 		
-		global _root
-		if _root == None:
-			_root = self
+		with workflow.lock:
+			if workflow.root is None:
+				workflow.root = self
 			
 		if file_filter:
 			if isinstance(file_filter, str):
-				self.__file_filter = lambda f: fnmatch(f, file_filter)
+				self.__file_filter = _glob_filter((file_filter,))
 				self.file_filter = file_filter
 			elif hasattr(file_filter, '__iter__'):
-				self.__file_filter = lambda f: any([fnmatch(f, fil) for fil in file_filter])
+				self.__file_filter = _glob_filter(file_filter)
 				self.file_filter = str(file_filter)
 			elif callable(file_filter):
 				self.__file_filter = file_filter
@@ -158,10 +633,48 @@ class AbstractTask(object):
 			else:
 				raise ValueError("file_filter must be a string glob pattern ('*.csv'), iterable of globs, or callable")
 			
+	@property
+	def termargs(self):
+		return self.__dict__['termargs']
+		
+	@termargs.setter
+	def termargs(self, value):
+		self.__dict__['termargs'] = value if isinstance(value, Termargs) else Termargs(value)
+		
+	@property
+	def passed(self):
+		return self.__dict__.get('passed')
+		
+	@passed.setter
+	def passed(self, value):
+		"Termargs too, once restored from a journal or snapshot, which write them out flat."
+		self.__dict__['passed'] = value if value is None or isinstance(value, Termargs) else Termargs(value)
+		
+	@property
+	def status(self):
+		return self.__dict__.get('status')
+		
+	@status.setter
+	def status(self, value):
+		"Stored in the instance dict so it's still pickled; changes are reported to the scheduler and journal."
+		workflow = self.__dict__.get('__workflow__')
+		if workflow is not None:
+			workflow.lock.acquire()
+		try:
+			old = self.__dict__.get('status')
+			self.__dict__['status'] = value
+			scheduler = self.__dict__.get('__scheduler__')
+			if scheduler is not None:
+				scheduler.__transition__(self, old, value)
+			journal = self.__dict__.get('__journal__')
+			if journal is not None:
+				journal.mark(self)
+		finally:
+			if workflow is not None:
+				workflow.lock.release()
+			
 	def start(self, **kwargs):
-		"Subclasses should override start to implement features."
-		#AbstractTask should immediately complete, since it does nothing.
-		self.status = STATUS_FINISH
+		"Subclasses should override start to implement features. Returning no commands finishes the task once it's finalized."
 		return None
 	
 	@fix_stacktrace	
@@ -172,64 +685,162 @@ class AbstractTask(object):
 			raise ValueError("Graph relationships must be between Task objects; supplied type was '{}'.".format(type(parent)))
 				
 		#check for introduction of a cycle
-		self.raise_if_child(parent)
+		with _locked((self, parent)):
+			if parent not in self.__parents__:
+				self.__reorder__(parent)
+				self.__link__(parent)
+		return Relationship(parent, self)
+		
+	def __link__(self, parent):
 		parent.__children__.add(self)
 		self.__parents__.add(parent)
-		global _root
-		if _root == self:
-			_root = parent
-		return Relationship(parent, self)
+		for t in (parent, self):
+			if t.__scheduler__ is not None:
+				t.__scheduler__.stale = True
+		if self.__workflow__.root is self:
+			self.__workflow__.root = parent
 		
-	@fix_stacktrace	
-	def raise_if_child(self, potential_parent):
-		if potential_parent in self.__children__:
-			raise CycleException("Graph must remain acyclic.")
-		[c.raise_if_child(potential_parent) for c in self.__children__]
-		
-		
-	def __bind__(self, 
-		
-		
-# 	def __start__(self, *a, **kw):
-# 		self.stdout(self.stdin)
-# 		args = list(a)
-# 		self.params.update(kw)
-# 		kwargs = self.__bind__(self.termargs)
-# 		return self.start(**kwargs)
-# 		
-# 	def __bind__(self, termargs):
-# 		kwargs = defaultdict(list)
-# 		[kwargs[k].append(v) for k, v in self.params.items()]
-# 		for arg in self.termargs:
-# 			try:
-# 				key, value = arg
-# 				kwargs[key].append(value)
-# 			except ValueError:
-# 				args.append(arg)
-# 		[f(**kwargs) for f in self.__preprocessors__]
-# 		return kwargs
-# 		
-# 	def __finalize__(self, record, stdout, file_list, *args, **kwargs):
-# 		self.status = STATUS_FINISH
-# 		self.stdin += stdout
-# 		for c in self.__children__:
-# 			if not self.__conditionals__.get(c, lambda **r: True)(**dict(self.__dict__, **kwargs)):
-# 				c.status = STATUS_IGNORED
-# 			else:
-# 				c.__preload_files__(file_list)
-# 		[f(self, *args, **kwargs) for f in self.__postprocessors__]
-# 		#self.termargs.extend(self.finalize(*args, **kwargs))
-# 		[c.termargs.extend(self.termargs) for c in self.__children__]
-# 		return self
+	def __reorder__(self, parent):
+		"""
+		Keep every parent ordered before its children as an edge from parent is added,
+		reordering only the tasks in between the two (Pearce-Kelly). Raises CycleException.
+		"""
+		lower, upper = self.__order__, parent.__order__
+		if lower > upper:
+			return
+		if parent is self:
+			raise _cycle([self, self])
+		forward, via, stack = [self], {self: None}, [self]
+		while stack:
+			t = stack.pop()
+			for c in t.__children__:
+				if c is parent:
+					path = [parent]
+					while t is not None:
+						path.insert(1, t)
+						t = via[t]
+					raise _cycle(path + [parent])
+				if c not in via and c.__order__ <= upper:
+					via[c] = t
+					forward.append(c)
+					stack.append(c)
+		backward, stack = [parent], [parent]
+		seen = set(backward)
+		while stack:
+			for p in stack.pop().__parents__:
+				if p not in seen and p.__order__ >= lower:
+					seen.add(p)
+					backward.append(p)
+					stack.append(p)
+		key = lambda t: t.__order__
+		backward.sort(key=key)
+		forward.sort(key=key)
+		region = backward + forward
+		for t, order in zip(region, sorted([t.__order__ for t in region])):
+			t.__order__ = order
+		
+	def __start__(self, **kw):
+		"Hand the task its predecessors' output, bind params and termargs, run preprocessors, then start it."
+		with _timed(self, 'start'):
+			self.fingerprint = self.__fingerprint__()
+		with _timed(self, 'stdout'):
+			self.stdout(self.stdin)
+		if self.status == STATUS_FATAL: #e.g. a RegexTask that stops on a miss
+			return None
+		with _timed(self, 'start'):
+			kwargs = self.__bind__(self.termargs)
+			kwargs.update(kw)
+			[f(**kwargs) for f in self.__preprocessors__]
+			return self.start(**kwargs)
+		
+	def __bind__(self, termargs):
+		"Key-value termargs and params as keyword arguments. The task's own params win, as they do in what __finalize__ passes on."
+		if isinstance(termargs, Termargs):
+			kwargs = dict(termargs.bound())
+		else:
+			kwargs = dict([arg for arg in termargs if _pair(arg)])
+		kwargs.update(self.params)
+		return kwargs
+		
+	def __finalize__(self, record, stdout, file_list, *args, **kwargs):
+		"""
+		Pass the task's output, files and termargs on to the children whose conditions
+		hold, then mark it complete. Both happen under the workflow's lock, so no child
+		is ready before it has its inputs, or before it can be ignored.
+		"""
+		_mark(self, 'done')
+		with _timed(self, 'finalize'), _locked([self] + list(self.__children__)):
+			termargs = Termargs(chain(self.params.items(), args, kwargs.items()), [self.termargs])
+			termargs = self.finalize(termargs)
+			if not isinstance(termargs, Termargs):
+				termargs = Termargs(termargs)
+			self.handoff, self.passed = [self.__workflow__.keep(stdout), list(file_list)], termargs #kept so invalidated children can be refilled
+			self.__deliver__(self.__children__, *self.__handoff__())
+			self.status = STATUS_FINISH
+		[f(self, *args, **kwargs) for f in self.__postprocessors__]
+		return self
+		
+	def __handoff__(self):
+		"The termargs, stdout and files this task passed on to its children."
+		digest, file_list = self.handoff
+		return self.passed, self.__workflow__.outputs[digest], file_list
+		
+	def __deliver__(self, children, termargs, stdout, file_list):
+		bound = termargs.bound() #what's passed on already has the params under whatever finalize added
+		for c in children:
+			cond = self.__conditionals__.get(c)
+			with c.__workflow__.lock: #other parents may be delivering to it too
+				if cond is not None and not cond.evaluate(bound):
+					c.status = STATUS_IGNORED
+				else:
+					c.stdin += stdout
+					c.termargs.inherit(termargs)
+					c.__preload_files__(file_list)
 		
 	def finalize(self, termargs):
-		"Subclasses should override finalize to modify what termargs get passed on to children."
+		"Subclasses should override finalize to modify what termargs get passed on to children. Any iterable of args will do."
 		return termargs
 		
+	def __fingerprint__(self):
+		"Hash of the task's params and command, and the size and mtime of each of its input files."
+		files = []
+		for path in self.input_files:
+			try:
+				stat = os.stat(path)
+				files.append([path, stat.st_size, stat.st_mtime])
+			except OSError:
+				files.append([path, None, None])
+		described = [getattr(self, 'run_command', None), sorted([(k, repr(v)) for k, v in self.params.items()]), files]
+		return hashlib.sha256(json.dumps(described).encode('utf-8')).hexdigest()
+		
+	def changed(self):
+		"Tasks in this workflow that ran, but whose params or input files have changed since."
+		return [t for t in self.__tasks__().values() if t.fingerprint is not None and t.fingerprint != t.__fingerprint__()]
+		
+	def invalidate(self, changed=False):
+		"Reset this task and everything downstream of it; with changed=True, whatever's changed in its workflow instead."
+		return invalidate(self.changed() if changed else [self])
+		
+	def __reset__(self):
+		self.status = STATUS_PENDING
+		self.fingerprint = None
+		self.handoff = None
+		self.passed = None
+		self.__dict__.pop('term_error', None)
+		if 'job_id' in self.__dict__:
+			self.job_id = None
+		if self.__parents__: #a root keeps what it was given; everything else is refilled by its parents
+			self.stdin = ""
+			self.input_files = []
+			self.termargs = []
+		
+	def __accept__(self, file_list):
+		"The paths from any iterable, generators included, that this task takes as input."
+		keep = self.__file_filter
+		return [path for path in file_list if keep(path)]
+		
 	def __preload_files__(self, file_list):
-		for path in file_list:
-			if self.__file_filter(path):
-				self.input_files.append(path)
+		self.input_files.extend(self.__accept__(file_list))
 
 		
 	def stdout(self, stdoutput):
@@ -257,68 +868,164 @@ class AbstractTask(object):
 		[c.__untouch__() for c in self.__children__]
 		return self
 		
-	def __to_dict__(self):
-		s = dict()
+	def __to_dict__(self, keys=None):
+		top = keys is None
+		if top:
+			keys = dict((t, key) for key, t in self.__tasks__().items())
+		self.__hydrate__()
+		s = {'~key': keys[self]}
 		if not self.__touch__:
 			s.update(self.__dict__)
 			for key in s.keys():
 				if '__' in key:
 					del s[key]
+			for key in _LAYERED_FIELDS:
+				if s.get(key) is not None:
+					s[key] = list(s[key])
 			self.__touch__ = True
 		else:
 			s['slug'] = self.slug
-		s['~children'] = [c.__to_dict__() for c in self.__children__]
+		s['~children'] = [c.__to_dict__(keys) for c in self.__children__]
+		if top:
+			s['~outputs'] = _outputs(keys)
 		return s
 		
-	def __from_dict__(self, s):
-		for key, value in s.items():
-			if '~' not in key:
-				setattr(self, key, value)
-		for child in self.__children__:
-			for struct in s['~children']:
-				if struct['slug'] == child.name:
-					child.__from_dict__(struct)
+	def __from_dict__(self, s, lazy=False):
+		"Restore from the nested layout __to_dict__ produces, by key, regardless of which parent a task was written under."
+		flat, stack = dict(), [s]
+		while stack:
+			struct = stack.pop()
+			stack.extend(struct.get('~children', ()))
+			fields = dict((k, v) for k, v in struct.items() if '~' not in k)
+			if len(fields) > 1: #otherwise it's only a reference to a task written elsewhere
+				flat[struct.get('~key', fields['slug'])] = fields
+		flat['~outputs'] = s.get('~outputs', {})
+		return self.__from_flat__(flat, lazy)
+		
+	def __tasks__(self):
+		"""
+		Every task at or below this one, keyed by slug. Tasks that share a slug (every
+		OrmTask, say) are told apart by the order they were made in: the first keeps the
+		slug, the rest are 'slug#2', 'slug#3'..., the same each time the workflow is built.
+		"""
+		by_slug = defaultdict(list)
+		for t in _below(self):
+			by_slug[t.slug].append(t)
+		tasks = dict()
+		for slug, same in by_slug.items():
+			same.sort(key=lambda t: t.__created__)
+			tasks[slug] = same[0]
+			tasks.update([('{}#{}'.format(slug, n), t) for n, t in enumerate(same[1:], 2)])
+		return tasks
+		
+	def __to_flat__(self):
+		"""
+		State of every task below this one, keyed as __tasks__ keys them. Bulky fields are kept pre-encoded
+		under '~lazy', termargs layers are written once each under '~termargs', and the output each
+		finished task handed off once under '~outputs'.
+		"""
+		s = {'~lazy': dict()}
+		table = dict()
+		tasks = self.__tasks__()
+		for slug, t in tasks.items():
+			t.__hydrate__()
+			fields = dict((k, v) for k, v in t.__dict__.items() if '__' not in k)
+			bulky = dict((k, fields.pop(k)) for k in _LAZY_FIELDS if k in fields)
+			for key in _LAYERED_FIELDS:
+				if fields.get(key) is not None:
+					fields[key] = _layer_ids(fields[key], table)
+			s[slug] = fields
+			s['~lazy'][slug] = json.dumps(bulky, ensure_ascii=True, separators=(',', ':'), sort_keys=True)
+		s['~termargs'] = dict((str(n), [layer.args, [table[id(p)][0] for p in layer.parents]]) for n, layer in table.values())
+		s['~outputs'] = _outputs(tasks.values())
+		return s
+		
+	def __from_flat__(self, s, lazy=False):
+		"""
+		Hydrate each task once from the flat layout. A lazy restore decodes bulky fields only when
+		they're read. Definition fields aren't restored: the tasks keep what the workflow description
+		built them with, so changed() compares what they ran with against what they'd run with now.
+		"""
+		bulky = s.get('~lazy', {})
+		self.__workflow__.outputs.update(s.get('~outputs', {}))
+		layers = dict()
+		for n in sorted(s.get('~termargs', {}), key=int): #parents are numbered first
+			args, parents = s['~termargs'][n]
+			layers[int(n)] = Termargs(args, [layers[p] for p in parents])
+		for slug, t in self.__tasks__().items():
+			if slug not in s:
+				continue
+			t.__hydrate__()
+			for key, value in s[slug].items():
+				if key in t.__definition__:
+					continue
+				if key in _LAYERED_FIELDS and isinstance(value, int):
+					value = layers[value]
+				setattr(t, key, value)
+			if slug not in bulky:
+				continue
+			if lazy:
+				for key in _LAZY_FIELDS:
+					t.__dict__.pop(key, None)
+				t.__lazy__ = bulky[slug]
+			else:
+				for key, value in json.loads(bulky[slug]).items():
+					setattr(t, key, value)
 		return self
 		
+	def __hydrate__(self):
+		lazy = self.__dict__.pop('__lazy__', None)
+		if lazy is not None:
+			for key, value in json.loads(lazy).items():
+				self.__dict__.setdefault(key, value)
+		return self
+		
+	def __getattr__(self, attr):
+		"Only called for missing attributes; decodes the fields a lazy restore held back."
+		if '__lazy__' in self.__dict__ and attr in _LAZY_FIELDS:
+			self.__hydrate__()
+			if attr in self.__dict__:
+				return self.__dict__[attr]
+		raise AttributeError("'{}' object has no attribute '{}'".format(type(self).__name__, attr))
 		
 	def __serialize__(self):
-		self.__untouch__()
-		s = self.__to_dict__()
-		return json.dumps(s, ensure_ascii=True, indent=2, separators=(',', ': '), sort_keys=True)
+		s = self.__to_flat__()
+		return json.dumps(s, ensure_ascii=True, indent=2, separators=(',', ': '), sort_keys=True, default=_encode)
 		
 		
-	def __deserialize__(self, ser):
+	def __deserialize__(self, ser, lazy=False):
 		struct = json.loads(ser)
-		self.__from_dict__(struct)
-		return self
+		if '~lazy' in struct:
+			return self.__from_flat__(struct, lazy)
+		return self.__from_dict__(struct, lazy)
 	
 	@fix_stacktrace	
 	def __get_next__(self, nexts=None):
-		if nexts is None:
-			nexts = set()
-		if self.status in STATUS_FATAL:
-			raise FatalException("Task {s.name} (job id:{s.job_id}) is in a terminal failure state.".format(s=self))
-		if (self.status in STATUS_PENDING or self.status in STATUS_RUNNING) and all(map(lambda p: p.status in STATUS_FINISH, self.__parents__)):
-			nexts.add(self)
-		if self.status in STATUS_FINISH:
-			[c.__get_next__(nexts) for c in self.__children__]
-		return nexts
+		"Tasks ready to start or still running. The ready set is built once, then kept current as statuses change."
+		with self.__workflow__.lock, _timed(self, 'poll'):
+			scheduler = self.__scheduler__
+			if scheduler is None or scheduler.stale or scheduler.root is not self:
+				from scheduler import Scheduler
+				scheduler = Scheduler(self)
+			return scheduler.poll(nexts)
 		
 	def __setRunning__(self, job_id):
+		_mark(self, 'submitted')
 		self.job_id = job_id
 		self.status = STATUS_RUNNING
 		return self
 		
 	def __setFatal__(self, error_condition=None):
+		_mark(self, 'fatal')
 		self.status = STATUS_FATAL
 		self.term_error = "{};{}".format(type(error_condition), error_condition)
 		return self
 		
 	def is_root(self):
-		global _root
-		_root = self
+		with self.__workflow__.lock:
+			self.__workflow__.root = self
 		self.__scan_modules__ = lambda: scan_modules(self)
-		self.__getCommandLog__ = lambda: self.command_list
+		self.__getCommandLog__ = lambda: self.__workflow__.command_log
 		return self
 		
 	def __getJobIds__(self):
@@ -338,29 +1045,68 @@ class AbstractTask(object):
 
 class ClusterTask(AbstractTask):
 	
+	__definition__ = AbstractTask.__definition__ + ('run_command', 'modules', 'array', 'chunk_size', 'cores', 'mem')
+	
 	def __init__(self,
 				 name,
 				 run,
 				 modules=[],
+				 array=False,
+				 chunk_size=1,
+				 cores=1,
+				 mem=None,
 				 **kwargs):
 		super(ClusterTask, self).__init__(name, **kwargs)
 		self.run_command = run
 		self.job_id = None
 		self.modules = modules
+		self.array = array #submit per-input commands as one UGE task array
+		self.chunk_size = chunk_size #inputs per array element
+		self.cores = cores #each job's request; commands can use {cores}
+		self.mem = mem #GB per job, None if it needn't ask
 	
 	
-	def start(self, **kwargs):
-		params = dict()
+	def start(self, manifest_dir=None, module_cache=None, **kwargs):
+		params = dict(cores=self.cores)
 		params.update(self.params)
 		params.update(kwargs)
-		mods = '; '.join(['module load {}'.format(m) for m in self.modules])
-		if '{input}' in self.run_command:
-			command_set = set(['; '.join((mods, self.run_command.format(input=i, **params).replace('\n',' ').replace('\t',' '))) for i in self.input_files])
+		if module_cache is not None:
+			mods = module_cache.prefix(self.modules)
+		else:
+			mods = '; '.join(['module load {}'.format(m) for m in self.modules])
+		if '{input}' in self.run_command and self.array:
+			command_set = set([self.__array_command__(mods, params, manifest_dir)]) if self.input_files else set()
+		elif '{input}' in self.run_command:
+			command_set = set()
+			for i in self.input_files:
+				params['input'] = i
+				command_set.add(self.__render__(mods, params))
 		else:
-			command_set = set(('; '.join((mods, self.run_command.format(**params).replace('\n',' ').replace('\t',' ')))), ) #one-element set
-		_root.command_log.extend(command_set)
+			command_set = set([self.__render__(mods, params)])
+		self.__workflow__.log(command_set)
 		return command_set
 		
+	def __render__(self, mods, params):
+		command = self.run_command.format(**params).replace('\n',' ').replace('\t',' ')
+		return '; '.join([c for c in (mods, command) if c])
+		
+	def __array_command__(self, mods, params, manifest_dir=None):
+		"One command for a whole task array; element $SGE_TASK_ID runs over its line of the input manifest."
+		handle, self.manifest = tempfile.mkstemp(prefix=self.slug + '.', suffix='.manifest', dir=manifest_dir)
+		self.array_size = 0
+		with os.fdopen(handle, 'w') as manifest: #streamed a path at a time, chunk_size paths to a line
+			for n, path in enumerate(self.input_files):
+				if not n % self.chunk_size:
+					manifest.write('\n' if n else '')
+					self.array_size += 1
+				else:
+					manifest.write('\t')
+				manifest.write(path)
+			manifest.write('\n' if self.array_size else '')
+		command = self.__render__('', dict(params, input='"$input"'))
+		loop = 'sed -n "${{SGE_TASK_ID}}p" "{}" | tr "\\t" "\\n" | while IFS= read -r input; do {{ {}; }} || exit 1; done'.format(self.manifest, command)
+		return '; '.join([c for c in (mods, loop) if c])
+		
 	def __test__(self):
 		print('{} ["{}"]'.format(self.name, ' '.join(self.run_command.split()))) #self.run_command.replace('\t',' ').replace('\n',' ')))
 
@@ -369,7 +1115,6 @@ class NullTask(AbstractTask):
 	 
 	def __init__(self):
 		super(NullTask, self).__init__("Null task", None)
-		del self.params
 	 	
 	@property
 	def status(self):
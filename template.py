@@ -0,0 +1,161 @@
+import copy
+from array import array
+from collections import deque
+from itertools import chain
+from tasks import Termargs, Workflow, _below, STATUS_PENDING, STATUS_RUNNING, STATUS_FINISH, STATUS_FATAL, STATUS_IGNORED, FatalException
+
+STATUSES = (STATUS_PENDING, STATUS_RUNNING, STATUS_FINISH, STATUS_FATAL, STATUS_IGNORED)
+PENDING, RUNNING, FINISH, FATAL, IGNORED = range(len(STATUSES))
+
+
+class Template(object):
+	"""
+	A workflow graph frozen so one definition can back any number of runs. Tasks
+	are numbered in topological order, the root first, and edges are kept as tuples
+	of indices; nothing about a run is stored on the tasks themselves.
+	"""
+
+	def __init__(self, root):
+		self.tasks = tuple(sorted(_below(root), key=lambda t: t.__order__))
+		self.index = dict((t, i) for i, t in enumerate(self.tasks))
+		self.children = tuple([tuple(sorted([self.index[c] for c in t.__children__])) for t in self.tasks])
+		self.parents = tuple([tuple(sorted([self.index[p] for p in t.__parents__ if p in self.index])) for t in self.tasks])
+		self.conditions = dict(((self.index[t], self.index[c]), cond) for t in self.tasks for c, cond in t.__conditionals__.items() if c in self.index)
+		self.indegree = array('i', [len(p) for p in self.parents])
+		[t.__hydrate__() for t in self.tasks]
+
+	def __len__(self):
+		return len(self.tasks)
+
+	def run(self, *args, **kwargs):
+		"A fresh run; any termargs given (a record's fields, say) are handed to the root."
+		return Run(self, list(chain(args, kwargs.items())))
+
+
+class Run(object):
+	"""
+	One run of a Template: status codes, unresolved parent counts and whether each
+	task has been fed, in flat arrays, plus sparse maps for the stdin, termargs,
+	input files, job ids and errors of just the tasks that have them.
+
+	Task methods run against throwaway copies of the template's tasks that carry
+	this run's state, so the tasks' own start(), stdout() and finalize() apply.
+	Tasks that are already finished, such as NullTasks, never start: they pass on
+	what they hold as soon as the run begins, as they would under a Scheduler.
+	"""
+
+	__slots__ = ('template', 'status', 'unresolved', 'fed', 'ready', 'stdin', 'termargs', 'input_files', 'job_ids', 'errors')
+
+	def __init__(self, template, termargs=()):
+		n = len(template)
+		self.template = template
+		self.status = array('b', [PENDING]) * n
+		self.unresolved = array('i', template.indegree)
+		self.fed = array('b', [0]) * n
+		self.ready = set()
+		self.stdin = dict()
+		self.termargs = dict([(0, Termargs(termargs, [template.tasks[0].termargs]))]) if n else dict()
+		self.input_files = dict()
+		self.job_ids = dict()
+		self.errors = dict()
+		finished = [i for i, t in enumerate(template.tasks) if t.status == STATUS_FINISH] #in topological order
+		if n and 0 not in finished:
+			self.ready.add(0)
+		for i in finished:
+			t = self.task(i)
+			self.finish(i, t.stdin, t.input_files)
+
+	def task(self, i):
+		"A copy of task i with this run's state, for its methods to work on."
+		t = copy.copy(self.template.tasks[i])
+		d = t.__dict__
+		d['__scheduler__'] = d['__journal__'] = None
+		d['__workflow__'] = Workflow() #logs and locks of its own, not the definition's
+		d['__parents__'] = d['__children__'] = frozenset() #detached, so nothing reaches back into the template
+		d['status'] = STATUSES[self.status[i]]
+		root = not self.template.parents[i] #a root keeps what it was defined with
+		d['stdin'] = self.stdin.get(i, d['stdin'] if root else '')
+		d['termargs'] = self.termargs[i] if i in self.termargs else Termargs([], [d['termargs']])
+		d['input_files'] = list(self.input_files.get(i, d['input_files'] if root else ()))
+		d['command_log'] = []
+		if i in self.job_ids:
+			d['job_id'] = self.job_ids[i]
+		return t
+
+	def state(self, i):
+		return STATUSES[self.status[i]]
+
+	def poll(self):
+		"Tasks ready to start, by index. Raises FatalException once any task has failed."
+		if self.errors:
+			i = min(self.errors)
+			raise FatalException("Task {} failed in this run: {}".format(self.template.tasks[i].name, self.errors[i]))
+		return set(self.ready)
+
+	def done(self):
+		return not self.errors and not any([code in (PENDING, RUNNING) for code in self.status])
+
+	def start(self, i, **kwargs):
+		"Start task i; returns the commands it needs run. Finish it with finish() or fail()."
+		self.ready.discard(i)
+		t = self.task(i)
+		commands = t.__start__(**kwargs)
+		self.termargs[i] = t.termargs #stdout() may have added to them
+		if t.status == STATUS_FATAL:
+			self.fail(i, getattr(t, 'term_error', 'failed to start'))
+			return None
+		self.status[i] = RUNNING
+		return commands
+
+	def running(self, i, job_id):
+		self.job_ids[i] = job_id
+
+	def fail(self, i, error=None):
+		self.ready.discard(i)
+		self.status[i] = FATAL
+		self.errors[i] = error
+
+	def finish(self, i, stdout, file_list, *args, **kwargs):
+		"Task i is complete: pass its output, files and termargs on to the children whose conditions hold."
+		t = self.task(i)
+		termargs = Termargs(chain(t.params.items(), args, kwargs.items()), [t.termargs])
+		termargs = t.finalize(termargs)
+		if not isinstance(termargs, Termargs):
+			termargs = Termargs(termargs)
+		bound = termargs.bound()
+		file_list = list(file_list)
+		ignored = []
+		for c in self.template.children[i]:
+			cond = self.template.conditions.get((i, c))
+			if cond is not None and not cond.evaluate(bound):
+				ignored.append(c)
+				continue
+			child = self.template.tasks[c]
+			self.stdin[c] = self.stdin.get(c, '') + stdout
+			if c not in self.termargs:
+				self.termargs[c] = Termargs([], [child.termargs])
+			self.termargs[c].inherit(termargs)
+			self.input_files.setdefault(c, []).extend(child.__accept__(file_list))
+		self.__resolve__(i, FINISH)
+		for c in ignored:
+			if self.status[c] == PENDING:
+				self.__resolve__(c, IGNORED)
+		[f(t, *args, **kwargs) for f in t.__postprocessors__]
+
+	def __resolve__(self, i, code):
+		"Count a finished or ignored task off its children; a child whose parents were all ignored is ignored too."
+		queue = deque([(i, code)])
+		while queue:
+			i, code = queue.popleft()
+			self.status[i] = code
+			self.ready.discard(i)
+			for c in self.template.children[i]:
+				if code == FINISH:
+					self.fed[c] = 1
+				self.unresolved[c] -= 1
+				if self.unresolved[c] or self.status[c] != PENDING:
+					continue
+				if self.fed[c]:
+					self.ready.add(c)
+				else:
+					queue.append((c, IGNORED))
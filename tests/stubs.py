@@ -1,3 +1,5 @@
+from fnmatch import fnmatch
+
 class Orm(object):
 	
 	def __getattr__(self, atr):
@@ -20,4 +22,24 @@ class Meta(object):
 	
 	
 class RecordNotFoundException(Exception):
-	pass
\ No newline at end of file
+	pass
+
+
+class Session(object):
+	"An ORM session over an in-memory table of records, counting round trips."
+
+	records = {} #id -> (type, {field: value})
+	round_trips = 0
+
+	def find(self, types, offset, limit):
+		Session.round_trips += 1
+		ids = sorted([i for i, (t, _) in self.records.items() if any([fnmatch(t, pattern) for pattern in types])])
+		return ids[offset:offset + limit]
+
+	def fields(self, ids, fields):
+		Session.round_trips += 1
+		return dict((i, dict((k, v) for k, v in self.records[i][1].items() if fields is None or k in fields)) for i in ids)
+
+
+def connect():
+	return Session()
@@ -1,7 +1,12 @@
+import json
+import os
+import pickle
+import runpy
 import unittest
 from unittest import TestCase as Case
 import dag_core
 from dag_core import *
+from dag_core.tasks import Termargs
 
 TEST_PARAMETER = 'TEST_PARAMETER'
 TEST_VALUE = 'TEST_VALUE'
@@ -33,6 +38,154 @@ class TestParameterBindingOverrideCase(Task):
 		self.A.__finalize__({}, '', [], TEST_PARAMETER=TEST_NOT_VALUE)
 		self.assertIn((TEST_PARAMETER, TEST_NOT_VALUE), self.B.termargs)
 
+class TestOwnParamsCase(Case):
+
+	def testOwnParams(self):
+		"A task's own params beat inherited ones both when it runs and in what it passes on."
+		A = AbstractTask("Assemble", p=2)
+		B = ClusterTask("Filter", "filter_contigs {p}", p=1)
+		C = AbstractTask("Count")
+		B.follows(A)
+		C.follows(B)
+		A.__start__()
+		A.__finalize__({}, '', [])
+		self.assertEqual(B.__start__(), set(['filter_contigs 1']))
+		B.__finalize__({}, '', [])
+		self.assertEqual(C.termargs.get('p'), 1)
+
+class Diamond(Case):
+
+	def setUp(self):
+		self.A = A = AbstractTask("Root Task A")
+		self.B = B = AbstractTask("Task B")
+		self.C = C = AbstractTask("Task C", TEST_PARAMETER=TEST_NOT_VALUE)
+		self.D = D = AbstractTask("Task D")
+		B.follows(A)
+		C.follows(A)
+		D.follows(B)
+		D.follows(C)
+		A.__finalize__({}, '', [], 'VAL1', TEST_PARAMETER=TEST_VALUE)
+		B.__finalize__({}, '', [])
+		C.__finalize__({}, '', [])
+
+class TestSharedTermargsCase(Diamond):
+
+	def testSharedTermargs(self):
+		self.assertEqual(list(self.D.termargs).count('VAL1'), 1)
+		self.assertIs(self.B.termargs.parents[0], self.C.termargs.parents[0])
+		self.assertEqual(self.D.__bind__(self.D.termargs)[TEST_PARAMETER], self.D.termargs.get(TEST_PARAMETER))
+
+class TestFrozenTermargsCase(Diamond):
+
+	def testFrozenTermargs(self):
+		self.assertIsNotNone(self.A.passed.merged) #frozen once passed on
+		expected = dict([arg for arg in self.D.termargs if isinstance(arg, tuple) and len(arg) == 2])
+		self.assertEqual(self.D.termargs.bound(), expected) #same as reading every layer in order
+		restored = pickle.loads(pickle.dumps(self.D.termargs))
+		self.assertIsNone(restored.parents[0].merged)
+		self.assertEqual(restored.get(TEST_PARAMETER), TEST_NOT_VALUE)
+
+	def testThaw(self):
+		layer = Termargs([('x', 1)])
+		passed, child = Termargs([], [layer]).freeze(), Termargs([], [layer])
+		layer.append(('x', 2))
+		self.assertIsNone(layer.merged)
+		self.assertEqual((layer.get('x'), child.get('x'), passed.get('x')), (2, 2, 1))
+
+	def testDeep(self):
+		layer = Termargs([('depth', 0)])
+		for depth in range(1, 20000):
+			above, layer = layer, Termargs([('depth', depth)])
+			layer.parents = [above] #unfrozen, as if unpickled
+		self.assertEqual(layer.get('depth'), 19999)
+		self.assertEqual(Termargs([], [layer]).bound(), {'depth': 19999})
+
+class TestTermargsSerializeCase(Diamond):
+
+	def testTermargsSerialize(self):
+		s = self.A.__serialize__()
+		self.assertEqual(s.count('VAL1'), 1)
+		self.A.__deserialize__(s)
+		self.assertIn((TEST_PARAMETER, TEST_VALUE), self.D.termargs)
+		self.assertEqual(list(self.D.termargs).count('VAL1'), 1)
+		self.assertEqual(self.A.__serialize__(), s)
+
+
+class Inv(Case):
+
+	def setUp(self):
+		self.A = A = AbstractTask("Assemble")
+		self.B = B = AbstractTask("Annotate")
+		self.C = C = AbstractTask("Filter", filter_length=500)
+		self.D = D = AbstractTask("Count")
+		B.follows(A)
+		C.follows(A)
+		D.follows(B)
+		D.follows(C)
+		for t, out in ((A, 'contigs'), (B, 'genes'), (C, 'filtered'), (D, 'counted')):
+			t.__start__()
+			t.__finalize__({}, out + '\n', ['/path/to/{}.fasta'.format(out)])
+
+class TestInvalidateCase(Inv):
+
+	def testInvalidate(self):
+		self.assertEqual(self.C.invalidate(), [self.C, self.D])
+		self.assertEqual((self.A.status, self.B.status), (STATUS_FINISH, STATUS_FINISH))
+		self.assertEqual((self.C.status, self.D.status), (STATUS_PENDING, STATUS_PENDING))
+		self.assertEqual(self.C.input_files, ['/path/to/contigs.fasta'])
+		self.assertEqual(self.D.input_files, ['/path/to/genes.fasta'])
+		self.assertEqual(self.D.stdin, 'genes\n')
+		self.assertEqual(self.A.__get_next__(), set([self.C]))
+
+class TestInvalidateChangedCase(Inv):
+
+	def testInvalidateChanged(self):
+		self.assertEqual(self.A.changed(), [])
+		self.C.params['filter_length'] = 1000
+		self.assertEqual(self.A.changed(), [self.C])
+		self.assertEqual(self.A.invalidate(changed=True), [self.C, self.D])
+		self.C.__start__()
+		self.C.__finalize__({}, 'refiltered\n', ['/path/to/refiltered.fasta'])
+		self.assertIn(('filter_length', 1000), self.D.termargs)
+		self.assertEqual(sorted(self.D.input_files), ['/path/to/genes.fasta', '/path/to/refiltered.fasta'])
+
+class TestInvalidateRestoredCase(Inv):
+
+	def testInvalidateRestored(self):
+		self.A.__deserialize__(self.A.__serialize__(), lazy=True)
+		self.B.invalidate()
+		self.assertEqual(self.D.input_files, ['/path/to/filtered.fasta'])
+		self.assertIn(('filter_length', 500), self.D.termargs)
+		self.assertEqual(self.B.stdin, 'contigs\n')
+
+class TestChangedRestoredCase(Case):
+
+	def build(self, filter_length):
+		with Workflow():
+			root = AbstractTask("Assemble")
+			filt = ClusterTask("Filter", "filter_contigs {filter_length}", filter_length=filter_length)
+			filt.follows(root)
+		return root, filt
+
+	def testChangedRestored(self):
+		root, filt = self.build(500)
+		filt.__start__()
+		state = root.__serialize__()
+		for filter_length, changed in ((500, []), (1000, [1])):
+			root2, filt2 = self.build(filter_length)
+			root2.__deserialize__(state)
+			self.assertEqual(filt2.params, {'filter_length': filter_length}) #as the description says now
+			self.assertEqual([len(c.params) for c in root2.changed()], changed)
+
+class TestHandoffOnceCase(Inv):
+
+	def testHandoffOnce(self):
+		"Output handed off is kept once, not once per task that handed it off."
+		state, digest = json.loads(self.A.__serialize__()), self.A.handoff[0]
+		self.assertEqual(json.loads(state['~lazy']['assemble'])['handoff'], [digest, ['/path/to/contigs.fasta']])
+		self.assertEqual(state['~outputs'][digest], 'contigs\n')
+		self.assertEqual(len(state['~outputs']), 4)
+
 
 class DAG(Case):
 	
@@ -62,7 +215,7 @@ class TestSlugifyCase(DAG):
 class TestRootCase(DAG):
 
 	def testRoot(self):
-		self.assertIs(self.A, tasks._root)
+		self.assertIs(self.A, self.A.__workflow__.root)
 
 class TestStructureCase(DAG):
 
@@ -77,6 +230,85 @@ class TestSerializeCase(DAG):
 		self.A.__deserialize__(s)
 		self.assertEqual(self.A.__serialize__(), s)
 		
+class TestDuplicateSlugCase(DAG):
+
+	def build(self):
+		with Workflow():
+			root = AbstractTask("Root")
+			first, second = AbstractTask("Count"), AbstractTask("count")
+			first.follows(root)
+			second.follows(root)
+		return root, first, second
+
+	def testDuplicateSlug(self):
+		root, first, second = self.build()
+		self.assertEqual(root.__tasks__(), {'root': root, 'count': first, 'count#2': second})
+		second.status, second.fingerprint = STATUS_FINISH, 'abc'
+		for state in (root.__serialize__(), json.dumps(root.__to_dict__())):
+			root2, first2, second2 = self.build()
+			root2.__deserialize__(state)
+			self.assertEqual((first2.status, first2.fingerprint), (STATUS_PENDING, None))
+			self.assertEqual((second2.status, second2.fingerprint), (STATUS_FINISH, 'abc'))
+		self.assertEqual(root.changed(), [second])
+
+class TestSerializeExampleCase(Case):
+
+	def testSerializeExample(self):
+		"Every OrmTask is 'ORM Task' and every NullTask 'Null task'; the example still round-trips."
+		path = os.path.join(os.path.dirname(dag_core.__file__), 'assembly_example.py')
+		with Workflow():
+			root = runpy.run_path(path)['root']
+		tasks = root.__tasks__()
+		self.assertEqual(len(tasks), len(set(tasks.values())))
+		tasks['orm-task#2'].status = STATUS_FINISH
+		state = root.__serialize__()
+		with Workflow():
+			root2 = runpy.run_path(path)['root']
+		root2.__deserialize__(state)
+		restored = root2.__tasks__()
+		self.assertEqual(sorted(restored), sorted(tasks))
+		self.assertEqual([(restored[k].name, restored[k].status) for k in sorted(tasks)], [(tasks[k].name, tasks[k].status) for k in sorted(tasks)])
+		self.assertEqual((restored['orm-task'].types, restored['orm-task#2'].types), (('* sequence',), ('Assembly',)))
+
+class Restore(DAG):
+
+	def setUp(self):
+		super(Restore, self).setUp()
+		self.A.status = STATUS_FINISH
+		self.C.status = STATUS_FINISH
+		self.D.input_files.append('/path/to/a/file.fastq')
+		self.D.__setRunning__(7)
+		self.A2 = A2 = AbstractTask("Root Task A")
+		self.C2 = C2 = AbstractTask("Task C")
+		self.D2 = D2 = AbstractTask("Task D")
+		C2.follows(A2)
+		D2.follows(C2)
+
+class TestRestoreCase(Restore):
+
+	def testRestore(self):
+		self.A2.__deserialize__(self.A.__serialize__())
+		self.assertEqual(self.C2.status, STATUS_FINISH)
+		self.assertEqual(self.D2.job_id, 7)
+		self.assertEqual(self.D2.input_files, ['/path/to/a/file.fastq'])
+
+class TestLazyRestoreCase(Restore):
+
+	def testLazyRestore(self):
+		self.A2.__deserialize__(self.A.__serialize__(), lazy=True)
+		self.assertEqual(self.D2.status, STATUS_RUNNING)
+		self.assertNotIn('input_files', self.D2.__dict__)
+		self.assertEqual(self.D2.input_files, ['/path/to/a/file.fastq'])
+		self.assertIn('input_files', self.D2.__dict__)
+
+class TestNestedRestoreCase(Restore):
+
+	def testNestedRestore(self):
+		self.A.__untouch__()
+		self.A2.__from_dict__(self.A.__to_dict__())
+		self.assertEqual(self.D2.job_id, 7)
+		self.assertEqual(self.C2.status, STATUS_FINISH)
+
 class TestGetNextCase(DAG):
 	
 	def testGetNext(self):
@@ -90,7 +322,47 @@ class TestFinalizeCase(DAG):
 		self.assertEqual(self.A.status, STATUS_FINISH)
 		self.assertIn('/path/to/another/file.fasta', self.B.input_files)
 		self.assertNotIn('/path/to/a/file.fastq', self.B.input_files)
-		
+
+class TestStreamingFinalizeCase(DAG):
+
+	def testStreamingFinalize(self):
+		self.A.__finalize__({}, '', (p for p in ('/path/to/a/file.fastq', '/path/to/another/file.fasta')))
+		self.assertEqual(self.B.input_files, ['/path/to/another/file.fasta'])
+		self.assertEqual(len(self.C.input_files), 2)
+
+class TestMultiGlobCase(Case):
+
+	def testMultiGlob(self):
+		T = AbstractTask("Globs", file_filter=("*.fasta", "*_R[12].fastq", "reads/*"))
+		T.__preload_files__(iter(('a.fasta', 'a_R1.fastq', 'a_R3.fastq', 'reads/x.bam', 'a.fasta.gz')))
+		self.assertEqual(T.input_files, ['a.fasta', 'a_R1.fastq', 'reads/x.bam'])
+
+class TestCycleCase(DAG):
+
+	def testCycle(self):
+		with self.assertRaises(CycleException) as cm:
+			self.A.follows(self.D)
+		self.assertEqual(cm.exception.path, [self.D, self.A, self.C, self.D])
+		self.assertNotIn(self.D, self.A.__parents__)
+
+class TestAddEdgesCase(DAG):
+
+	def testAddEdges(self):
+		F = AbstractTask("Task F")
+		G = AbstractTask("Task G")
+		add_edges([(F, G), (self.D, F), (self.B, G)])
+		self.assertIn(G, F.__children__)
+		self.assertIn(self.D, F.__parents__)
+		self.assertLess(self.D.__order__, F.__order__)
+		self.assertLess(F.__order__, G.__order__)
+
+class TestAddEdgesCycleCase(DAG):
+
+	def testAddEdgesCycle(self):
+		F = AbstractTask("Task F")
+		self.assertRaises(CycleException, add_edges, [(self.E, F), (F, self.A)])
+		self.assertNotIn(F, self.E.__children__)
+
 class Cond(DAG):
 
 	def setUp(self):
@@ -112,6 +384,57 @@ class TestPositiveConditionalCase(Cond):
 		self.assertIn(self.D, self.A.__get_next__())
 		self.assertIn(self.E, self.A.__get_next__())
 	
+class Memo(Cond):
+
+	def setUp(self):
+		super(Memo, self).setUp()
+		self.calls = []
+		self.F = AbstractTask("Task F")
+		self.G = AbstractTask("Task G")
+		def illumina(cntn_fk_contentType, **k):
+			self.calls.append(cntn_fk_contentType)
+			return 'Illumina' in cntn_fk_contentType
+		self.F.follows(self.B).when(illumina, keys=('cntn_fk_contentType',))._else(self.G)
+
+class TestElseCase(Memo):
+
+	def testElse(self):
+		self.B.__finalize__({}, '', [], cntn_fk_contentType='Illumina Miseq', other='x')
+		self.assertNotEqual(self.F.status, STATUS_IGNORED)
+		self.assertEqual(self.G.status, STATUS_IGNORED)
+		self.assertEqual(self.calls, ['Illumina Miseq'])
+
+class TestConditionMemoCase(Memo):
+
+	def testConditionMemo(self):
+		for other in ('x', 'y', 'z'):
+			self.B.__finalize__({}, '', [], cntn_fk_contentType='Illumina Miseq', other=other)
+		self.assertEqual(self.calls, ['Illumina Miseq'])
+		self.assertEqual(self.B.__conditionals__[self.F].keys, ('cntn_fk_contentType',))
+
+class TestCatchAllConditionCase(Cond):
+
+	def testCatchAllCondition(self):
+		calls = []
+		def miseq(cntn_fk_contentType, **k):
+			calls.append(k.get('platform'))
+			return k.get('platform') == 'miseq'
+		F, G = AbstractTask("Task F"), AbstractTask("Task G")
+		F.follows(self.B).when(miseq)._else(G)
+		self.assertIsNone(self.B.__conditionals__[F].keys) #it may read anything
+		self.B.__finalize__({}, '', [], cntn_fk_contentType='Illumina', platform='miseq')
+		self.assertNotEqual(F.status, STATUS_IGNORED)
+		self.assertEqual(G.status, STATUS_IGNORED)
+		self.assertEqual(calls, ['miseq']) #once for both edges
+
+class TestCompoundConditionCase(Cond):
+
+	def testCompoundCondition(self):
+		F = AbstractTask("Task F")
+		F.follows(self.C).when(TEST_PARAMETER, TEST_VALUE)._or('OTHER', 1)._and(lambda OTHER, **k: OTHER < 2)
+		self.C.__finalize__({}, '', [], TEST_PARAMETER=TEST_NOT_VALUE, OTHER=1)
+		self.assertNotEqual(F.status, STATUS_IGNORED)
+
 class Dec(DAG):
 	
 	def setUp(self):
@@ -0,0 +1,44 @@
+import json
+import unittest
+from unittest import TestCase as Case
+from dag_core import *
+from dag_core import bench
+from dag_core.tasks import _below
+
+
+def counts(root):
+	tasks = _below(root)
+	return len(tasks), sum([len(t.__children__) for t in tasks])
+
+
+class TestShapesCase(Case):
+
+	def testShapes(self):
+		self.assertEqual(counts(bench.fan_out(50)), (50, 49))
+		self.assertEqual(counts(bench.chain(50)), (50, 49))
+		self.assertEqual(counts(bench.diamonds(19, width=8)), (19, 32))
+		tasks, edges = counts(bench.layered(100, degree=3))
+		self.assertEqual(tasks, 100)
+		self.assertLessEqual(edges, 3 * 99)
+
+class TestRunCase(Case):
+
+	def testRun(self):
+		out = json.loads(json.dumps(bench.run(['chain', 'fan_out'], [10, 20])))
+		self.assertEqual(out['skipped'], [])
+		ops = set([r['operation'] for r in out['results']])
+		self.assertEqual(ops, set(['follows', 'get_next', 'serialize', 'deserialize', 'conditions', 'finalize', 'start', 'preload_files']))
+		self.assertEqual(len(out['results']), 2 * 2 * len(ops))
+		self.assertTrue(all([r['seconds'] >= 0 for r in out['results']]))
+
+class TestBudgetCase(Case):
+
+	def testBudget(self):
+		self.assertEqual(bench.projected([(10, 1.0), (100, 100.0)], 1000), 10000.0)
+		self.assertEqual(bench.projected([(10, 1.0), (100, 1.0)], 1000), 10.0)
+		out = bench.run(['chain'], [10, 1000000], budget=0.0)
+		self.assertEqual([(s['shape'], s['size']) for s in out['skipped']], [('chain', 1000000)])
+
+
+if __name__ == "__main__":
+	unittest.main()
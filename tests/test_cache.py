@@ -0,0 +1,86 @@
+import unittest
+import os
+import shutil
+import tempfile
+import time
+from unittest import TestCase as Case
+from dag_core import *
+from dag_core.cache import ResultCache
+from dag_core.executor import LocalExecutor
+
+
+class Cac(Case):
+
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.reads = os.path.join(self.dir, 'reads.fastq')
+		with open(self.reads, 'w') as reads:
+			reads.write('@read\nACGT\n+\nIIII\n')
+		self.cache = ResultCache(os.path.join(self.dir, 'cache'))
+
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+
+	def workflow(self):
+		F = FileTask("Reads", [self.reads])
+		C = ClusterTask("Copy", "cp {input} {output}/copy.txt; echo copied")
+		R = RegexTask("Parse", r"(?P<said>copied)")
+		T = AbstractTask("Text", file_filter="*.txt")
+		C.follows(F)
+		R.follows(C)
+		T.follows(C)
+		LocalExecutor(scratch=self.dir, cache=self.cache).run(F)
+		return R, T
+
+class TestHitCase(Cac):
+
+	def testHit(self):
+		self.workflow()
+		self.assertEqual((self.cache.hits, self.cache.misses), (0, 1))
+		R, T = self.workflow()
+		self.assertEqual(self.cache.hits, 1)
+		self.assertIn(('said', 'copied'), R.termargs)
+		self.assertEqual([os.path.basename(f) for f in T.input_files], ['copy.txt'])
+		self.assertNotEqual(os.path.dirname(T.input_files[0]), os.path.join(self.dir, 'cache'))
+
+class TestChangedInputCase(Cac):
+
+	def testChangedInput(self):
+		self.workflow()
+		with open(self.reads, 'a') as reads:
+			reads.write('@read2\nTTTT\n+\nIIII\n')
+		self.workflow()
+		self.assertEqual((self.cache.hits, self.cache.misses), (0, 2))
+
+class TestEvictCase(Cac):
+
+	def testEvict(self):
+		for n, key in enumerate(('a', 'b', 'c')):
+			self.cache.put(key, '0123456789')
+			os.utime(os.path.join(self.cache.path, key, 'meta.json'), (time.time() - 100 + n,) * 2)
+		self.cache.get('a')
+		self.cache.max_bytes = 25
+		self.cache.put('d', '0123456789')
+		self.assertEqual(sorted([key for _, _, key in self.cache.entries()]), ['a', 'd'])
+		self.cache.max_age = 60
+		self.cache.evict(now=time.time() + 3600)
+		self.assertEqual(self.cache.entries(), [])
+
+class TestIndexCase(Cac):
+
+	def testIndex(self):
+		"Puts that leave the store within its limits don't list it again."
+		listed, entries = [], self.cache.entries
+		self.cache.entries = lambda: listed.append(1) or entries()
+		for n in range(20):
+			self.cache.put(str(n), '0123456789')
+		self.assertEqual(len(listed), 1)
+		self.cache.max_bytes = 100
+		self.cache.put('20', '0123456789')
+		self.assertEqual(len(listed), 2)
+		self.assertEqual(len(entries()), 10)
+		self.assertEqual(sorted(self.cache.index), sorted([key for _, _, key in entries()]))
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,78 @@
+import unittest
+import os
+import shutil
+import tempfile
+import time
+from unittest import TestCase as Case
+from dag_core import *
+from dag_core.executor import LocalExecutor
+
+
+class Loc(Case):
+
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.A = A = ClusterTask("Assemble", "echo length_1024_cov_12.5")
+		self.R = R = RegexTask("Parse Assembler Output", r"length_(?P<length>\d*)_cov_(?P<cov>\d*\.\d*)")
+		self.S = S = AbstractTask("Save")
+		A.is_root()
+		R.follows(A)
+		S.follows(R)
+		self.executor = LocalExecutor(max_workers=2, scratch=self.dir)
+
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+
+class TestRunCase(Loc):
+
+	def testRun(self):
+		self.executor.run(self.A)
+		self.assertEqual(self.S.status, STATUS_FINISH)
+		self.assertIn(('length', '1024'), self.S.termargs)
+		self.assertIn(('cov', '12.5'), self.S.termargs)
+
+class TestOrderCase(Loc):
+
+	def testOrder(self):
+		marker = os.path.join(self.dir, 'marker')
+		B = ClusterTask("Write marker", "sleep 0.2; touch {marker}", marker=marker)
+		C = ClusterTask("Read marker", "test -e {marker}", marker=marker)
+		B.follows(self.A)
+		C.follows(B)
+		self.executor.run(self.A)
+		self.assertEqual(C.status, STATUS_FINISH)
+
+class TestOutputCase(Loc):
+
+	def testOutput(self):
+		B = ClusterTask("Write output", "echo '>contig' > {output}/contigs.fasta")
+		C = AbstractTask("Filter", file_filter="*.fasta")
+		B.follows(self.A)
+		C.follows(B)
+		self.executor.run(self.A)
+		self.assertEqual([os.path.basename(f) for f in C.input_files], ['contigs.fasta'])
+
+class TestFailureCase(Loc):
+
+	def testFailure(self):
+		B = ClusterTask("Fail", "exit 3")
+		B.follows(self.A)
+		self.assertRaises(FatalException, self.executor.run, self.A)
+		self.assertEqual(B.status, STATUS_FATAL)
+
+class TestLatencyCase(Loc):
+
+	def testLatency(self):
+		B = ClusterTask("Wait", "sleep 1.5")
+		B.follows(self.A)
+		began = time.time()
+		self.executor.run(self.A)
+		self.assertLess(time.time() - began, 2.2) #noticed within max_interval of finishing
+
+	def testMaxInterval(self):
+		self.assertEqual(LocalExecutor().max_interval, 0.5)
+		self.assertEqual(LocalExecutor(max_interval=2.0).max_interval, 2.0)
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,58 @@
+import unittest
+import hashlib
+import os
+import tempfile
+from unittest import TestCase as Case
+from dag_core import *
+from dag_core import files
+from dag_core.files import digest
+
+
+class TestFileTaskCase(Case):
+
+	def testFileTask(self):
+		handle, path = tempfile.mkstemp()
+		os.write(handle, b'ACGT')
+		os.close(handle)
+		F = FileTask("Reads", [path])
+		F.__start__()
+		self.assertEqual(digest(path), F.digests[path])
+		os.remove(path)
+		self.assertEqual(F.status, STATUS_PENDING) #finished once it's finalized
+		F.__finalize__({}, '', F.input_files)
+		self.assertEqual(F.status, STATUS_FINISH)
+		self.assertEqual(F.digests, {path: hashlib.sha256(b'ACGT').hexdigest()})
+
+class TestMissingFileCase(Case):
+
+	def testMissingFile(self):
+		F = FileTask("Reads", ['/path/to/nowhere.fastq'])
+		F.__start__()
+		self.assertEqual(F.status, STATUS_FATAL)
+
+class TestDigestBoundCase(Case):
+
+	def setUp(self):
+		self.max_digests, files._MAX_DIGESTS = files._MAX_DIGESTS, 2
+		self.dir = tempfile.mkdtemp()
+
+	def tearDown(self):
+		files._MAX_DIGESTS = self.max_digests
+		[os.remove(os.path.join(self.dir, name)) for name in os.listdir(self.dir)]
+		os.rmdir(self.dir)
+
+	def testDigestBound(self):
+		paths = [os.path.join(self.dir, str(n)) for n in range(3)]
+		for path in paths:
+			with open(path, 'w') as f:
+				f.write(path)
+		digest(paths[0])
+		digest(paths[1])
+		digest(paths[0]) #used again, so paths[1] goes first
+		digest(paths[2])
+		self.assertEqual([memo[0] for memo in files._digests], [paths[0], paths[2]])
+		self.assertEqual(digest(paths[1]), hashlib.sha256(paths[1].encode('utf-8')).hexdigest())
+
+
+if __name__ == "__main__":
+	unittest.main()
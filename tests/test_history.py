@@ -0,0 +1,85 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import TestCase as Case
+from dag_core import *
+from dag_core.runner import Runner, FakeBackend
+
+
+class His(Case):
+
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		with Workflow():
+			self.root = root = AbstractTask("Root")
+			self.longs, parent = [], root
+			for i in range(3):
+				t = ClusterTask("Long {}".format(i), "spades.py --pass {}".format(i))
+				t.follows(parent)
+				self.longs.append(t)
+				parent = t
+			self.shorts = [ClusterTask("Short {}".format(i), "echo {}".format(i)) for i in range(8)]
+			[t.follows(root) for t in self.shorts]
+		self.durations = dict([(t.slug, 10) for t in self.longs] + [(t.slug, 2) for t in self.shorts])
+
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+
+	def history(self, long, short):
+		history = RuntimeHistory()
+		[history.record(t, long, 0) for t in self.longs]
+		[history.record(t, short, 0) for t in self.shorts]
+		return history
+
+	def makespan(self, history):
+		"Polls until the workflow is done, with two job slots."
+		for t in [self.root] + self.longs + self.shorts:
+			t.__reset__()
+		runner = Runner(FakeBackend(durations=self.durations), max_jobs=2, interval=0, history=history).add(self.root)
+		steps = 0
+		while runner.workflows:
+			runner.step()
+			steps += 1
+		return steps
+
+class TestMakespanCase(His):
+
+	def testMakespan(self):
+		informed = self.makespan(self.history(10.0, 2.0))
+		misled = self.makespan(self.history(1.0, 20.0))
+		self.assertLessEqual(informed, 3 * 10 + 1) #the long chain never waits for a slot
+		self.assertLess(informed, misled)
+
+class TestPrioritiesCase(His):
+
+	def testPriorities(self):
+		longest = self.history(10.0, 2.0).priorities(self.root)
+		self.assertEqual(longest[self.root], 30.0)
+		self.assertEqual(longest[self.longs[1]], 20.0)
+		self.assertEqual(longest[self.shorts[0]], 2.0)
+		self.assertEqual(RuntimeHistory(default=5.0).priorities(self.root)[self.root], 15.0)
+
+class TestEstimateCase(His):
+
+	def testEstimate(self):
+		history = RuntimeHistory(keep=3)
+		t = self.shorts[0]
+		[history.record(t, seconds, 100) for seconds in (50.0, 1.0, 2.0, 3.0)]
+		self.assertEqual(history.samples[t.slug], [[100, 1.0], [100, 2.0], [100, 3.0]])
+		self.assertEqual(history.estimate(t), 2.0)
+		self.assertEqual(history.estimate(t, 400), 8.0)
+		self.assertEqual(history.estimate(self.root), 0.0)
+
+class TestRecordedCase(His):
+
+	def testRecorded(self):
+		path = os.path.join(self.dir, 'history.json')
+		Runner(FakeBackend(), interval=0, history=RuntimeHistory(path)).add(self.root).run()
+		history = RuntimeHistory(path)
+		self.assertEqual(sorted(history.samples), sorted([t.slug for t in self.longs + self.shorts]))
+		self.assertTrue(all([len(s) == 1 and s[0][1] >= 0 for s in history.samples.values()]))
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,95 @@
+import json
+import unittest
+import os
+import shutil
+import tempfile
+from unittest import TestCase as Case
+from dag_core import *
+from dag_core.journal import Journal
+
+
+def workflow():
+	A = AbstractTask("Root Task A")
+	B = AbstractTask("Task B", file_filter="*fasta")
+	C = AbstractTask("Task C")
+	A.is_root()
+	B.follows(A)
+	C.follows(A)
+	return A, B, C
+
+
+class Jour(Case):
+
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.path = os.path.join(self.dir, 'state.journal')
+		self.A, self.B, self.C = workflow()
+		self.journal = Journal(self.A, self.path, compact_every=5).flush()
+
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+
+	def lines(self):
+		with open(self.path) as journal:
+			return journal.readlines()
+
+class TestAppendCase(Jour):
+
+	def testAppend(self):
+		self.A.status = STATUS_FINISH
+		self.journal.flush()
+		self.B.__setRunning__(42)
+		self.journal.flush()
+		self.assertEqual(len(self.lines()), 4) #snapshot, A status, B job_id and status
+		self.assertIn('["task-b","job_id",42]\n', self.lines())
+
+class TestReplayCase(Jour):
+
+	def testReplay(self):
+		self.A.__finalize__({}, 'contigs\n', ['/path/to/file.fasta'], sample='S1')
+		self.journal.flush()
+		self.C.__setFatal__(ValueError('bad'))
+		self.journal.flush()
+		A, B, C = workflow()
+		Journal(A, self.path).replay()
+		self.assertEqual(A.__serialize__(), self.A.__serialize__())
+		self.assertEqual(C.status, STATUS_FATAL)
+
+class TestReplayInvalidateCase(Jour):
+
+	def testReplayInvalidate(self):
+		self.journal.compact_every = 1000 #so passed is replayed from a record, not a snapshot
+		self.A.__finalize__({}, 'contigs', ['/path/to/a.fasta'], sample='S1')
+		self.journal.flush()
+		A, B, C = workflow()
+		Journal(A, self.path).replay()
+		B.invalidate() #refilled from what A passed on
+		self.assertEqual(B.termargs.get('sample'), 'S1')
+		self.assertEqual((B.stdin, B.input_files), ('contigs', ['/path/to/a.fasta']))
+
+class TestReferencesCase(Jour):
+
+	def testReferences(self):
+		"Records hold scalar state and references; output is written once, and children's inputs not at all."
+		self.journal.compact_every = 1000
+		self.A.__finalize__({}, 'contigs\n' * 1000, ['/path/to/a.fasta'], sample='S1')
+		self.journal.flush()
+		records = [json.loads(line) for line in self.lines()[1:]]
+		self.assertEqual(sorted([field for key, field, _ in records if key == 'root-task-a']), ['handoff', 'passed', 'status'])
+		self.assertEqual([key for key, _, _ in records if key not in ('root-task-a', '~termargs', '~outputs')], [])
+		self.assertEqual(len([line for line in self.lines()[1:] if 'contigs' in line]), 1)
+
+class TestCompactCase(Jour):
+
+	def testCompact(self):
+		for n in range(6):
+			self.B.__setRunning__(n)
+			self.journal.flush()
+		self.assertEqual(len(self.lines()), 3)
+		A, B, C = workflow()
+		Journal(A, self.path).replay()
+		self.assertEqual(B.job_id, 5)
+
+
+if __name__ == "__main__":
+	unittest.main()
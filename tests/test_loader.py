@@ -0,0 +1,155 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from unittest import TestCase as Case
+from dag_core import *
+from dag_core.loader import WorkflowLoader
+from tests.test_template import drive
+
+SOURCE = '''
+from dag_core import AbstractTask, ClusterTask, RegexTask
+
+threshold = {threshold}
+
+def big(contigs, **k):
+	return int(contigs) > threshold
+
+record = AbstractTask("Record")
+assemble = ClusterTask("Assemble", "spades.py --sample {{sample}}")
+parse = RegexTask("Parse", r"contigs_(?P<contigs>\\d+)")
+report = AbstractTask("Report", file_filter=("*.fasta", "*.fa"))
+small = AbstractTask("Small")
+assemble.follows(record)
+parse.follows(assemble)
+report.follows(parse).when(big)._else(small)
+save = AbstractTask("Save").follows(parse)
+'''
+
+
+class Load(Case):
+
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.source = os.path.join(self.dir, 'workflow.py')
+		self.write(3)
+		self.outputs = dict(('spades.py --sample {}'.format(n), 'contigs_{}\n'.format(n)) for n in range(10))
+
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+
+	def write(self, threshold):
+		with open(self.source, 'w') as f:
+			f.write(SOURCE.format(threshold=threshold))
+
+	def loader(self):
+		return WorkflowLoader(os.path.join(self.dir, 'compiled'))
+
+	def report(self, template, sample):
+		run = drive(template.run(sample=sample), self.outputs)
+		names = [t.name for t in template.tasks]
+		return run.state(names.index("Report")), run.state(names.index("Small")), run.input_files.get(names.index("Report"))
+
+class TestMemoryHitCase(Load):
+
+	def testMemoryHit(self):
+		loader = self.loader()
+		first = loader.load(self.source)
+		self.assertIs(loader.load(self.source), first)
+		self.assertEqual((loader.misses, loader.hits), (1, 1))
+
+class TestDiskHitCase(Load):
+
+	def testDiskHit(self):
+		compiled = self.loader().load(self.source)
+		loader = self.loader()
+		template = loader.load(self.source)
+		self.assertEqual((loader.misses, loader.hits), (0, 1))
+		self.assertIsNot(template, compiled)
+		self.assertEqual([t.name for t in template.tasks], [t.name for t in compiled.tasks])
+		self.assertIs(template.tasks[0].__workflow__.root, template.tasks[0])
+		self.assertEqual(self.report(template, 7)[:2], (STATUS_FINISH, STATUS_IGNORED))
+		self.assertEqual(self.report(template, 2)[:2], (STATUS_IGNORED, STATUS_FINISH))
+		self.assertEqual(len(self.report(template, 7)[2]), 1)
+
+class TestInvalidateCase(Load):
+
+	def testInvalidate(self):
+		self.assertEqual(self.report(self.loader().load(self.source), 5)[0], STATUS_FINISH)
+		self.write(6)
+		loader = self.loader()
+		template = loader.load(self.source)
+		self.assertEqual(loader.misses, 1)
+		self.assertEqual(self.report(template, 5)[0], STATUS_IGNORED)
+
+class TestFreshProcessCase(Load):
+
+	def testFreshProcess(self):
+		self.loader().load(self.source)
+		script = ("from dag_core.loader import WorkflowLoader; import time; l = WorkflowLoader({!r}); "
+				  "t = time.time(); l.load({!r}); print(l.hits, time.time() - t)").format(os.path.join(self.dir, 'compiled'), self.source)
+		out = subprocess.check_output([sys.executable, '-c', script], env=dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path)))
+		self.assertTrue(out.startswith('(1, '))
+
+class TestDependencyCase(Load):
+
+	def setUp(self):
+		super(TestDependencyCase, self).setUp()
+		self.helper = os.path.join(self.dir, 'contig_rules.py')
+		with open(self.helper, 'w') as f:
+			f.write('threshold = 3\n')
+		with open(self.source, 'a') as f:
+			f.write('import contig_rules\n')
+		sys.path.insert(0, self.dir)
+
+	def tearDown(self):
+		sys.path.remove(self.dir)
+		sys.modules.pop('contig_rules', None)
+		super(TestDependencyCase, self).tearDown()
+
+	def testDependency(self):
+		"Editing a module the description imports invalidates it, in memory and on disk."
+		self.loader().load(self.source)
+		loader = self.loader()
+		loader.load(self.source)
+		self.assertEqual((loader.misses, loader.hits), (0, 1))
+		with open(self.helper, 'w') as f:
+			f.write('threshold = 30\n')
+		os.utime(self.helper, (time.time() + 10,) * 2)
+		loader.load(self.source)
+		self.assertEqual((loader.misses, loader.hits), (1, 1))
+		fresh = self.loader()
+		fresh.load(self.source)
+		self.assertEqual((fresh.misses, fresh.hits), (0, 1))
+
+class TestBoundedCase(Load):
+
+	def testBounded(self):
+		other = os.path.join(self.dir, 'other.py')
+		shutil.copy(self.source, other)
+		with open(other, 'a') as f:
+			f.write('extra = AbstractTask("Extra").follows(save)\n')
+		loader = WorkflowLoader(max_compiled=1)
+		first = loader.load(self.source)
+		loader.load(other)
+		self.assertEqual(len(loader.compiled), 1)
+		self.assertIsNot(loader.load(self.source), first)
+		self.assertEqual(loader.misses, 3)
+
+class TestUnpicklableCase(Load):
+
+	def testUnpicklable(self):
+		with open(self.source, 'a') as f:
+			f.write('import threading\nreport.lock = threading.Lock()\n')
+		self.loader().load(self.source)
+		loader = self.loader()
+		loader.load(self.source)
+		self.assertEqual(loader.misses, 1)
+		self.assertEqual(os.listdir(os.path.join(self.dir, 'compiled')), [])
+
+
+if __name__ == "__main__":
+	unittest.main()
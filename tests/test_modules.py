@@ -0,0 +1,104 @@
+import unittest
+import os
+import shutil
+import subprocess
+import tempfile
+from unittest import TestCase as Case
+from dag_core import *
+from dag_core.modules import ModuleCache
+from dag_core.tasks import module_sets, scan_modules
+
+FAKE_MODULECMD = """#!/bin/sh
+echo "$@" >> "$(dirname "$0")/calls"
+f="$MODULEPATH/$3"
+[ -d "$f" ] && f=$(ls "$f"/* | head -n 1)
+[ -f "$f" ] && cat "$f" || echo false
+"""
+
+
+class Mod(Case):
+
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.modulepath = os.path.join(self.dir, 'modulefiles')
+		os.makedirs(os.path.join(self.modulepath, 'bwa'))
+		self.write('spades', 'export SPADES_HOME=/opt/spades\n')
+		self.write('bwa/0.7', 'export BWA_VERSION=0.7\n')
+		modulecmd = os.path.join(self.dir, 'modulecmd')
+		with open(modulecmd, 'w') as f:
+			f.write(FAKE_MODULECMD)
+		os.chmod(modulecmd, 0o755)
+		self.init = 'MODULEPATH={}; export MODULEPATH; module() {{ eval "$({} sh "$@")"; }}'.format(self.modulepath, modulecmd)
+		self.cache = self.module_cache()
+
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+
+	def write(self, name, text):
+		with open(os.path.join(self.modulepath, name), 'w') as f:
+			f.write(text)
+
+	def module_cache(self):
+		return ModuleCache(os.path.join(self.dir, 'snapshots'), init=self.init, modulepath=self.modulepath)
+
+	def calls(self):
+		with open(os.path.join(self.dir, 'calls')) as f:
+			return len(f.readlines())
+
+class TestSnapshotCase(Mod):
+
+	def testSnapshot(self):
+		prefix = self.cache.prefix(('spades', 'bwa'))
+		self.assertEqual(prefix, self.cache.prefix(['spades', 'bwa']))
+		self.assertEqual(self.calls(), 2)
+		out = subprocess.check_output(['sh', '-c', prefix + '; echo $SPADES_HOME $BWA_VERSION'], universal_newlines=True)
+		self.assertEqual(out.split(), ['/opt/spades', '0.7'])
+
+class TestModulefileChangedCase(Mod):
+
+	def testModulefileChanged(self):
+		first = self.cache.snapshot(('spades',))
+		self.assertEqual(self.module_cache().snapshot(('spades',)), first)
+		self.write('spades', 'export SPADES_HOME=/opt/spades-3.13\n')
+		os.utime(os.path.join(self.modulepath, 'spades'), (1, 1))
+		second = self.module_cache().snapshot(('spades',))
+		self.assertNotEqual(second, first)
+		with open(second) as snapshot:
+			self.assertIn('/opt/spades-3.13', snapshot.read())
+
+class TestModulefileChangedInProcessCase(Mod):
+
+	def testModulefileChangedInProcess(self):
+		first = self.cache.snapshot(('spades',))
+		self.write('spades', 'export SPADES_HOME=/opt/spades-3.13\n')
+		os.utime(os.path.join(self.modulepath, 'spades'), (1, 1))
+		second = self.cache.snapshot(('spades',))
+		self.assertNotEqual(second, first)
+		self.assertEqual(self.cache.prefix(('spades',)), '. ' + second)
+		with open(second) as snapshot:
+			self.assertIn('/opt/spades-3.13', snapshot.read())
+
+class TestMissingModuleCase(Mod):
+
+	def testMissingModule(self):
+		self.assertIsNone(self.cache.snapshot(('nope',)))
+		self.assertEqual(self.cache.prefix(('nope',)), 'module load nope')
+
+class TestClusterTaskCase(Mod):
+
+	def testClusterTask(self):
+		A = ClusterTask("Assemble", "spades.py", modules=['spades'])
+		B = ClusterTask("Align", "bwa mem", modules=['bwa/0.7', 'spades'])
+		C = ClusterTask("Count", "grep -c '>'", modules=['spades'])
+		B.follows(A)
+		C.follows(A)
+		C.follows(B)
+		self.assertEqual(module_sets(A), set([('spades',), ('bwa/0.7', 'spades')]))
+		self.assertEqual(scan_modules(A), set(['spades', 'bwa/0.7']))
+		self.assertEqual(len(self.cache.prepare(A)), 2)
+		command, = C.start(module_cache=self.cache)
+		self.assertEqual(command, '. {}; grep -c \'>\''.format(self.cache.snapshot(['spades'])))
+
+
+if __name__ == "__main__":
+	unittest.main()
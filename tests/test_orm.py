@@ -0,0 +1,65 @@
+import unittest
+from unittest import TestCase as Case
+from dag_core import *
+from dag_core.orm import SessionPool, referenced_fields
+from dag_core.template import Template
+from dag_core.tests.stubs import Session, connect
+
+
+class Bulk(Case):
+
+	def setUp(self):
+		Session.records = dict((n, ('miseq sequence', {'SEQ_MISEQ_FORWARD': '/reads/{}_R1.fastq'.format(n), 'platform': 'miseq', 'notes': 'x' * 1000})) for n in range(1200))
+		Session.records[5000] = ('isolate', {'notes': ''})
+		Session.round_trips = 0
+		self.O = O = OrmTask('* sequence', batch_size=500, pool=SessionPool(connect, size=2))
+		self.A = A = ClusterTask("Assemble", "spades.py -1 {SEQ_MISEQ_FORWARD} -o {output}")
+		A.follows(O).when('platform', 'miseq')
+
+class TestReferencedFieldsCase(Bulk):
+
+	def testReferencedFields(self):
+		self.assertEqual(referenced_fields(self.O), set(['SEQ_MISEQ_FORWARD', 'platform']))
+		B = AbstractTask("Report")
+		B.follows(self.A).when(lambda platform, **k: k.get('notes'))
+		self.assertIsNone(referenced_fields(self.O))
+
+class TestBatchesCase(Bulk):
+
+	def testBatches(self):
+		records = list(self.O.records())
+		self.assertEqual(len(records), 1200)
+		self.assertEqual(Session.round_trips, 3)
+		self.assertEqual(records[7].SEQ_MISEQ_FORWARD, '/reads/7_R1.fastq')
+		self.assertEqual(records[499].platform, 'miseq')
+		self.assertEqual(Session.round_trips, 4)
+		self.assertEqual(records[0].items(), [('SEQ_MISEQ_FORWARD', '/reads/0_R1.fastq'), ('platform', 'miseq')])
+
+class TestReadOnlyCase(Bulk):
+
+	def testReadOnly(self):
+		record = next(self.O.records())
+		self.assertRaises(AttributeError, setattr, record, 'platform', 'nextseq')
+		self.assertRaises(AttributeError, getattr, record, 'notes')
+		self.assertFalse(hasattr(record, '__dict__'))
+
+class TestRunPerRecordCase(Bulk):
+
+	def testRunPerRecord(self):
+		template = Template(self.O)
+		runs = [template.run(*record.items()) for record in self.O.records()]
+		run = runs[7]
+		run.start(0)
+		run.finish(0, '', [])
+		assemble = template.index[self.A]
+		self.assertEqual(run.poll(), set([assemble]))
+		self.assertIn(('SEQ_MISEQ_FORWARD', '/reads/7_R1.fastq'), run.termargs[assemble])
+
+class TestNoConnectCase(Case):
+
+	def testNoConnect(self):
+		self.assertRaises(ValueError, SessionPool, None)
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -1,6 +1,19 @@
 import unittest
+import os
+import re
+import tempfile
 from unittest import TestCase as Case
-from regex import RegexTask, STATUS_FATAL
+from regex import RegexTask, AbstractTask, STATUS_FATAL, _scan, _fusable
+
+class Collector(object):
+
+	done = False
+
+	def __init__(self):
+		self.found = []
+
+	def add(self, mtch):
+		self.found.append(mtch.group())
 
 class Reg(Case):
 	
@@ -21,4 +34,122 @@ class TestNonMatchCase(Reg):
 	def testNonMatch(self):
 		self.R.stdout("PARAMETER")
 		self.assertNotIn(("PARAM","PARAMETER"), self.R.termargs)
-		self.assertEqual(self.R.status, STATUS_FATAL)
\ No newline at end of file
+		self.assertEqual(self.R.status, STATUS_FATAL)
+
+HEADERS = ''.join(['>NODE_{0}_length_{1}_cov_{2}.5\nACGT\n'.format(n, 100 * n, n) for n in range(1, 201)])
+
+class Stream(Case):
+
+	def setUp(self):
+		self.R = RegexTask("Parse Contigs",
+						   r"length_(?P<length>\d+)_cov_(?P<cov>\d+\.\d+)",
+						   aggregate={'length': 'sum', 'cov': 'mean'},
+						   chunk_size=7, overlap=32)
+
+class TestChunkBoundaryCase(Stream):
+
+	def testChunkBoundary(self):
+		chunks = [HEADERS[i:i + 13] for i in range(0, len(HEADERS), 13)]
+		self.assertEqual([m.group() for m in self.R.__finditer__(chunks)], [m.group() for m in self.R.regex.finditer(HEADERS)])
+
+class TestEndAnchorCase(Case):
+
+	def testEndAnchor(self):
+		"Without MULTILINE, $ only matches at the very end, not before the newline each chunk ends on."
+		text = '1\n22\n333\n'
+		R = RegexTask("Last", r"(?P<n>\d+)$")
+		for size in (2, 3, 4):
+			chunks = [text[i:i + size] for i in range(0, len(text), size)]
+			self.assertEqual([m.group() for m in R.__finditer__(chunks)], ['333'])
+		self.assertEqual([m.group() for m in R.__finditer__(text.splitlines(True))], ['333'])
+
+class TestUnparsedCase(Case):
+
+	def testUnparsed(self):
+		R = RegexTask("Parse Contigs", r"cov_(?P<cov>[\d.]+)", aggregate='mean')
+		R.stdout('>NODE_1_cov_2.0\n>NODE_2_cov_.\n>NODE_3_cov_4.0\n')
+		self.assertIn(('cov', 3.0), R.termargs)
+
+class TestAggregateCase(Stream):
+
+	def testAggregate(self):
+		self.R.stdout(iter(HEADERS.splitlines(True)))
+		self.assertIn(('length', sum(range(100, 20001, 100))), self.R.termargs)
+		self.assertIn(('cov', 101.0), self.R.termargs)
+
+class TestCountCase(Case):
+
+	def testCount(self):
+		R = RegexTask("Count Contigs", r"^>(?P<contigs>NODE)", aggregate='count')
+		R.stdout(HEADERS)
+		self.assertIn(('contigs', 1), R.termargs)
+		R = RegexTask("Count Contigs", r"(?m)^>(?P<contigs>NODE)", aggregate='count', chunk_size=5)
+		R.stdout(HEADERS.splitlines(True))
+		self.assertIn(('contigs', 200), R.termargs)
+
+class TestScanFilesCase(Stream):
+
+	def testScanFiles(self):
+		handle, path = tempfile.mkstemp(suffix='.fasta')
+		with os.fdopen(handle, 'w') as contigs:
+			contigs.write(HEADERS)
+		self.R.scan_files = True
+		self.R.input_files = [path]
+		self.R.__start__()
+		os.remove(path)
+		self.assertIn(('cov', 101.0), self.R.termargs)
+
+class TestBadAggregateCase(Case):
+
+	def testBadAggregate(self):
+		self.assertRaises(ValueError, RegexTask, "Bad", r"(?P<x>.)", aggregate={'x': 'median'})
+
+class Fuse(Case):
+
+	def setUp(self):
+		self.P = AbstractTask("Assemble")
+		self.A = RegexTask("Node", r"NODE_(?P<node>\d+)_length")
+		self.B = RegexTask("Length", r"length_(?P<length>\d+)", aggregate='sum')
+		self.C = RegexTask("Warnings", r"(?P<warning>WARNING.*)", stop_on_miss=True)
+		for task in (self.A, self.B, self.C):
+			task.follows(self.P)
+			task.stdin = HEADERS
+
+class TestFusedScanCase(Fuse):
+
+	def testFusedScan(self):
+		self.A.stdout(self.A.stdin)
+		self.assertIsNotNone(self.B.__fused__)
+		self.assertIsNotNone(self.C.__fused__)
+		self.B.stdout(self.B.stdin)
+		self.C.stdout(self.C.stdin)
+		self.assertEqual(list(self.A.termargs), [('node', '1')])
+		self.assertEqual(list(self.B.termargs), [('length', sum(range(100, 20001, 100)))])
+		self.assertEqual(self.C.status, STATUS_FATAL)
+		self.assertNotEqual(self.B.status, STATUS_FATAL)
+
+class TestFusedUnicodeCase(Fuse):
+
+	def testFusedUnicode(self):
+		for task in (self.A, self.B, self.C):
+			task.stdin = u'' + HEADERS #as restored from JSON
+		self.assertEqual(self.A.__chunks__(self.A.stdin), (self.A.stdin,))
+		self.A.stdout(self.A.stdin)
+		self.assertIsNotNone(self.B.__fused__)
+		self.B.stdout(self.B.stdin)
+		self.assertEqual(list(self.B.termargs), [('length', sum(range(100, 20001, 100)))])
+
+class TestFusedMatchesCase(Case):
+
+	def testFusedMatches(self):
+		text = 'ab12 cd34 ab56\n' * 50
+		regexes = [re.compile(r'ab\d+ cd'), re.compile(r'\d+'), re.compile(r'(?m)^ab')]
+		collectors = [Collector() for r in regexes[:2]]
+		_scan(regexes[:2], [text[i:i + 9] for i in range(0, len(text), 9)], 32, collectors)
+		self.assertEqual(collectors[0].found, [m.group() for m in regexes[0].finditer(text)])
+		self.assertEqual(collectors[1].found, [m.group() for m in regexes[1].finditer(text)])
+		self.assertFalse(_fusable(regexes[1:]))
+
+
+if __name__ == "__main__":
+	unittest.main()
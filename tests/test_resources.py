@@ -0,0 +1,87 @@
+import unittest
+from unittest import TestCase as Case
+from dag_core import *
+from dag_core.runner import Runner, FakeCluster
+from dag_core.uge import UGE
+
+
+def workflow(name, big=2, small=10, big_cores=12):
+	with Workflow():
+		root = AbstractTask(name)
+		bigs = [ClusterTask("{} big {}".format(name, i), "spades.py -t {cores}", cores=big_cores, mem=48) for i in range(big)]
+		smalls = [ClusterTask("{} small {}".format(name, i), "count {}".format(i), cores=2, mem=4) for i in range(small)]
+		[t.follows(root) for t in bigs + smalls]
+	return root, bigs, smalls
+
+
+class Res(Case):
+
+	def setUp(self):
+		self.root, self.bigs, self.smalls = workflow("Sample")
+		durations = dict([(t.slug, 10) for t in self.bigs] + [(t.slug, 2) for t in self.smalls])
+		self.cluster = FakeCluster(16, mem=64, durations=durations)
+
+class TestPackedCase(Res):
+
+	def testPacked(self):
+		runner = Runner(self.cluster, interval=0, budget=ResourceBudget(cores=16, mem=64)).add(self.root).run()
+		self.assertEqual(runner.finished, [self.root])
+		self.assertLessEqual(max(self.cluster.busy), 16)
+		self.assertTrue(any([busy == 16 for busy in self.cluster.busy])) #small jobs filled in beside a big one
+		self.assertLess(len(self.cluster.busy), 10 + 10 + 2 + 2) #fewer polls than the big jobs, then the small ones
+
+class TestOversubscribedCase(Res):
+
+	def testOversubscribed(self):
+		runner = Runner(self.cluster, interval=0).add(self.root).run()
+		self.assertIsInstance(runner.failed[self.root], OSError) #without a budget, more is submitted than fits
+
+class TestTooBigCase(Res):
+
+	def testTooBig(self):
+		runner = Runner(self.cluster, interval=0, budget=ResourceBudget(cores=8)).add(self.root).run()
+		self.assertIn(self.root, runner.failed)
+		self.assertEqual(self.bigs[0].status, STATUS_FATAL)
+
+class TestArrayClaimCase(Case):
+
+	def testArrayClaim(self):
+		"An array of three 4-core elements takes 12 cores, so only one of two 4-core jobs fits beside it in 16."
+		with Workflow():
+			root = AbstractTask("Sample")
+			array = ClusterTask("Trim", "fastx_trimmer -i {input}", array=True, chunk_size=2, cores=4)
+			array.input_files = ['/reads/{}.fastq'.format(n) for n in range(6)]
+			others = [ClusterTask("Count {}".format(i), "count {}".format(i), cores=4) for i in range(2)]
+			[t.follows(root) for t in [array] + others]
+		cluster = FakeCluster(16, durations={array.slug: 3})
+		runner = Runner(cluster, interval=0, budget=ResourceBudget(cores=16)).add(root).run()
+		self.assertEqual(runner.finished, [root])
+		self.assertEqual(cluster.busy[0], 16)
+		self.assertLessEqual(max(cluster.busy), 16)
+
+class TestPerUserCase(Case):
+
+	def testPerUser(self):
+		alice, _, _ = workflow("Alice", big=0, small=6)
+		bob, _, _ = workflow("Bob", big=0, small=6)
+		budget = ResourceBudget(cores=16, users={'alice': (4, None)})
+		runner = Runner(FakeCluster(16, polls=2), interval=0, budget=budget).add(alice, user='alice').add(bob, user='bob')
+		peak = dict(alice=0, total=0)
+		while runner.workflows:
+			runner.step()
+			peak['alice'] = max(peak['alice'], budget.used['alice'][0])
+			peak['total'] = max(peak['total'], budget.used[None][0])
+		self.assertEqual(peak, dict(alice=4, total=16))
+		self.assertEqual(budget.used[None], [0, 0])
+
+class TestRenderCase(Case):
+
+	def testRender(self):
+		task = ClusterTask("Assemble", "spades.py -t {cores}", cores=8, mem=32)
+		self.assertEqual(task.start(), set(['spades.py -t 8']))
+		self.assertEqual(UGE().__resources__(task), ['-pe', 'smp', '8', '-l', 'h_vmem=4G'])
+		self.assertEqual(UGE(pe='threads').__resources__(ClusterTask("Count", "grep")), [])
+
+
+if __name__ == "__main__":
+	unittest.main()
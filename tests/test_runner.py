@@ -0,0 +1,85 @@
+import unittest
+from unittest import TestCase as Case
+from dag_core import *
+from dag_core.runner import Runner, FakeBackend
+
+
+def workflow(n):
+	root = AbstractTask("Root {}".format(n))
+	assemble = ClusterTask("Assemble {}".format(n), "spades.py -t 8")
+	count = ClusterTask("Count {}".format(n), "grep '^>' contigs.fasta")
+	assemble.follows(root)
+	count.follows(assemble)
+	return root, assemble, count
+
+
+class Run(Case):
+
+	def setUp(self):
+		self.backend = FakeBackend(results={'count-3': (1, '')}, polls=2)
+		self.runner = Runner(self.backend, max_jobs=5, interval=0)
+		self.workflows = [workflow(n) for n in range(20)]
+		[self.runner.add(w[0]) for w in self.workflows]
+
+class TestManyWorkflowsCase(Run):
+
+	def testManyWorkflows(self):
+		self.runner.run()
+		self.assertEqual(len(self.runner.finished), 19)
+		self.assertEqual(len(self.backend.submitted), 40)
+		self.assertLessEqual(self.backend.peak, 5)
+
+class TestFailureIsolatedCase(Run):
+
+	def testFailureIsolated(self):
+		self.runner.run()
+		root, assemble, count = self.workflows[3]
+		self.assertIsInstance(self.runner.failed[root], FatalException)
+		self.assertEqual(count.status, STATUS_FATAL)
+		self.assertEqual(self.workflows[4][2].status, STATUS_FINISH)
+
+class Refusing(FakeBackend):
+	"Can't submit one workflow's jobs, as when qsub rejects them."
+
+	def launch(self, task, command):
+		if task.slug == 'assemble-1':
+			raise OSError("qsub exited with status 1: Unable to run job")
+		return super(Refusing, self).launch(task, command)
+
+class TestLaunchFailedCase(Case):
+
+	def testLaunchFailed(self):
+		workflows = [workflow(n) for n in range(3)]
+		budget = ResourceBudget(cores=4)
+		runner = Runner(Refusing(), interval=0, budget=budget)
+		[runner.add(w[0]) for w in workflows]
+		runner.run()
+		root, assemble, count = workflows[1]
+		self.assertIsInstance(runner.failed[root], OSError)
+		self.assertEqual(assemble.status, STATUS_FATAL)
+		self.assertEqual(sorted([r.name for r in runner.finished]), ['Root 0', 'Root 2'])
+		self.assertEqual(budget.used[None], [0, 0])
+
+class TestCancelCase(Run):
+
+	def testCancel(self):
+		self.runner.step()
+		root, assemble, count = [w for w in self.workflows if w[1].status == STATUS_RUNNING][0]
+		self.runner.cancel(root)
+		self.runner.run()
+		self.assertEqual(len(self.backend.cancelled), 1)
+		self.assertEqual(assemble.status, STATUS_FATAL)
+		self.assertEqual(count.status, STATUS_PENDING)
+		self.assertNotIn(root, self.runner.finished)
+
+class TestBackoffCase(Case):
+
+	def testBackoff(self):
+		root, assemble, count = workflow(0)
+		runner = Runner(FakeBackend(durations={assemble.slug: 6}), interval=0.001, max_interval=0.004).add(root).run()
+		self.assertEqual(runner.finished, [root])
+		self.assertEqual(list(runner.waits), [0.001, 0.002, 0.004, 0.004])
+
+
+if __name__ == "__main__":
+	unittest.main()
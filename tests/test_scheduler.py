@@ -0,0 +1,80 @@
+import unittest
+from unittest import TestCase as Case
+from dag_core import *
+
+
+class Sched(Case):
+
+	def setUp(self):
+		self.A = A = AbstractTask("Root Task A")
+		self.B = B = AbstractTask("Task B")
+		self.C = C = AbstractTask("Task C")
+		self.D = D = AbstractTask("Task D")
+		self.E = E = AbstractTask("Task E")
+
+		A.is_root()
+
+		B.follows(A)
+		C.follows(A)
+		D.follows(B)
+		D.follows(C)
+		E.follows(D)
+		self.A.__get_next__()
+
+class TestIncrementalCase(Sched):
+
+	def testIncremental(self):
+		self.assertEqual(self.A.__get_next__(), set([self.A]))
+		self.A.status = STATUS_FINISH
+		self.assertEqual(self.A.__get_next__(), set([self.B, self.C]))
+		self.B.__setRunning__(1)
+		self.assertEqual(self.A.__get_next__(), set([self.B, self.C]))
+		self.B.status = STATUS_FINISH
+		self.assertEqual(self.A.__get_next__(), set([self.C]))
+		self.C.status = STATUS_FINISH
+		self.assertEqual(self.A.__get_next__(), set([self.D]))
+
+class TestIgnoredParentCase(Sched):
+
+	def testIgnoredParent(self):
+		self.A.status = STATUS_FINISH
+		self.B.status = STATUS_IGNORED
+		self.C.status = STATUS_FINISH
+		self.assertEqual(self.A.__get_next__(), set([self.D]))
+
+class TestIgnoredCascadeCase(Sched):
+
+	def testIgnoredCascade(self):
+		self.A.status = STATUS_FINISH
+		self.B.status = STATUS_IGNORED
+		self.C.status = STATUS_IGNORED
+		self.assertEqual(self.A.__get_next__(), set())
+		self.assertEqual(self.D.status, STATUS_IGNORED)
+		self.assertEqual(self.E.status, STATUS_IGNORED)
+
+class TestFatalCase(Sched):
+
+	def testFatal(self):
+		self.A.status = STATUS_FINISH
+		self.B.__setFatal__(ValueError())
+		self.assertRaises(FatalException, self.A.__get_next__)
+
+class TestResetCase(Sched):
+
+	def testReset(self):
+		self.A.status = STATUS_FINISH
+		self.A.__get_next__()
+		self.A.status = STATUS_PENDING
+		self.assertEqual(self.A.__get_next__(), set([self.A]))
+
+class TestGraphChangeCase(Sched):
+
+	def testGraphChange(self):
+		self.A.status = STATUS_FINISH
+		F = AbstractTask("Task F")
+		F.follows(self.A)
+		self.assertIn(F, self.A.__get_next__())
+
+
+if __name__ == "__main__":
+	unittest.main()
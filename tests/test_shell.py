@@ -0,0 +1,125 @@
+import os
+import shutil
+import signal
+import tempfile
+import threading
+import unittest
+from unittest import TestCase as Case
+from dag_core import *
+from dag_core.shell import SessionLost
+from dag_core.uge import UGE
+from dag_core.runner import Runner
+from dag_core.tests.test_uge import FAKE_QSUB, FAKE_QSTAT, FAKE_QACCT
+
+
+class Sh(Case):
+	"A local sh stands in for the submit host."
+
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.pool = ShellPool(['sh'])
+
+	def tearDown(self):
+		self.pool.close()
+		shutil.rmtree(self.dir)
+
+class TestRunCase(Sh):
+
+	def testRun(self):
+		self.assertEqual(self.pool.run(['echo', 'hello world']), (0, 'hello world\n', ''))
+		self.assertEqual(self.pool.run(['printf', 'no newline']), (0, 'no newline', ''))
+		self.assertEqual(self.pool.run(['sh', '-c', 'echo oops >&2; exit 3']), (3, '', 'oops\n'))
+		self.assertEqual(self.pool.run(['cat'], input="line one\n$HOME 'quoted'\n"), (0, "line one\n$HOME 'quoted'\n", ''))
+		self.assertEqual(self.pool.run(['cat']), (0, '', ''))
+
+class TestPipelineCase(Sh):
+
+	def testPipeline(self):
+		commands = [(['echo', str(i)], None) for i in range(2000)] + [(['sh', '-c', 'seq 100000'], None)]
+		results = self.pool.pipeline(commands)
+		self.assertEqual([out for _, out, _ in results[:-1]], ['{}\n'.format(i) for i in range(2000)])
+		self.assertEqual(len(results[-1][1].split()), 100000) #larger than a pipe buffer
+		metrics = self.pool.metrics()
+		self.assertEqual((metrics['connects'], metrics['round_trips'], metrics['commands']), (1, 1, 2001))
+
+class TestCarriageReturnCase(Sh):
+
+	def testCarriageReturn(self):
+		"stderr is read back by its size in bytes, so line endings mustn't be translated."
+		results = self.pool.pipeline([(['sh', '-c', 'printf "a\\r\\nb\\r\\n"; printf "c\\r\\n" >&2'], None), (['echo', 'next'], None)])
+		self.assertEqual(results, [(0, 'a\r\nb\r\n', 'c\r\n'), (0, 'next\n', '')])
+
+class TestReconnectCase(Sh):
+
+	def testReconnect(self):
+		self.pool.run(['true'])
+		with self.pool.session() as session:
+			os.kill(session.proc.pid, signal.SIGKILL)
+			session.proc.wait()
+		self.assertEqual(self.pool.run(['echo', 'back']), (0, 'back\n', ''))
+		self.assertEqual(self.pool.metrics()['reconnects'], 1)
+
+class TestLostCase(Sh):
+
+	def testLost(self):
+		flag = os.path.join(self.dir, 'flag')
+		dies_once = ['sh', '-c', 'test -e "$1" || { touch "$1"; kill -9 $PPID; }; echo ok', 'sh', flag]
+		self.assertRaises(SessionLost, self.pool.run, dies_once)
+		os.remove(flag)
+		self.assertEqual(self.pool.run(dies_once, idempotent=True), (0, 'ok\n', ''))
+		metrics = self.pool.metrics()
+		self.assertEqual((metrics['lost'], metrics['connects']), (2, 3))
+
+class TestSharedCase(Sh):
+
+	def testShared(self):
+		results = []
+		def work():
+			for i in range(10):
+				results.append(self.pool.run(['echo', str(i)]))
+		threads = [threading.Thread(target=work) for _ in range(6)]
+		[t.start() for t in threads]
+		[t.join() for t in threads]
+		self.assertEqual(len(results), 60)
+		self.assertTrue(all([status == 0 for status, _, _ in results]))
+		self.assertLessEqual(self.pool.metrics()['connects'], 2)
+
+class TestUGEOverPoolCase(Sh):
+
+	def testUGEOverPool(self):
+		for name, script in (('qsub', FAKE_QSUB), ('qstat', FAKE_QSTAT), ('qacct', FAKE_QACCT)):
+			with open(os.path.join(self.dir, name), 'w') as fake:
+				fake.write(script)
+			os.chmod(os.path.join(self.dir, name), 0o755)
+		uge = UGE(qsub=os.path.join(self.dir, 'qsub'), qstat=os.path.join(self.dir, 'qstat'), qacct=os.path.join(self.dir, 'qacct'), output_dir=self.dir, pool=self.pool)
+		with Workflow():
+			root = AbstractTask("Root")
+			tasks = [ClusterTask("Echo {}".format(i), "echo {}".format(i)) for i in range(5)]
+			[t.follows(root) for t in tasks]
+		Runner(uge, interval=0, scratch=self.dir).add(root).run()
+		self.assertEqual([t.status for t in tasks], [STATUS_FINISH] * 5)
+		self.assertEqual(self.pool.metrics()['connects'], 1)
+		self.assertEqual(uge.exit_statuses(['101', '102']), [0, 0])
+
+class TestBatchedLaunchCase(Sh):
+
+	def testBatchedLaunch(self):
+		"A step's qsubs go out in one round trip."
+		for name, script in (('qsub', FAKE_QSUB), ('qstat', FAKE_QSTAT), ('qacct', FAKE_QACCT)):
+			with open(os.path.join(self.dir, name), 'w') as fake:
+				fake.write(script)
+			os.chmod(os.path.join(self.dir, name), 0o755)
+		uge = UGE(qsub=os.path.join(self.dir, 'qsub'), qstat=os.path.join(self.dir, 'qstat'), qacct=os.path.join(self.dir, 'qacct'), pool=self.pool)
+		with Workflow():
+			root = AbstractTask("Root")
+			tasks = [ClusterTask("Echo {}".format(i), "echo {}".format(i)) for i in range(5)]
+			[t.follows(root) for t in tasks]
+		runner = Runner(uge, interval=0, scratch=self.dir).add(root)
+		uge.poll = lambda handles: {}
+		runner.step()
+		self.assertEqual(sorted([t.job_id for t in tasks]), ['101', '102', '103', '104', '105'])
+		self.assertEqual((self.pool.metrics()['round_trips'], self.pool.metrics()['commands']), (1, 5))
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,86 @@
+import unittest
+from unittest import TestCase as Case
+from dag_core import *
+from dag_core.template import Template
+
+
+def drive(run, outputs):
+	"Run every ready task to completion, with commands 'answered' from outputs."
+	while True:
+		ready = run.poll()
+		if not ready:
+			return run
+		for i in sorted(ready):
+			commands = run.start(i)
+			if run.state(i) == STATUS_FATAL:
+				continue
+			stdout = ''.join([outputs.get(c, '') for c in sorted(commands or ())])
+			run.finish(i, stdout, ['/path/to/{}.fasta'.format(i)])
+
+
+class Tem(Case):
+
+	def setUp(self):
+		self.A = A = AbstractTask("Record")
+		self.B = B = ClusterTask("Assemble", "spades.py --sample {sample}")
+		self.R = R = RegexTask("Parse", r"contigs_(?P<contigs>\d+)", stop_on_miss=True)
+		self.C = C = AbstractTask("Save")
+		self.E = E = AbstractTask("Report", file_filter="*.fasta")
+		self.F = F = AbstractTask("Publish")
+		B.follows(A)
+		R.follows(B)
+		C.follows(R)
+		C.follows(A)
+		E.follows(R).when('contigs', '3')
+		F.follows(E)
+		self.template = Template(A)
+		self.outputs = dict(('spades.py --sample {}'.format(n), 'contigs_{}\n'.format(n % 5)) for n in range(200))
+
+class TestManyRunsCase(Tem):
+
+	def testManyRuns(self):
+		runs = [drive(self.template.run(sample=n), self.outputs) for n in range(200)]
+		self.assertTrue(all([run.done() for run in runs]))
+		save = self.template.index[self.C]
+		self.assertIn(('sample', 7), runs[7].termargs[save])
+		self.assertIn(('contigs', '2'), runs[7].termargs[save])
+		self.assertEqual(runs[8].state(self.template.index[self.F]), STATUS_FINISH)
+		self.assertEqual(runs[8].input_files[self.template.index[self.E]], ['/path/to/{}.fasta'.format(self.template.index[self.R])])
+		self.assertEqual(self.B.status, STATUS_PENDING)
+		self.assertEqual(list(self.C.termargs), [])
+		self.assertFalse(hasattr(runs[0], '__dict__'))
+
+class TestIgnoredCase(Tem):
+
+	def testIgnored(self):
+		run = drive(self.template.run(sample=1), self.outputs)
+		self.assertEqual(run.state(self.template.index[self.E]), STATUS_IGNORED)
+		self.assertEqual(run.state(self.template.index[self.F]), STATUS_IGNORED)
+		self.assertEqual(run.state(self.template.index[self.C]), STATUS_FINISH)
+
+class TestFailedRunCase(Tem):
+
+	def testFailedRun(self):
+		run = self.template.run(sample=1000)
+		self.assertRaises(FatalException, drive, run, self.outputs)
+		self.assertEqual(run.state(self.template.index[self.R]), STATUS_FATAL)
+		self.assertEqual(self.R.status, STATUS_PENDING)
+
+class TestNullRootCase(Case):
+
+	def testNullRoot(self):
+		with Workflow():
+			N = NullTask()
+			B = ClusterTask("Assemble", "spades.py --sample {sample}")
+			B.follows(N)
+		template = Template(N)
+		run = template.run(sample=3)
+		self.assertEqual(run.poll(), set([template.index[B]]))
+		drive(run, {'spades.py --sample 3': 'contigs_3\n'})
+		self.assertTrue(run.done())
+		self.assertEqual(run.state(template.index[N]), STATUS_FINISH)
+		self.assertIn(('sample', 3), run.termargs[template.index[B]])
+
+
+if __name__ == "__main__":
+	unittest.main()
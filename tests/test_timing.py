@@ -0,0 +1,73 @@
+import json
+import unittest
+from unittest import TestCase as Case
+from dag_core import *
+from dag_core.runner import Runner, FakeBackend
+
+
+class Tim(Case):
+
+	def setUp(self):
+		with Workflow():
+			self.A = A = AbstractTask("Record")
+			self.B = B = ClusterTask("Assemble", "spades.py")
+			self.C = C = ClusterTask("Quick", "echo contigs_3")
+			self.R = R = RegexTask("Parse", r"contigs_(?P<contigs>\d+)")
+			self.D = D = ClusterTask("Count", "grep -c '>'")
+			B.follows(A)
+			C.follows(A)
+			R.follows(C)
+			D.follows(B)
+			D.follows(R)
+		self.backend = FakeBackend(results={'quick': (0, 'contigs_3\n')}, polls=1)
+		self.timings = Timings().attach(A)
+
+	def drive(self):
+		Runner(self.backend, interval=0).add(self.A).run()
+
+class TestPhasesCase(Tim):
+
+	def testPhases(self):
+		self.drive()
+		phases = self.timings.totals()
+		for phase in ('poll', 'start', 'stdout', 'job', 'finalize'):
+			self.assertIn(phase, phases)
+		self.assertEqual(len([s for s in self.timings.spans if s[1] == 'job']), 3)
+		self.assertEqual(set([s[0] for s in self.timings.spans if s[1] == 'finalize']), set([self.A, self.B, self.C, self.R, self.D]))
+		report = self.timings.report()
+		self.assertEqual(report['critical_path'][0]['task'], 'record')
+		self.assertEqual(report['critical_path'][-1]['task'], 'count')
+		self.assertGreaterEqual(report['elapsed'], report['critical_path'][-1]['ended'])
+
+class TestQueueRunCase(Tim):
+
+	def testQueueRun(self):
+		self.timings.mark(self.B, 'submitted', 1.0)
+		self.timings.mark(self.B, 'running', 3.0)
+		self.timings.mark(self.B, 'done', 7.0)
+		self.assertEqual(self.timings.totals(), {'queue': 2.0, 'run': 4.0})
+
+class TestChromeTraceCase(Tim):
+
+	def testChromeTrace(self):
+		self.backend.results['count'] = (1, '')
+		self.drive()
+		trace = json.loads(json.dumps(self.timings.chrome_trace()))
+		events = trace['traceEvents']
+		names = dict((e['tid'], e['args']['name']) for e in events if e['ph'] == 'M')
+		self.assertEqual(sorted(names.values()), sorted([t.name for t in (self.A, self.B, self.C, self.R, self.D)] + ['scheduler']))
+		self.assertTrue(all([e['dur'] >= 0 and e['ts'] >= 0 for e in events if e['ph'] == 'X']))
+		self.assertIn(('fatal', 'Count'), [(e['name'], names[e['tid']]) for e in events if e['ph'] == 'i'])
+
+class TestDisabledCase(Case):
+
+	def testDisabled(self):
+		with Workflow() as wf:
+			A = AbstractTask("Record")
+			ClusterTask("Assemble", "spades.py").follows(A)
+		Runner(FakeBackend(), interval=0).add(A).run()
+		self.assertIsNone(wf.timings)
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,150 @@
+import unittest
+import os
+import shutil
+import subprocess
+import tempfile
+from unittest import TestCase as Case
+from dag_core import *
+from dag_core.uge import UGE
+from dag_core.runner import Runner
+
+FAKE_QSUB = """#!/bin/sh
+cd "$(dirname "$0")"
+id=$(( $(cat counter 2>/dev/null || echo 100) + 1 ))
+echo $id > counter
+cat > job.$id
+echo "$@" > args.$id
+out=$(echo "$*" | sed -n 's/.*-o \\([^ ]*\\).*/\\1/p')
+if [ -n "$out" ]; then
+	sh job.$id > "$out/STDIN.o$id"
+else
+	touch running.$id
+fi
+case "$*" in
+	*-t*) echo "$id.$(echo "$*" | sed 's/.*-t \\([^ ]*\\).*/\\1/'):1" ;;
+	*) echo $id ;;
+esac
+"""
+
+FAKE_QSTAT = """#!/bin/sh
+cd "$(dirname "$0")"
+echo x >> qstat.calls
+test -e unreachable && exit 255
+echo "job-ID  prior   name       user         state submit/start at     queue          slots ja-task-ID"
+echo "-----------------------------------------------------------------------------------------------"
+for f in running.*; do
+	test -e "$f" || continue
+	echo "    ${f#running.} 0.55500 STDIN      user         r     01/01/2024 10:00:00 all.q@node1    1"
+done
+"""
+
+FAKE_QACCT = """#!/bin/sh
+echo "exit_status  0"
+"""
+
+LAGGING_QACCT = """#!/bin/sh
+cd "$(dirname "$0")"
+test -e "accounted.$2" || { echo "error: job id $2 not found" >&2; exit 1; }
+cat "accounted.$2"
+"""
+
+INPUTS = ['/path/to/{}.fastq'.format(n) for n in range(5)]
+
+
+class Arr(Case):
+
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		for name, script in (('qsub', FAKE_QSUB), ('qstat', FAKE_QSTAT), ('qacct', FAKE_QACCT)):
+			with open(os.path.join(self.dir, name), 'w') as fake:
+				fake.write(script)
+			os.chmod(os.path.join(self.dir, name), 0o755)
+		self.T = ClusterTask("Array Task", "echo {input}", array=True, chunk_size=2)
+		self.T.input_files = list(INPUTS)
+		self.uge = UGE(qsub=os.path.join(self.dir, 'qsub'), qstat=os.path.join(self.dir, 'qstat'), qacct=os.path.join(self.dir, 'qacct'))
+
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+
+class TestArrayCommandCase(Arr):
+
+	def testArrayCommand(self):
+		commands = self.T.start(manifest_dir=self.dir)
+		self.assertEqual(len(commands), 1)
+		self.assertEqual(self.T.array_size, 3)
+		with open(self.T.manifest) as manifest:
+			self.assertEqual(manifest.read(), '\t'.join(INPUTS[0:2]) + '\n' + '\t'.join(INPUTS[2:4]) + '\n' + INPUTS[4] + '\n')
+
+class TestArrayElementCase(Arr):
+
+	def testArrayElement(self):
+		command, = self.T.start(manifest_dir=self.dir)
+		env = dict(os.environ, SGE_TASK_ID='2')
+		out = subprocess.check_output(['sh', '-c', command], env=env, universal_newlines=True)
+		self.assertEqual(out.split(), INPUTS[2:4])
+
+class TestArraySubmitCase(Arr):
+
+	def testArraySubmit(self):
+		job_id = self.uge.submit(self.T, manifest_dir=self.dir)
+		self.assertEqual(job_id, '101')
+		self.assertEqual(self.T.status, STATUS_RUNNING)
+		with open(os.path.join(self.dir, 'args.101')) as args:
+			self.assertIn('-t 1-3', args.read())
+		self.assertFalse(self.uge.finished(job_id))
+		os.remove(os.path.join(self.dir, 'running.101'))
+		self.assertTrue(self.uge.finished(job_id))
+
+class TestBulkPollCase(Arr):
+
+	def testBulkPoll(self):
+		for job in ('101', '102', '103'):
+			open(os.path.join(self.dir, 'running.' + job), 'w').close()
+		self.assertEqual(self.uge.live(), set(['101', '102', '103']))
+		os.remove(os.path.join(self.dir, 'running.102'))
+		calls = os.path.join(self.dir, 'qstat.calls')
+		os.remove(calls)
+		self.assertEqual(sorted(self.uge.poll(['101', '102', '103', '104'])), ['102', '104'])
+		with open(calls) as f:
+			self.assertEqual(len(f.readlines()), 1) #one query a poll, however many jobs
+		self.assertFalse(self.uge.finished('101,102'))
+		self.assertTrue(self.uge.finished('102,104'))
+
+class TestAccountingLagCase(Arr):
+
+	def testAccountingLag(self):
+		with open(self.uge.qacct, 'w') as fake:
+			fake.write(LAGGING_QACCT)
+		self.uge.accounting_polls = 3
+		self.assertIsNone(self.uge.exit_status('101'))
+		self.assertEqual(self.uge.poll(['101', '102']), {}) #gone from qstat, but not accounted for yet
+		self.assertEqual(self.uge.poll(['101', '102']), {})
+		with open(os.path.join(self.dir, 'accounted.101'), 'w') as record:
+			record.write("exit_status  3\n")
+		results = self.uge.poll(['101', '102'])
+		self.assertEqual(results['101'][0], 3)
+		self.assertEqual(results['102'][0], 1)
+		self.assertIn('no record of job 102', results['102'][2])
+		self.assertEqual(self.uge.unaccounted, {})
+
+class TestUnreachableCase(Arr):
+
+	def testUnreachable(self):
+		open(os.path.join(self.dir, 'unreachable'), 'w').close()
+		self.assertIsNone(self.uge.live())
+		self.assertEqual(self.uge.poll(['101']), {})
+		self.assertFalse(self.uge.finished('101'))
+
+class TestRunnerBackendCase(Arr):
+
+	def testRunnerBackend(self):
+		self.uge.output_dir = self.dir
+		R = RegexTask("Count", r"(?P<last>\S+4\.fastq)")
+		R.follows(self.T)
+		Runner(self.uge, interval=0, scratch=self.dir).add(self.T).run()
+		self.assertEqual(R.status, STATUS_FINISH)
+		self.assertIn(('last', INPUTS[4]), R.termargs)
+
+
+if __name__ == "__main__":
+	unittest.main()
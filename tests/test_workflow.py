@@ -0,0 +1,96 @@
+import threading
+import unittest
+from unittest import TestCase as Case
+from dag_core import *
+from dag_core.runner import Runner, FakeBackend
+
+
+def build(n):
+	with Workflow() as wf:
+		root = AbstractTask("Root {}".format(n))
+		assemble = ClusterTask("Assemble {}".format(n), "spades.py -k {}".format(n))
+		count = ClusterTask("Count {}".format(n), "grep -c {}".format(n))
+		assemble.follows(root)
+		count.follows(assemble)
+	return wf, root, count
+
+
+def threads(target, n):
+	workers = [threading.Thread(target=target, args=(i,)) for i in range(n)]
+	[w.start() for w in workers]
+	[w.join() for w in workers]
+
+
+class TestIsolatedCase(Case):
+
+	def testIsolated(self):
+		results, errors = {}, []
+		def go(i):
+			try:
+				wf, root, count = build(i)
+				Runner(FakeBackend(polls=1), interval=0).add(root).run()
+				results[i] = (wf, root, count)
+			except Exception as e:
+				errors.append(e)
+		threads(go, 16)
+		self.assertEqual(errors, [])
+		for i, (wf, root, count) in results.items():
+			self.assertIs(wf.root, root)
+			self.assertEqual(count.status, STATUS_FINISH)
+			self.assertEqual(sorted(wf.command_log), sorted(["spades.py -k {}".format(i), "grep -c {}".format(i)]))
+
+class TestDefaultPerThreadCase(Case):
+
+	def testDefaultPerThread(self):
+		seen = {}
+		def go(i):
+			seen[i] = current_workflow()
+		threads(go, 4)
+		self.assertEqual(len(set([id(wf) for wf in seen.values()])), 4)
+		self.assertNotIn(current_workflow(), seen.values())
+
+class TestConcurrentDeliveryCase(Case):
+
+	def testConcurrentDelivery(self):
+		with Workflow():
+			root = AbstractTask("Root")
+			child = AbstractTask("Child")
+			parents = [AbstractTask("Parent {}".format(i)) for i in range(32)]
+			add_edges([(root, p) for p in parents] + [(p, child) for p in parents])
+		def go(i):
+			parents[i].__finalize__(None, 'out{}\n'.format(i), ['file{}.fasta'.format(i)])
+		threads(go, len(parents))
+		self.assertEqual(sorted(child.input_files), sorted(['file{}.fasta'.format(i) for i in range(32)]))
+		self.assertEqual(len(child.stdin.splitlines()), 32)
+
+class TestDeliverBeforeFinishCase(Case):
+
+	def testDeliverBeforeFinish(self):
+		with Workflow():
+			root = AbstractTask("Root")
+			kept, skipped = AbstractTask("Kept"), AbstractTask("Skipped")
+			kept.follows(root)
+		polled, during = [], []
+		poller = threading.Thread(target=lambda: polled.append(root.__get_next__()))
+		def condition(**k):
+			poller.start()
+			poller.join(0.2)
+			during.append((root.status, poller.is_alive()))
+			return False
+		skipped.follows(root).when(condition)
+		root.__finalize__(None, 'contigs\n', ['contigs.fasta'])
+		self.assertEqual(during, [(STATUS_PENDING, True)]) #delivered before finishing, with pollers held off
+		poller.join()
+		self.assertEqual(polled, [set([kept])])
+		self.assertEqual((kept.stdin, kept.input_files), ('contigs\n', ['contigs.fasta']))
+		self.assertEqual(skipped.status, STATUS_IGNORED)
+
+	def testWorkflowOrder(self):
+		with Workflow() as wf:
+			tasks = [AbstractTask("Task {}".format(i)) for i in range(3)]
+		self.assertEqual([t.__order__ for t in tasks], [0, 1, 2]) #numbered by their own workflow
+		self.assertEqual(next(wf.ids), 3)
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,149 @@
+from collections import defaultdict
+
+try:
+	from time import monotonic as clock
+except ImportError: #python 2
+	from timeit import default_timer as clock
+
+#moments that end a task's time on the cluster
+_ENDS = ('done', 'fatal')
+#phases spent on the workflow as a whole, recorded against the root they polled from
+_SCHEDULER = ('poll',)
+
+
+class _Untimed(object):
+	"Stands in for a span when nothing's being timed."
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		return False
+
+untimed = _Untimed()
+
+
+class _Span(object):
+
+	def __init__(self, timings, task, phase):
+		self.timings, self.task, self.phase = timings, task, phase
+
+	def __enter__(self):
+		self.began = clock()
+		return self
+
+	def __exit__(self, *exc):
+		self.timings.span(self.task, self.phase, self.began, clock())
+		return False
+
+
+class Timings(object):
+	"""
+	Where in its lifecycle each task of a workflow spent its time. Once attached
+	to a workflow, its tasks record the time they spend polling the scheduler
+	('poll'), reading their predecessors' output ('stdout'), binding and rendering
+	commands ('start') and finalizing ('finalize'), and when they were submitted
+	and ended. Time between submission and the end is 'job', or 'queue' and 'run'
+	if a backend marks when the job started running.
+
+	Tasks in workflows without Timings pay a call and an attribute check per phase.
+	"""
+
+	def __init__(self):
+		self.spans = [] #(task, phase, start, end)
+		self.instants = [] #(task, event, time)
+		self.marks = defaultdict(dict) #task -> {event: time}
+
+	def attach(self, root):
+		"Time every task in the workflow root belongs to."
+		root.__workflow__.timings = self
+		return self
+
+	def phase(self, task, phase):
+		return _Span(self, task, phase)
+
+	def span(self, task, phase, start, end):
+		self.spans.append((task, phase, start, end))
+
+	def mark(self, task, event, when=None):
+		"Note a moment in a task's life: 'submitted', 'running' (for backends that can tell), 'done' or 'fatal'."
+		when = clock() if when is None else when
+		self.instants.append((task, event, when))
+		marks = self.marks[task]
+		marks[event] = when
+		if event in _ENDS and 'submitted' in marks:
+			submitted = marks.pop('submitted')
+			running = marks.pop('running', None)
+			if running is None:
+				self.span(task, 'job', submitted, when)
+			else:
+				self.span(task, 'queue', submitted, running)
+				self.span(task, 'run', running, when)
+
+	def origin(self):
+		return min([s[2] for s in self.spans] + [i[2] for i in self.instants] or [0.0])
+
+	def totals(self):
+		"Seconds spent in each phase, over all tasks."
+		totals = defaultdict(float)
+		for task, phase, start, end in self.spans:
+			totals[phase] += end - start
+		return dict(totals)
+
+	def __extents__(self):
+		"When each task's recorded life began and ended."
+		extents = dict()
+		for task, phase, start, end in self.spans:
+			if phase in _SCHEDULER:
+				continue
+			began, ended = extents.get(task, (start, end))
+			extents[task] = (min(began, start), max(ended, end))
+		for task, event, when in self.instants:
+			began, ended = extents.get(task, (when, when))
+			extents[task] = (min(began, when), max(ended, when))
+		return extents
+
+	def critical_path(self):
+		"""
+		The chain of tasks that held up the end of the run: from the task that ended
+		last, back through whichever of each task's parents ended last, to a root.
+		"""
+		extents = self.__extents__()
+		if not extents:
+			return []
+		t = max(extents, key=lambda task: extents[task][1])
+		path = [t]
+		while True:
+			parents = [p for p in t.__parents__ if p in extents]
+			if not parents:
+				return path[::-1]
+			t = max(parents, key=lambda p: extents[p][1])
+			path.append(t)
+
+	def report(self):
+		"Total seconds in each phase, and the critical path with when each task on it began and ended and its phases."
+		origin, extents = self.origin(), self.__extents__()
+		phases = defaultdict(lambda: defaultdict(float))
+		for task, phase, start, end in self.spans:
+			if phase not in _SCHEDULER:
+				phases[task][phase] += end - start
+		path = [dict(task=t.slug, began=extents[t][0] - origin, ended=extents[t][1] - origin, phases=dict(phases[t]))
+				for t in self.critical_path()]
+		elapsed = max([e[1] for e in extents.values()] or [origin]) - origin
+		return dict(elapsed=elapsed, phases=self.totals(), critical_path=path)
+
+	def chrome_trace(self):
+		"Trace-event JSON for chrome://tracing or Perfetto: a row per task, a slice per phase, and a row for polling."
+		origin, rows, events = self.origin(), dict(), []
+		us = lambda seconds: round(seconds * 1e6, 3)
+		for task, phase, start, end in self.spans:
+			tid = 0 if phase in _SCHEDULER else rows.setdefault(task, len(rows) + 1)
+			events.append(dict(name=phase, cat='task', ph='X', pid=1, tid=tid, ts=us(start - origin), dur=us(end - start), args=dict(task=task.slug)))
+		for task, event, when in self.instants:
+			tid = rows.setdefault(task, len(rows) + 1)
+			events.append(dict(name=event, cat='task', ph='i', s='t', pid=1, tid=tid, ts=us(when - origin), args=dict(task=task.slug)))
+		for task, tid in rows.items():
+			events.append(dict(name='thread_name', ph='M', pid=1, tid=tid, args=dict(name=task.name)))
+		if any([e['tid'] == 0 for e in events]):
+			events.append(dict(name='thread_name', ph='M', pid=1, tid=0, args=dict(name='scheduler')))
+		return dict(traceEvents=events, displayTimeUnit='ms')
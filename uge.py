@@ -0,0 +1,175 @@
+import glob
+import os
+import re
+import subprocess
+from tasks import STATUS_FINISH
+from runner import Backend
+from resources import requested
+from shell import ShellPool
+
+
+class UGE(Backend):
+	"""
+	Submits the commands a task renders to Univa Grid Engine and checks on them by
+	job id. A ClusterTask in array mode goes in as a single 'qsub -t' task array.
+
+	With ssh set, every qsub/qstat/qacct/qdel runs on that submit host, over a pool
+	of sessions kept open between calls (or over pool, a ShellPool, if given). As a
+	Runner backend, job output is read back from output_dir, which has to be on a
+	filesystem shared with the cluster.
+
+	A task's cores go in as a request for that many slots of parallel environment pe,
+	and its mem, divided between them, as mem_resource, which UGE counts per slot.
+
+	Accounting lags a job leaving qstat, so a job isn't reported done until qacct has
+	its exit status. One qacct still knows nothing about after accounting_polls polls
+	is reported failed.
+	"""
+
+	def __init__(self, qsub='qsub', qstat='qstat', options=(), ssh=None, qacct='qacct', qdel='qdel', output_dir=None, pe='smp', mem_resource='h_vmem', pool=None, accounting_polls=10):
+		self.qsub = qsub
+		self.qstat = qstat
+		self.qacct = qacct
+		self.qdel = qdel
+		self.options = list(options)
+		self.ssh = ssh
+		self.output_dir = output_dir
+		self.pe = pe
+		self.mem_resource = mem_resource
+		if pool is None and ssh:
+			pool = ShellPool(['ssh', '-T', ssh, 'sh'])
+		self.pool = pool
+		self.accounting_polls = accounting_polls
+		self.unaccounted = dict() #job id -> polls since it left qstat with no accounting record
+
+	def __run__(self, commands, idempotent=True):
+		"(exit status, stdout, stderr) of each (args, input), in one round trip if there's a pool."
+		if not commands:
+			return []
+		if self.pool is not None:
+			try:
+				return self.pool.pipeline(commands, idempotent)
+			except OSError as e:
+				return [(255, '', str(e))] * len(commands)
+		results = []
+		for args, input in commands:
+			try:
+				proc = subprocess.Popen(args, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+			except OSError as e:
+				results.append((127, '', str(e)))
+				continue
+			out, err = proc.communicate(input)
+			results.append((proc.returncode, out, err))
+		return results
+
+	def __resources__(self, task):
+		"qsub options asking for the cores and memory a task declares."
+		cores, mem = requested(task)
+		options = ['-pe', self.pe, str(cores)] if cores > 1 else []
+		if mem:
+			options.extend(['-l', '{}={:g}G'.format(self.mem_resource, float(mem) / cores)])
+		return options
+
+	def __submission__(self, command, array_size=None, resources=()):
+		"The qsub (args, input) that submits a command."
+		args = [self.qsub, '-terse'] + self.options + list(resources)
+		if self.output_dir:
+			args.extend(['-o', self.output_dir, '-e', self.output_dir])
+		if array_size:
+			args.extend(['-t', '1-{}'.format(array_size)])
+		return args, command + '\n'
+
+	def __job_id__(self, status, out, err):
+		if status:
+			raise OSError("qsub exited with status {}: {}".format(status, err.strip()))
+		return out.strip().split('.')[0] #task arrays come back as '1234.1-10:1'
+
+	def __qsub__(self, command, array_size=None, resources=()):
+		[result] = self.__run__([self.__submission__(command, array_size, resources)], idempotent=False) #a retried qsub could submit twice
+		return self.__job_id__(*result)
+
+	def submit(self, task, **kwargs):
+		"Render and submit a task's commands, then mark it running under the resulting job id(s)."
+		commands = task.start(**kwargs)
+		if not commands:
+			task.status = STATUS_FINISH #nothing to run
+			return None
+		array_size = task.array_size if getattr(task, 'array', False) else None
+		try:
+			job_ids = [self.__qsub__(c, array_size, self.__resources__(task)) for c in sorted(commands)]
+		except OSError as e:
+			task.__setFatal__(e)
+			return None
+		task.__setRunning__(','.join(job_ids))
+		return task.job_id
+
+	def live(self):
+		"Ids of every job qstat still lists, from a single query; None if qstat couldn't be asked."
+		[(status, out, err)] = self.__run__([([self.qstat], None)])
+		if status:
+			return None
+		return set(re.findall(r'^\s*(\d+)\s', out, re.M)) #task arrays list a row per element, under one id
+
+	def finished(self, job_id, live=None):
+		"Jobs are finished once qstat no longer lists them; a task array once every element is done."
+		live = self.live() if live is None else live
+		if live is None:
+			return False
+		return not any([job in live for job in str(job_id).split(',')])
+
+	def exit_statuses(self, job_ids):
+		"Worst exit status qacct reports over each job's tasks, asked all at once; None if accounting has nothing yet."
+		results = self.__run__([([self.qacct, '-j', str(job_id)], None) for job_id in job_ids])
+		statuses = []
+		for status, out, _ in results:
+			found = [int(s) for s in re.findall(r'^exit_status\s+(\d+)', out, re.M)]
+			statuses.append(max(found) if found and not status else None) #e.g. 'job id not found' until it's written
+		return statuses
+
+	def exit_status(self, job_id):
+		return self.exit_statuses([job_id])[0]
+
+	def __output__(self, job_id, stream):
+		if not self.output_dir:
+			return ''
+		text = []
+		pattern = os.path.join(self.output_dir, '*.{}{}'.format(stream, job_id))
+		for path in sorted(glob.glob(pattern) + glob.glob(pattern + '.*')): #task arrays add .<task id>
+			with open(path) as output:
+				text.append(output.read())
+		return ''.join(text)
+
+	def launch(self, task, command):
+		return self.__qsub__(command, task.array_size if getattr(task, 'array', False) else None, self.__resources__(task))
+
+	def launch_all(self, launches):
+		"Every qsub in one round trip over the pool."
+		submissions = [self.__submission__(command, task.array_size if getattr(task, 'array', False) else None, self.__resources__(task)) for task, command in launches]
+		handles = []
+		for result in self.__run__(submissions, idempotent=False):
+			try:
+				handles.append(self.__job_id__(*result))
+			except OSError as e:
+				handles.append(e)
+		return handles
+
+	def poll(self, handles):
+		"One qstat covers every outstanding job; accounting and output are read for just the ones that are done."
+		live = self.live()
+		if live is None: #e.g. the submit host didn't answer; ask again next time
+			return {}
+		done, results = [job for job in handles if self.finished(job, live)], dict()
+		for job, status in zip(done, self.exit_statuses(done)):
+			if status is None:
+				missed = self.unaccounted[job] = self.unaccounted.get(job, 0) + 1
+				if missed < self.accounting_polls:
+					continue #ask again next poll
+				results[job] = (1, self.__output__(job, 'o'), "qacct has no record of job {} after {} polls".format(job, missed))
+			else:
+				results[job] = (status, self.__output__(job, 'o'), self.__output__(job, 'e'))
+			self.unaccounted.pop(job, None)
+		return results
+
+	def cancel(self, handle):
+		self.unaccounted.pop(handle, None)
+		self.__run__([([self.qdel, str(handle)], None)])